@@ -0,0 +1,92 @@
+"""
+Benchmark of the html parser backends of the crawlers (crawlers.HTML_PARSERS) against the original parsing:
+a full html.parser tree of the page and a scan of all of its <tr> rows.
+parse time and peak memory are reported for every page. the memory is measured by tracemalloc, which sees the
+python allocations only: the tree of lxml lives in libxml2 and is not counted.
+
+    python benchmarks/bench_parsers.py
+    python benchmarks/bench_parsers.py --tgju saved/tgju.html --iranjib saved/iranjib.html
+"""
+
+import argparse
+import sys
+import timeit
+import tracemalloc
+from bs4 import BeautifulSoup
+
+sys.path.append("src")
+
+from data_tools import PriceData, translate_prices
+from crawlers import HTML_PARSERS, parse_car_prices, parse_tgju_prices
+
+
+def parse_tgju_original(html: str):
+    soup = BeautifulSoup(html, "html.parser")
+    prices = []
+    for sec in soup.find_all("tr"):
+        name = sec.get("data-market-nameslug")
+        price = sec.get("data-price")
+        try:
+            prices.append(PriceData(code=name, source="tgju", price_high=float(price.replace(",", ""))))
+        except Exception:
+            pass
+    return translate_prices(prices)
+
+
+def parse_car_original(html: str):
+    soup = BeautifulSoup(html, "html.parser")
+    prices = []
+    for tr in soup.find_all("tr"):
+        try:
+            tds = tr.find_all("td")
+            code = tds[0].a.text
+            pr_market, pr_factory = 0, 0
+            try:
+                pr_market = float(tds[1].span.text.replace(",", ""))
+                pr_factory = float(tds[2].span.text.replace(",", ""))
+            except AttributeError:
+                pass
+            if pr_market == 0 and pr_factory == 0:
+                continue
+            prices.append(PriceData(code=code, source="iranjib", price_high=pr_market, price_low=pr_factory))
+        except Exception:
+            pass
+    return translate_prices(prices)
+
+
+def peak_memory(func) -> int:
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main(pages: dict, repeat: int):
+    for name, (path, original, parse) in pages.items():
+        with open(path, encoding="utf-8") as f:
+            html = f.read()
+        cases = {"html.parser, all rows (original)": lambda: original(html)}
+        for parser in HTML_PARSERS:
+            cases[parser] = lambda parser=parser: parse(html, parser)
+        expected = [p.code for p in original(html)]
+        print(f"{name}: {path} ({len(html) / 1024:.0f} KiB)")
+        for case, func in cases.items():
+            assert [p.code for p in func()] == expected
+            best = min(timeit.repeat(func, number=1, repeat=repeat))
+            print(f"{case:>34}: {best * 1000:8.2f} ms  peak memory {peak_memory(func) / 1024:8.0f} KiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tgju", default="tests/fixtures/tgju_currency.html", help="saved currency page of tgju.org")
+    parser.add_argument("--iranjib", default="tests/fixtures/iranjib_car.html", help="saved car page of iranjib.ir")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    main(
+        {
+            "tgju": (args.tgju, parse_tgju_original, parse_tgju_prices),
+            "iranjib": (args.iranjib, parse_car_original, parse_car_prices),
+        },
+        args.repeat,
+    )
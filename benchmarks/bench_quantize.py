@@ -0,0 +1,54 @@
+"""
+Micro-benchmark of the batched time bucketing (data_tools.quantize_datetimes) against the original
+per-timestamp loop that quantize_datetime used to run.
+
+    python benchmarks/bench_quantize.py --n 100000
+"""
+
+import argparse
+import sys
+import timeit
+from datetime import datetime, timedelta
+import numpy as np
+
+sys.path.append("src")
+
+from data_tools import quantize_datetimes
+
+
+def quantize_datetime_loop(dt: datetime, quantize_level: float = 0.25) -> float:
+    # the original implementation: a fresh np.arange and a linear search for every timestamp
+    def quantize_num(num, qlist):
+        for i in range(len(qlist) - 1):
+            if num >= qlist[i] and num < qlist[i + 1]:
+                return qlist[i]
+        return qlist[-1]
+
+    float_time = dt.hour + dt.minute / 60
+    qlist = np.arange(start=0, stop=24, step=quantize_level)
+    return quantize_num(float_time, qlist)
+
+
+def main(n: int, repeat: int):
+    start = datetime(2024, 5, 1)
+    dts = [start + timedelta(minutes=13 * i) for i in range(n)]
+    array = np.array(dts, dtype="datetime64[s]")
+    assert quantize_datetimes(dts).tolist() == [quantize_datetime_loop(dt) for dt in dts]
+
+    cases = {
+        "loop (original)": lambda: [quantize_datetime_loop(dt) for dt in dts],
+        "batched, datetime list": lambda: quantize_datetimes(dts),
+        "batched, datetime64 array": lambda: quantize_datetimes(array),
+    }
+    print(f"{n} timestamps, quantize_level=0.25")
+    for name, func in cases.items():
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        print(f"{name:>28}: {best * 1000:10.2f} ms  ({best / n * 1e9:8.1f} ns/timestamp)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--n", type=int, default=100000, help="number of timestamps")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    main(args.n, args.repeat)
@@ -0,0 +1,110 @@
+"""
+Benchmark of the cpu time to build the /get_prices body of all codes from the stored records, without compression
+(which is the same for all cases):
+
+- original: json records, decoded into validated PriceData and serialized through a PricesPayload.
+- snapshot, all changed: binary records (storage_tools) reloaded by cache_tools.PriceSnapshotCache, each one decoded
+  and rendered, and the body spliced from the rendered prices.
+- snapshot, one changed: the same after a submission of one price, the other records are neither decoded nor
+  rendered again.
+
+    python benchmarks/bench_render.py
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from datetime import datetime
+from unittest import mock
+
+sys.path.append("src")
+
+from data_tools import MAIN_CODES, PriceData, PricesPayload
+from storage_tools import encode_price
+import cache_tools
+
+
+def sample_prices():
+    now = datetime.now().isoformat()
+    return [
+        PriceData(
+            code=code,
+            category=category,
+            description=description,
+            source="bonbast",
+            price_high=60000 + i * 1.5,
+            price_low=59000 + i,
+            price_high_change=0.25,
+            price_low_change=-0.5,
+            time=now,
+        )
+        for i, (code, (category, description)) in enumerate(MAIN_CODES.items())
+    ]
+
+
+class IdentityRendered(cache_tools.RenderedPrices):
+    # the uncompressed body only, the bodies must never be compressed while timing
+    def __init__(self, fragments, last_modified=0, **kwargs):
+        super().__init__(fragments, last_modified, **kwargs)
+        self._compressors = {}
+
+
+def render_original(records):
+    prices = [PriceData.model_validate_json(r) for r in records]
+    return PricesPayload(prices=prices).model_dump_json().encode("utf-8")
+
+
+def best_time(func, repeat: int, number: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - t0) / number)
+    return min(times)
+
+
+def main(repeat: int, number: int):
+    prices = sample_prices()
+    json_records = [p.model_dump_json().encode() for p in prices]
+    all_changed = [[encode_price(p.model_copy(update={"price_low": n})) for p in prices] for n in range(2)]
+    one_changed = [[encode_price(p) for p in prices] for _ in range(2)]
+    one_changed[1][0] = encode_price(prices[0].model_copy(update={"price_high": 1}))
+
+    loop = asyncio.new_event_loop()
+
+    def snapshot_case(versions):
+        state = {"n": 0}
+
+        async def loader():
+            state["n"] += 1
+            return versions[state["n"] % 2]
+
+        cache = cache_tools.PriceSnapshotCache(loader)
+        loop.run_until_complete(cache.refresh())
+
+        def run():
+            loop.run_until_complete(cache.refresh())
+            return cache.rendered[()].bodies["identity"]
+
+        return run
+
+    with mock.patch.object(cache_tools, "RenderedPrices", IdentityRendered):
+        cases = {
+            "original": lambda: render_original(json_records),
+            "snapshot, all changed": snapshot_case(all_changed),
+            "snapshot, one changed": snapshot_case(one_changed),
+        }
+        assert cases["snapshot, one changed"]() == render_original([p.model_dump_json() for p in prices])
+        print(f"{len(prices)} codes")
+        for case, func in cases.items():
+            print(f"{case:>24}: {best_time(func, repeat, number) * 1e6:8.1f} µs")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+    main(args.repeat, args.number)
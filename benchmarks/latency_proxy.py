@@ -0,0 +1,70 @@
+"""
+TCP proxy adding latency in front of a server, to run the load test against a redis with the round-trip time of a
+deployment, where redis is on another host. every chunk of data is forwarded `--delay` milliseconds after it's
+received, in each direction, so a round-trip takes 2 * delay more. for example, a redis 2 ms away:
+
+    python benchmarks/latency_proxy.py --listen 6380 --target localhost:6379 --delay 1
+    REDIS_PORT=6380 uvicorn app:app --port 10000
+"""
+
+import argparse
+import asyncio
+import time
+
+
+async def forward(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, delay: float):
+    queue = asyncio.Queue()
+
+    async def deliver():
+        while True:
+            due, data = await queue.get()
+            if data is None:
+                break
+            wait = due - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            writer.write(data)
+            await writer.drain()
+
+    delivery = asyncio.create_task(deliver())
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            queue.put_nowait((time.monotonic() + delay, data))
+        queue.put_nowait((0, None))
+        await delivery
+    finally:
+        delivery.cancel()
+        writer.close()
+
+
+async def main(args):
+    host, port = args.target.rsplit(":", 1)
+    delay = args.delay / 1000
+
+    async def handle(client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter):
+        try:
+            server_reader, server_writer = await asyncio.open_connection(host, int(port))
+        except OSError:
+            client_writer.close()
+            return
+        await asyncio.gather(
+            forward(client_reader, server_writer, delay),
+            forward(server_reader, client_writer, delay),
+            return_exceptions=True,
+        )
+
+    server = await asyncio.start_server(handle, "127.0.0.1", args.listen)
+    print(f"forwarding 127.0.0.1:{args.listen} to {args.target} with {args.delay} ms of latency each way")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--listen", type=int, default=6380, help="port to listen on")
+    parser.add_argument("--target", default="localhost:6379", help="host:port of the server")
+    parser.add_argument("--delay", type=float, default=1, help="milliseconds added in each direction")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,89 @@
+"""
+Load test for a running Nerkh API server.
+
+Fires /get_prices requests from many concurrent clients and reports throughput and latency percentiles
+for each concurrency level. /get_prices is served from the in-process snapshot of the prices, so to load redis,
+--endpoint history requests the last day of history, which is read from redis on every request. for example:
+
+    python benchmarks/load_test.py --url http://localhost:10000 --concurrency 1 10 100 1000
+    python benchmarks/load_test.py --endpoint history --codes USD-TMN EUR-TMN
+
+run the server with the rate limits disabled (RATE_LIMIT_GET_PRICES=0, RATE_LIMIT_HISTORY=0), and against a redis
+with the round-trip time of the deployment, see latency_proxy.py.
+"""
+
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+import aiohttp
+import numpy as np
+
+
+def request_of(endpoint: str, codes: list) -> tuple:
+    """
+    path and json body of the requests to an endpoint.
+    """
+    if endpoint == "history":
+        start = datetime.now(timezone.utc) - timedelta(days=1)
+        return "/history", {"codes": codes, "start": start.isoformat(), "bucket": "1h"}
+    return "/get_prices", {"codes": codes}
+
+
+async def run_level(url: str, concurrency: int, n_requests: int, codes: list, endpoint: str = "get_prices") -> dict:
+    path, body = request_of(endpoint, codes)
+    latencies = []
+    n_errors = 0
+    queue = asyncio.Queue()
+    for _ in range(n_requests):
+        queue.put_nowait(None)
+
+    async def client(session: aiohttp.ClientSession):
+        nonlocal n_errors
+        while not queue.empty():
+            queue.get_nowait()
+            start_time = time.perf_counter()
+            try:
+                async with session.post(f"{url}{path}", json=body) as response:
+                    await response.read()
+                    if response.status != 200:
+                        n_errors += 1
+            except aiohttp.ClientError:
+                n_errors += 1
+            latencies.append(time.perf_counter() - start_time)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start_time = time.perf_counter()
+        await asyncio.gather(*[client(session) for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start_time
+
+    latencies = np.array(latencies) * 1000
+    return {
+        "concurrency": concurrency,
+        "requests": n_requests,
+        "errors": n_errors,
+        "rps": n_requests / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+async def main(args):
+    print(f"{'concurrency':>12} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for concurrency in args.concurrency:
+        n_requests = max(args.requests, concurrency)
+        r = await run_level(args.url, concurrency, n_requests, args.codes, args.endpoint)
+        print(
+            f"{r['concurrency']:>12} {r['requests']:>9} {r['errors']:>7} {r['rps']:>9.1f} {r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:10000")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100, 500, 1000])
+    parser.add_argument("--requests", type=int, default=2000, help="requests per concurrency level")
+    parser.add_argument("--codes", nargs="*", default=[], help="codes to request. all codes by default")
+    parser.add_argument("--endpoint", choices=["get_prices", "history"], default="get_prices")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,274 @@
+"""
+Benchmark suite of the hot paths, with machine-readable results to compare between commits.
+
+the app is run in-process (ASGI, no network) against redis, like in production: the redis of the environment
+(.env or the environment variables, on the database of CURRENT_BRANCH="benchmark" so the prices of main and
+development are never touched), or with --fakeredis a fakeredis server started by the suite. the rate limits are
+disabled. every benchmark is run `--repeat` times `--number` calls, the statistics are of the time of one call.
+
+    python benchmarks/suite.py --fakeredis --output before.json
+    python benchmarks/suite.py --fakeredis --output after.json --compare before.json
+    python benchmarks/suite.py --compare before.json after.json --threshold 0.15
+    python benchmarks/suite.py --fakeredis --only get_prices
+
+with --compare, the exit status is 1 if a benchmark is slower than the baseline by more than the threshold
+(on the median), so the suite can guard a CI job.
+"""
+
+import argparse
+import asyncio
+import inspect
+import json
+import os
+import platform
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.append("src")
+
+FIXTURES = "tests/fixtures"
+
+
+def start_fakeredis() -> int:
+    """
+    start a fakeredis server in a background thread and return its port.
+    """
+    from fakeredis import TcpFakeServer
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = TcpFakeServer(("127.0.0.1", port), server_type="redis")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return port
+
+
+def configure_environment(fakeredis: bool):
+    # must run before the app (and its settings) is imported
+    if fakeredis:
+        os.environ.update(REDIS_HOST="127.0.0.1", REDIS_PORT=str(start_fakeredis()), REDIS_PASSWORD="")
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ["CURRENT_BRANCH"] = "benchmark"
+    for endpoint in ("GET_PRICES", "HISTORY", "SUBMIT_PRICES", "STREAM"):
+        os.environ[f"RATE_LIMIT_{endpoint}"] = "0"
+
+
+def read_fixture(name: str) -> str:
+    with open(f"{FIXTURES}/{name}", encoding="utf-8") as f:
+        return f.read()
+
+
+def sample_prices(n_version: int = 0):
+    from data_tools import MAIN_CODES, PriceData
+
+    now = datetime.now(timezone.utc).isoformat()
+    return [
+        PriceData(code=code, source="benchmark", price_high=60000 + i + n_version, price_low=59000 + i, time=now)
+        for i, code in enumerate(MAIN_CODES)
+    ]
+
+
+def micro_benchmarks() -> dict:
+    """
+    benchmarks of pure functions: name: function.
+    """
+    from data_tools import quantize_datetime, quantize_datetimes, source_translate_dicts, translate_prices
+    from crawlers import HTML_PARSERS, parse_car_prices, parse_tgju_prices
+    from storage_tools import decode_price, encode_price
+
+    bonbast_codes = list(source_translate_dicts["bonbast"])
+    raw_prices = [(c, "bonbast", 60000, 59000, "") for c in bonbast_codes]
+    start = datetime(2024, 5, 1)
+    times = [start + timedelta(minutes=13 * i) for i in range(10000)]
+    price = sample_prices()[0]
+    record = encode_price(price)
+    tgju_html, car_html = read_fixture("tgju_currency.html"), read_fixture("iranjib_car.html")
+
+    benchmarks = {
+        f"translate_prices[{len(raw_prices)}]": lambda: translate_prices(raw_prices),
+        f"quantize_datetimes[{len(times)}]": lambda: quantize_datetimes(times),
+        "quantize_datetime": lambda: quantize_datetime(times[1]),
+        "encode_price": lambda: encode_price(price),
+        "decode_price": lambda: decode_price(record),
+    }
+    for parser in HTML_PARSERS:
+        benchmarks[f"parse_tgju_prices[{parser}]"] = lambda parser=parser: parse_tgju_prices(tgju_html, parser)
+        benchmarks[f"parse_car_prices[{parser}]"] = lambda parser=parser: parse_car_prices(car_html, parser)
+    return benchmarks
+
+
+def app_benchmarks(client, token: str) -> dict:
+    """
+    benchmarks of the endpoints, through an httpx client of the app: name: coroutine function.
+    """
+    from data_tools import MAIN_CODES
+
+    subset = list(MAIN_CODES)[:5]
+    # alternated, so every submission changes the prices
+    versions = [{"prices": [p.model_dump() for p in sample_prices(n)]} for n in range(2)]
+    counter = {"submissions": 0}
+
+    def get_prices(codes, accept_encoding="identity"):
+        async def request():
+            headers = {"Accept-Encoding": accept_encoding}
+            response = await client.post("/get_prices", json={"codes": codes}, headers=headers)
+            assert response.status_code == 200, response.text
+
+        return request
+
+    async def get_prices_cacheable():
+        response = await client.get("/prices", headers={"Accept-Encoding": "br"})
+        assert response.status_code == 200, response.text
+
+    async def submit_prices():
+        counter["submissions"] += 1
+        payload = versions[counter["submissions"] % 2]
+        response = await client.post("/submit_prices", json=payload, headers={"token": token})
+        assert response.status_code == 200, response.text
+
+    return {
+        "get_prices[all]": get_prices([]),
+        "get_prices[all,gzip]": get_prices([], "gzip"),
+        "get_prices[all,br]": get_prices([], "br"),
+        f"get_prices[{len(subset)}]": get_prices(subset),
+        "GET /prices[all,br]": get_prices_cacheable,
+        f"submit_prices[{len(MAIN_CODES)}]": submit_prices,
+    }
+
+
+async def measure(func, number: int, repeat: int) -> dict:
+    """
+    time `repeat` rounds of `number` calls, after one warm-up call.
+
+    Returns:
+        dict: statistics of the time of one call, in microseconds.
+    """
+    is_async = inspect.iscoroutinefunction(func)
+    rounds = []
+    for i in range(repeat + 1):
+        t0 = time.perf_counter()
+        for _ in range(number if i else 1):
+            if is_async:
+                await func()
+            else:
+                func()
+        if i:
+            rounds.append((time.perf_counter() - t0) / number * 1e6)
+    return {
+        "median_us": statistics.median(rounds),
+        "min_us": min(rounds),
+        "stdev_us": statistics.stdev(rounds) if len(rounds) > 1 else 0.0,
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+async def run(args) -> dict:
+    configure_environment(args.fakeredis)
+    import httpx
+    from app import app
+    from authentication_tools import generate_token
+
+    only = re.compile(args.only) if args.only else None
+    results = {}
+
+    async def run_benchmarks(benchmarks: dict):
+        for name, func in benchmarks.items():
+            if only and not only.search(name):
+                continue
+            results[name] = await measure(func, args.number, args.repeat)
+            print(f"{name:>32}: {results[name]['median_us']:10.1f} µs  (min {results[name]['min_us']:.1f})")
+
+    await run_benchmarks(micro_benchmarks())
+    async with app.router.lifespan_context(app):
+        await app.state.redis.flushdb()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            token = generate_token("benchmark")
+            # some prices to read
+            payload = {"prices": [p.model_dump() for p in sample_prices()]}
+            response = await client.post("/submit_prices", json=payload, headers={"token": token})
+            assert response.status_code == 200, response.text
+            await run_benchmarks(app_benchmarks(client, token))
+        await app.state.redis.flushdb()
+
+    return {"meta": metadata(args), "results": results}
+
+
+def metadata(args) -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout
+        commit = commit.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "redis": "fakeredis" if args.fakeredis else os.environ.get("REDIS_HOST"),
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> bool:
+    """
+    print the change of every benchmark against the baseline.
+
+    Returns:
+        bool: whether some benchmark regressed by more than the threshold.
+    """
+    print(f"baseline {baseline['meta'].get('commit')} -> current {current['meta'].get('commit')}")
+    regressed = False
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            print(f"{name:>32}: {result['median_us']:10.1f} µs  (new)")
+            continue
+        change = result["median_us"] / base["median_us"] - 1
+        flag = ""
+        if change > threshold:
+            flag, regressed = "  REGRESSION", True
+        print(f"{name:>32}: {base['median_us']:10.1f} -> {result['median_us']:10.1f} µs  {change:+7.1%}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fakeredis", action="store_true", help="run against a fakeredis server")
+    parser.add_argument("--only", help="run the benchmarks whose name matches this regular expression")
+    parser.add_argument("--number", type=int, default=50, help="calls per round")
+    parser.add_argument("--repeat", type=int, default=5, help="rounds")
+    parser.add_argument("--output", help="save the results to this json file")
+    parser.add_argument(
+        "--compare",
+        nargs="+",
+        metavar="JSON",
+        help="baseline results, and optionally the results to compare with instead of running the suite",
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.10, help="relative slowdown of a median reported as a regression"
+    )
+    args = parser.parse_args()
+
+    if args.compare and len(args.compare) > 1:
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+    else:
+        current = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        sys.exit(1 if compare(baseline, current, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,64 +1,172 @@
 import sys
-import requests
+import asyncio
+import argparse
 from dotenv import load_dotenv
 import os
-from typing import List
+import httpx
+from typing import List, Tuple
 from fastapi import FastAPI
 
 sys.path.append("src")
 
-from data_tools import PriceData, PricesPayload
-from crawlers import get_bonbast_prices, get_car_prices
+from data_tools import PriceData
+from crawlers import CRAWLER_SOURCES, CrawlCache, CrawlResult, create_client, crawl_all, run_schedules
+from submit_tools import SubmittedSnapshot, SubmitTarget, fetch_assets, submit_all
+from metrics_tools import metrics_response
+from prometheus_client import start_http_server
 
 
 load_dotenv()
 
 NERKH_TOKEN = os.environ["NERKH_TOKEN"]
 
-
-# Function to post a list of PriceData to a URL
-def post_data(url: str, prices: List[PriceData]):
-    json_data = PricesPayload(prices=prices).model_dump()
-    response = requests.post(url, headers={"token": NERKH_TOKEN}, json=json_data)
-    return response
+# validators of the crawled pages and digests of the submitted prices, to skip unchanged sources
+CRAWLER_CACHE_DIR = os.environ.get("CRAWLER_CACHE_DIR", ".crawler_cache")
+# last submitted prices, only the changed ones are submitted
+SUBMITTER_SNAPSHOT_PATH = os.environ.get(
+    "SUBMITTER_SNAPSHOT_PATH", os.path.join(CRAWLER_CACHE_DIR, "submitter", "snapshot.json")
+)
+# seconds between two submissions of all prices (heartbeat)
+SUBMITTER_FULL_SYNC_INTERVAL = float(os.environ.get("SUBMITTER_FULL_SYNC_INTERVAL", 6 * 60 * 60))
+# /assets endpoint of a server to follow its asset catalog, for example "https://nerkh-api-dev.liara.run/assets".
+# by default, the catalog of src/assets.json is used.
+NERKH_ASSETS_URL = os.environ.get("NERKH_ASSETS_URL", "")
+# seconds between two reloads of the catalog, with --schedule
+SUBMITTER_ASSETS_INTERVAL = float(os.environ.get("SUBMITTER_ASSETS_INTERVAL", 60 * 60))
 
 
 app = FastAPI()
 
 
-nerkh_server_urls = [
-    # "https://nerkh-api.liara.run/submit_prices",  # for liara
-    "https://nerkh-api-dev.liara.run/submit_prices",  # for liara-dev
-    # "http://localhost:8000/submit_prices",  # for local machine
-    # "http://0.0.0.0:10000/submit_prices", # for docker
+nerkh_servers = [
+    # SubmitTarget(url="https://nerkh-api.liara.run/submit_prices_delta"),  # for liara
+    SubmitTarget(url="https://nerkh-api-dev.liara.run/submit_prices_delta"),  # for liara-dev
+    # SubmitTarget(url="http://localhost:8000/submit_prices_delta", timeout=5),  # for local machine
+    # SubmitTarget(url="http://0.0.0.0:10000/submit_prices_delta", timeout=5), # for docker
 ]
 
 
-def main(crawler_func) -> str:
-    prices = crawler_func()
-    result = ""
-    for url in nerkh_server_urls:
-        # Post the data to the URL
-        response = post_data(url, prices)
+async def submit(client: httpx.AsyncClient, prices: List[PriceData]) -> Tuple[bool, str]:
+    # post the prices to all servers concurrently. returns whether all posts succeeded and a report of them
+    results = await submit_all(client, nerkh_servers, prices, NERKH_TOKEN)
+    report = ""
+    for r in results:
         # Check the response
-        success = "Success" if response.status_code == 200 else "Failed"
-        result = (
-            result + "\n" + f"{success} data post to {url}. Status code: {response.status_code}, response: {response.text}"
-        )
-
+        success = "Success" if r.ok else "Failed"
+        status = f"Status code: {r.status_code}, response: {r.response}" if r.status_code else f"error: {r.error}"
+        report = report + "\n" + f"{success} data post to {r.url} after {r.attempts} attempts in {r.elapsed:.2f}s. {status}"
+    return all(r.ok for r in results), report
+
+
+async def update_assets(client: httpx.AsyncClient) -> str:
+    # reload the asset catalog from NERKH_ASSETS_URL, if set. returns a report of the failure
+    if not NERKH_ASSETS_URL:
+        return ""
+    error = await fetch_assets(client, NERKH_ASSETS_URL)
+    if not error:
+        return ""
+    return "\n" + f"Failed to load the asset catalog from {NERKH_ASSETS_URL}, the previous one is used: {error}"
+
+
+def open_state() -> Tuple[SubmittedSnapshot, CrawlCache]:
+    snapshot = SubmittedSnapshot(SUBMITTER_SNAPSHOT_PATH)
+    cache = CrawlCache(CRAWLER_CACHE_DIR)
+    if not snapshot.values:
+        # not modified pages would have nothing to submit: crawl them unconditionally
+        cache.clear()
+    return snapshot, cache
+
+
+async def main(sources: List[str]) -> str:
+    # crawl all sources concurrently and submit their changed prices at once, over the same pooled client
+    snapshot, cache = open_state()
+    async with create_client() as client:
+        result = await update_assets(client)
+        results = await crawl_all([CRAWLER_SOURCES[s] for s in sources], client, cache)
+        prices, crawled, full_synced = [], [], []
+        for crawl in results.values():
+            if crawl.error:
+                result = result + "\n" + f"Failed to crawl {crawl.source} after {crawl.attempts} attempts: {crawl.error}"
+                continue
+            full_sync = snapshot.full_sync_due(crawl.source, SUBMITTER_FULL_SYNC_INTERVAL)
+            prices += snapshot.to_submit(crawl, full_sync)
+            crawled.append(crawl)
+            if full_sync:
+                full_synced.append(crawl.source)
+        if prices:
+            ok, report = await submit(client, prices)
+            result = result + report
+            if not ok:
+                return result
+            snapshot.update(prices, full_synced)
+        else:
+            result = result + "\n" + "No changes."
+    for crawl in crawled:
+        cache.commit(crawl)
     return result
 
 
+async def submit_on_schedule(sources: List[str]):
+    """
+    crawl every source on its own interval (CrawlerSource.interval) and submit its changed prices, until interrupted.
+    """
+    snapshot, cache = open_state()
+    async with create_client() as client:
+
+        async def on_result(crawl: CrawlResult):
+            if crawl.error:
+                print(f"Failed to crawl {crawl.source} after {crawl.attempts} attempts: {crawl.error}")
+                return
+            full_sync = snapshot.full_sync_due(crawl.source, SUBMITTER_FULL_SYNC_INTERVAL)
+            prices = snapshot.to_submit(crawl, full_sync)
+            if prices:
+                ok, report = await submit(client, prices)
+                print(f"{crawl.source}:{report}")
+                if not ok:
+                    return
+                snapshot.update(prices, [crawl.source] if full_sync else [])
+            cache.commit(crawl)
+
+        async def follow_assets():
+            while True:
+                report = await update_assets(client)
+                if report:
+                    print(report.strip())
+                await asyncio.sleep(SUBMITTER_ASSETS_INTERVAL)
+
+        assets_task = asyncio.create_task(follow_assets()) if NERKH_ASSETS_URL else None
+        try:
+            await run_schedules(on_result, [CRAWLER_SOURCES[s] for s in sources], client, cache)
+        finally:
+            if assets_task is not None:
+                assets_task.cancel()
+
+
 @app.get("/update_bonbast")
-def update_bonbast() -> str:
-    return main(get_bonbast_prices)
+async def update_bonbast() -> str:
+    return await main(["bonbast"])
 
 
 @app.get("/update_car")
-def update_car() -> str:
-    return main(get_car_prices)
+async def update_car() -> str:
+    return await main(["iranjib"])
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    # prometheus metrics of the crawlers
+    return metrics_response()
 
 
 if __name__ == "__main__":
-    print(update_bonbast())
-    print(update_car())
+    parser = argparse.ArgumentParser(description="crawl prices and submit them to the nerkh servers.")
+    parser.add_argument("--sources", nargs="+", default=["bonbast", "iranjib"], choices=list(CRAWLER_SOURCES))
+    parser.add_argument("--schedule", action="store_true", help="keep crawling every source on its own interval.")
+    parser.add_argument("--metrics-port", type=int, help="serve the prometheus metrics of the crawlers on this port.")
+    args = parser.parse_args()
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+    if args.schedule:
+        asyncio.run(submit_on_schedule(args.sources))
+    else:
+        print(asyncio.run(main(args.sources)))
@@ -0,0 +1,159 @@
+"""
+aggregation of the prices of a code reported by several sources.
+
+the latest price of every source (a quote) is kept per code, in the "{code}:sources" hash (source: record, in the
+binary format of storage_tools), and the published "{code}:current" price is computed from the quotes by a policy:
+
+- "priority": the quote of the first source in the priority list, so a second source only fills in when the
+  preferred one is stale. sources missing from the list come last, the freshest first.
+- "freshest": the latest quote.
+- "median": the median of the prices of all quotes, at the time of the latest one. its source is the list of the
+  sources of the quotes, for example "bonbast,tgju".
+
+before a policy is applied, quotes older than `max_age` seconds relative to the latest quote are dropped, and with
+3 quotes or more, so are the outliers: the quotes whose price_high deviates from the median by more than
+`outlier_threshold` (relative). a code reported by one source is published as reported.
+
+`read_with_quotes` reads the quotes of many codes, with other keys, in one round-trip.
+"""
+
+import statistics
+import redis.asyncio as redis
+from typing import Dict, List, Sequence, Tuple, Union
+from data_tools import MAIN_CODES, PriceData
+from history_tools import price_timestamp
+
+AGGREGATION_POLICIES = ("priority", "freshest", "median")
+
+# KEYS: the keys to read with MGET, then the quotes hashes. ARGV[1]: number of the MGET keys.
+# returns {values of the MGET keys, {field, value, ...} of every hash}.
+READ_WITH_QUOTES_SCRIPT = """
+local n = tonumber(ARGV[1])
+local result = {redis.call("MGET", unpack(KEYS, 1, n))}
+for i = n + 1, #KEYS do
+    result[#result + 1] = redis.call("HGETALL", KEYS[i])
+end
+return result
+"""
+
+
+def sources_key(code: str) -> str:
+    return f"{code}:sources"
+
+
+async def read_with_quotes(
+    client: Union[redis.Redis, redis.client.Pipeline], keys: List[str], codes: List[str]
+) -> Tuple[List[Union[bytes, None]], List[Dict[bytes, bytes]]]:
+    """
+    read some keys and the quotes of some codes in one round-trip, with a lua script.
+
+    Args:
+        client (Union[redis.Redis, redis.client.Pipeline]): connection to redis database, or a pipeline in immediate
+            mode (after WATCH), so the reads are on the watching connection.
+        keys (List[str]): keys to read, at least one.
+        codes (List[str]): codes whose quotes are read.
+
+    Returns:
+        Tuple[List[Union[bytes, None]], List[Dict[bytes, bytes]]]: values of the keys, and quotes of the codes
+            (source: record).
+    """
+    # EVAL and not EVALSHA: a missing script would be an error reply in the middle of the transaction
+    values, *hashes = await client.eval(
+        READ_WITH_QUOTES_SCRIPT, len(keys) + len(codes), *keys, *map(sources_key, codes), len(keys)
+    )
+    return values, [dict(zip(h[::2], h[1::2])) for h in hashes]
+
+
+def _timestamp(price: PriceData) -> float:
+    try:
+        return price_timestamp(price)[0]
+    except ValueError:
+        return 0  # no time, or not an iso time: the oldest
+
+
+class PriceAggregator:
+    """
+    policies of the aggregation of the quotes of a code, see the module docstring.
+    """
+
+    def __init__(
+        self,
+        policy: str = "priority",
+        category_policies: Union[Dict[str, str], None] = None,
+        priority: Sequence[str] = (),
+        max_age: float = 3600,
+        outlier_threshold: float = 0.1,
+    ):
+        """
+        Args:
+            policy (str, optional): policy of the codes, one of AGGREGATION_POLICIES. Defaults to "priority".
+            category_policies (Union[Dict[str, str], None], optional): policy of the codes of some categories,
+                instead of `policy`. Defaults to None.
+            priority (Sequence[str], optional): sources in order of preference, for the "priority" policy.
+                Defaults to ().
+            max_age (float, optional): quotes older than this many seconds before the latest quote are ignored.
+                Defaults to 3600.
+            outlier_threshold (float, optional): relative deviation from the median of an outlier. 0 keeps all
+                quotes. Defaults to 0.1.
+
+        Raises:
+            ValueError: if a policy is unknown.
+        """
+        self.policy = policy
+        self.category_policies = dict(category_policies or {})
+        for p in [policy, *self.category_policies.values()]:
+            if p not in AGGREGATION_POLICIES:
+                raise ValueError(f"unknown aggregation policy '{p}'. valid policies: {AGGREGATION_POLICIES}.")
+        self.priority = {source: i for i, source in enumerate(priority)}
+        self.max_age = max_age
+        self.outlier_threshold = outlier_threshold
+
+    def policy_of(self, code: str) -> str:
+        category, _ = MAIN_CODES.get(code, ("", ""))
+        return self.category_policies.get(category, self.policy)
+
+    def aggregate(self, code: str, quotes: Dict[str, PriceData]) -> PriceData:
+        """
+        compute the published price of a code.
+
+        Args:
+            code (str): code of the asset.
+            quotes (Dict[str, PriceData]): latest price of each source. must not be empty.
+
+        Returns:
+            PriceData: the published price, a new object.
+        """
+        if len(quotes) == 1:
+            return next(iter(quotes.values())).model_copy()
+        timestamps = {source: _timestamp(q) for source, q in quotes.items()}
+        latest = max(timestamps.values())
+        candidates = [q for source, q in quotes.items() if latest - timestamps[source] <= self.max_age]
+        candidates = self._reject_outliers(candidates)
+
+        policy = self.policy_of(code)
+        if policy == "median":
+            freshest = max(candidates, key=lambda q: timestamps[q.source])
+            return freshest.model_copy(
+                update={
+                    "source": ",".join(sorted(q.source for q in candidates)),
+                    "price_high": statistics.median(q.price_high for q in candidates),
+                    "price_low": statistics.median(q.price_low for q in candidates),
+                    "price_high_change": 0,
+                    "price_low_change": 0,
+                }
+            )
+        if policy == "priority":
+            unranked = len(self.priority)
+            best = min(candidates, key=lambda q: (self.priority.get(q.source, unranked), -timestamps[q.source]))
+        else:
+            best = max(candidates, key=lambda q: timestamps[q.source])
+        return best.model_copy()
+
+    def _reject_outliers(self, quotes: List[PriceData]) -> List[PriceData]:
+        if self.outlier_threshold <= 0 or len(quotes) < 3:
+            return quotes
+        median = statistics.median(q.price_high for q in quotes)
+        if median == 0:
+            return quotes
+        kept = [q for q in quotes if abs(q.price_high - median) <= self.outlier_threshold * abs(median)]
+        return kept or quotes
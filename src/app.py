@@ -1,52 +1,217 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, Depends, status, Header, Response
-from typing import Union
-from data_tools import PriceData, PricesPayload, CodesPayload, MAIN_CODES, is_prices_same_day
-import redis
+from fastapi import FastAPI, HTTPException, Depends, status, Header, Request, Response, WebSocket, WebSocketException
+from fastapi.requests import HTTPConnection
+from fastapi.responses import RedirectResponse, StreamingResponse
+from typing import Union, List, Tuple, Dict
+from data_tools import (
+    PriceData,
+    PricesPayload,
+    PricesDeltaPayload,
+    CodesPayload,
+    HistoryPayload,
+    AssetsPayload,
+    ASSETS,
+    CODES_BY_CATEGORY,
+    MAIN_CODES,
+    expand_prices,
+    is_prices_same_day,
+)
+import redis.asyncio as redis
 from settings import *
-from authentication_tools import validate_token
+from catalog_tools import listen_for_catalog_updates, reload_assets
+from authentication_tools import TokenCache, is_token_revoked, listen_for_revocations, validate_token
+from pool_tools import FairConnectionPool
+from ratelimit_tools import RateLimiter, client_ip, parse_trusted_proxies
+from aggregation_tools import PriceAggregator, read_with_quotes, sources_key
+from cache_tools import PriceSnapshotCache, RenderedPrices, publish_prices_update, listen_for_prices_updates
+from stream_tools import PriceStream, PriceStreamHub
+from storage_tools import decode_price, encode_price, migrate_legacy_prices
+from compression_tools import CompressionMiddleware, RequestDecompressionMiddleware, choose_encoding
+from metrics_tools import RATE_LIMITED, SUBMITTED_PRICES, InstrumentedRedis, MetricsMiddleware, metrics_response
+from history_tools import (
+    HISTORY_RESOLUTIONS,
+    aggregate_buckets,
+    bucket_key,
+    bucket_start,
+    decode_buckets,
+    encode_tick,
+    format_history,
+    index_key,
+    merge_tick,
+    parse_bucket_size,
+    price_timestamp,
+    stored_resolution,
+    ticks_key,
+)
+import numpy as np
+import math
+import time
+import asyncio
+import logging
 import json
-from datetime import datetime
-import gzip
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # connect to redis db
+    # connect to redis db. requests wait for a connection in their order of arrival, see pool_tools
+    pool = FairConnectionPool(
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        password=REDIS_PASSWORD,
+        db=REDIS_INDEX,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+    )
     try:
-        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=REDIS_INDEX)
-        r.ping()  # Test if the connection is working by sending a PING command
+        r = InstrumentedRedis(connection_pool=pool)
+        await r.ping()  # Test if the connection is working by sending a PING command
     except redis.ConnectionError:
         raise redis.ConnectionError("Failed to connect to Redis database")
     app.state.redis = r
+
+    # the asset catalog stored in redis, if any, reloaded via redis pub/sub when it's changed
+    try:
+        await reload_assets(r)
+    except ValueError:
+        logger.exception("Invalid asset catalog in redis, the one of the assets file is used")
+
+    # rewrite the prices stored as json by the previous versions in the binary format
+    await migrate_legacy_prices([f"{c}:{day}" for c in MAIN_CODES for day in ("current", "yesterday")], r)
+
+    # in-process snapshot of current prices, refreshed via redis pub/sub when prices are submitted
+    app.state.price_cache = PriceSnapshotCache(
+        lambda: get_records_from_db([f"{c}:current" for c in MAIN_CODES], r, missing_ok=True),
+        max_staleness=PRICE_CACHE_MAX_STALENESS,
+        max_rendered=PRICE_CACHE_MAX_RENDERED,
+        gzip_level=COMPRESSION_GZIP_LEVEL,
+        brotli_quality=COMPRESSION_BROTLI_QUALITY,
+    )
+    # streams of /stream and /stream/ws, fed with the updated prices of every refresh of the snapshot
+    app.state.price_streams = PriceStreamHub(max_streams=STREAM_MAX_CONNECTIONS)
+
+    def publish_to_streams(codes: List[str]):
+        fragments = app.state.price_cache.fragments
+        app.state.price_streams.publish({c: fragments[c] for c in codes if c in fragments})
+
+    listener = asyncio.create_task(listen_for_prices_updates(r, app.state.price_cache, on_update=publish_to_streams))
+    # the codes of the snapshot follow the catalog
+    catalog_listener = asyncio.create_task(listen_for_catalog_updates(r, on_update=app.state.price_cache.invalidate))
+
+    # verified tokens, revoked ones are dropped via redis pub/sub
+    app.state.token_cache = TokenCache(max_size=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL)
+    revocations_listener = asyncio.create_task(listen_for_revocations(r, app.state.token_cache))
+
+    app.state.rate_limiter = RateLimiter(r, RATE_LIMITS)
     yield
+    listener.cancel()
+    catalog_listener.cancel()
+    revocations_listener.cancel()
     # disconnect from redis db
-    app.state.redis.close()
+    await app.state.redis.aclose(close_connection_pool=True)
 
 
 app = FastAPI(lifespan=lifespan)
 
-
-def authenticate_token(token: str = Header(...)) -> bool:
+# aggregation of the quotes of the sources into the published prices
+price_aggregator = PriceAggregator(
+    policy=AGGREGATION_POLICY,
+    category_policies=AGGREGATION_CATEGORY_POLICIES,
+    priority=SOURCE_PRIORITY,
+    max_age=QUOTE_MAX_AGE,
+    outlier_threshold=QUOTE_OUTLIER_THRESHOLD,
+)
+# proxies whose X-Forwarded-For is trusted for the ips of the anonymous clients
+trusted_proxies = parse_trusted_proxies(TRUSTED_PROXIES)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=COMPRESSION_MINIMUM_SIZE,
+    gzip_level=COMPRESSION_GZIP_LEVEL,
+    brotli_quality=COMPRESSION_BROTLI_QUALITY,
+    zstd_level=COMPRESSION_ZSTD_LEVEL,
+)
+app.add_middleware(RequestDecompressionMiddleware, max_size=REQUEST_MAX_DECOMPRESSED_SIZE)
+app.add_middleware(MetricsMiddleware, routes=app.routes)
+
+
+async def authenticate_token(request: Request, token: str = Header(...)) -> bool:
     """
-    Function to authenticate the user with a token.
+    Function to authenticate the user with a token. verified tokens are cached, so they're not verified again
+    on every request.
 
     Args:
         token (str, optional): your token
 
     Raises:
-        HTTPException: _description_
+        HTTPException: if the token is invalid, expired or revoked.
 
     Returns:
         bool: successfull authorization
     """
+    token_cache = request.app.state.token_cache
+    request.state.token_subject = token_cache.get(token)
+    if request.state.token_subject is not None:
+        return True
     token_status = validate_token(token)
     if not token_status[0]:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=token_status[1])
+    if await is_token_revoked(token, request.app.state.redis):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token has been revoked")
+    token_cache.put(token, token_status[2], token_status[3])
+    request.state.token_subject = token_status[2]
     return True
 
 
-def get_price_from_db(key: str, redisdb: redis.Redis) -> PriceData:
+def rate_limit(endpoint: str, authenticated: bool = False):
+    """
+    dependency limiting the requests of each client to an endpoint, see RATE_LIMITS in settings.py.
+    authenticated clients are identified by the subject of their token, the others by their ip, forwarded by the
+    TRUSTED_PROXIES (see `ratelimit_tools.client_ip`).
+
+    Args:
+        endpoint (str): name of the endpoint in RATE_LIMITS.
+        authenticated (bool, optional): the endpoint needs a token. the limit then depends on authenticate_token,
+            so it runs after the token is verified. the token is verified once per request, even if the endpoint
+            depends on authenticate_token too. Defaults to False.
+
+    Raises:
+        HTTPException: 429 with a Retry-After header if the client has exceeded its limit.
+        WebSocketException: 1013 (try again later) for a websocket.
+    """
+
+    async def dependency(connection: HTTPConnection):
+        subject = getattr(connection.state, "token_subject", None)
+        if subject is not None:
+            client = f"sub:{subject}"
+        else:
+            peer = connection.client.host if connection.client else "unknown"
+            forwarded_for = ", ".join(connection.headers.getlist("x-forwarded-for"))
+            client = f"ip:{client_ip(peer, forwarded_for, trusted_proxies)}"
+        retry_after = await connection.app.state.rate_limiter.hit(endpoint, client)
+        if retry_after <= 0:
+            return
+        RATE_LIMITED.labels(endpoint).inc()
+        if connection.scope["type"] == "websocket":
+            raise WebSocketException(code=status.WS_1013_TRY_AGAIN_LATER, reason="Too many requests")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+
+    async def authenticated_dependency(connection: HTTPConnection, _: bool = Depends(authenticate_token)):
+        await dependency(connection)
+
+    return authenticated_dependency if authenticated else dependency
+
+
+async def get_price_from_db(key: str, redisdb: redis.Redis) -> PriceData:
     """
     get price data from database.
 
@@ -57,27 +222,221 @@ def get_price_from_db(key: str, redisdb: redis.Redis) -> PriceData:
     Returns:
         PriceData: _description_
     """
-    if redisdb.exists(key):
-        price = PriceData(**json.loads(redisdb.get(key)))
-    else:
+    value = await redisdb.get(key)
+    if value is None:
         raise KeyError(f"Key '{key}' does not exist in the database.")
-    return price
+    return decode_price(value)
+
+
+async def get_records_from_db(keys: List[str], redisdb: redis.Redis, missing_ok: bool = False) -> List[bytes]:
+    """
+    get the stored records of several prices from database in a single round-trip (MGET).
+
+    Args:
+        keys (List[str]): keys to the prices in the format of "code:[yesterday/current]".
+        redisdb (redis.Redis): connection to redis database.
+        missing_ok (bool, optional): skip the keys that do not exist instead of raising an error. Defaults to False.
+
+    Raises:
+        KeyError: if some of the keys do not exist in the database (and missing_ok is False). all missing keys are reported.
+
+    Returns:
+        List[bytes]: records in the same order as the keys, see storage_tools.
+    """
+    if not keys:
+        return []
+    values = await redisdb.mget(keys)
+    missing = [k for k, v in zip(keys, values) if v is None]
+    if missing and not missing_ok:
+        raise KeyError(f"Keys {missing} do not exist in the database.")
+    return [v for v in values if v is not None]
+
 
+async def get_prices_from_db(keys: List[str], redisdb: redis.Redis, missing_ok: bool = False) -> List[PriceData]:
+    """
+    get several prices from database in a single round-trip (MGET). see `get_records_from_db`.
 
-def store_price_in_db(key: str, price: PriceData, redisdb: redis.Redis):
+    Returns:
+        List[PriceData]: prices in the same order as the keys.
     """
-    store price data into the database.
-    this function shouldn't be used directly. it is meant to be used by `analyze_and_store_price`.
+    return [decode_price(v) for v in await get_records_from_db(keys, redisdb, missing_ok)]
+
+
+async def get_history_from_db(
+    codes: List[str], start: float, end: float, resolution: str, redisdb: redis.Redis
+) -> Dict[str, np.ndarray]:
+    """
+    get the stored OHLC buckets of several codes in a time range, in two round-trips.
+
+    Args:
+        codes (List[str]): codes of the assets.
+        start (float): start of the time range (unix timestamp).
+        end (float): end of the time range (unix timestamp).
+        resolution (str): one of history_tools.HISTORY_RESOLUTIONS.
+        redisdb (redis.Redis): connection to redis database.
+
+    Returns:
+        Dict[str, np.ndarray]: buckets of each code sorted by time, as returned by `history_tools.decode_buckets`.
+    """
+    pipe = redisdb.pipeline(transaction=False)
+    for code in codes:
+        pipe.zrangebyscore(index_key(code, resolution), start, end)
+    starts = await pipe.execute()
+
+    # read the buckets with MGETs of at most 10000 keys, in one round-trip
+    keys = [bucket_key(code, resolution, int(s)) for code, code_starts in zip(codes, starts) for s in code_starts]
+    for i in range(0, len(keys), 10000):
+        pipe.mget(keys[i : i + 10000])
+    values = [v for chunk in await pipe.execute() for v in chunk]
+    history, i = {}, 0
+    for code, code_starts in zip(codes, starts):
+        # skip the buckets that expired after the index was last trimmed
+        history[code] = decode_buckets([v for v in values[i : i + len(code_starts)] if v is not None])
+        i += len(code_starts)
+    return history
+
+
+async def store_price_in_db(key: str, price: PriceData, redisdb: redis.Redis):
+    """
+    store price data into the database, in the binary format of `storage_tools`.
+    this function shouldn't be used directly. it is meant to be used by `analyze_and_store_prices`.
 
     Args:
         key (str): key to the price in the format of "code:[yesterday/current]". for example: "USD-TMN:current"
         price (PriceData): _description_
         redisdb (redis.Redis): connection to redis database.
     """
-    redisdb.set(key, price.model_dump_json())
+    await redisdb.set(key, encode_price(price))
 
 
-def analyze_and_store_price(newprice: PriceData, redisdb: redis.Redis):
+async def analyze_and_store_prices(
+    newprices: List[PriceData], redisdb: redis.Redis, aggregator: Union[PriceAggregator, None] = None
+) -> Tuple[List[str], List[str]]:
+    """
+    Analyze a batch of new prices and store them in the database atomically.
+
+    every new price is a quote of its source. the latest quote of each source is kept in the "{code}:sources" hash
+    and the current price of the code is aggregated from them (see `aggregation_tools`). a quote that leaves the
+    current price unchanged (for example, of a source with a lower priority) is stored, but changes nothing else.
+
+    current and yesterday prices and the quotes of all codes are read in one round-trip on the connection of the
+    WATCH. the aggregation, day-rollover and price changes are computed here, and every write is applied in a single
+    MULTI/EXEC. if another submitter changes one of the watched keys in between, the whole batch is recomputed,
+    so a code can't be rolled over twice.
+
+    every change of a current price is also appended to the history of its code (see `history_tools`), at the time
+    of the quote that caused it: the OHLC buckets it falls in are read and written with the prices, so the history
+    costs no extra round-trip.
+
+    Args:
+        newprices (List[PriceData]): new prices. prices of the same code are applied in order.
+        redisdb (redis.Redis): connection to redis database.
+        aggregator (Union[PriceAggregator, None], optional): policies of the aggregation. Defaults to the ones of
+            settings.py.
+
+    Returns:
+        Tuple[List[str], List[str]]: codes of the accepted prices and codes of the rejected (invalid) prices.
+    """
+    aggregator = aggregator or price_aggregator
+    accepted = [p for p in newprices if p.code in MAIN_CODES]
+    rejected = [p.code for p in newprices if p.code not in MAIN_CODES]
+    if not accepted:
+        return [], rejected
+
+    codes = list(dict.fromkeys(p.code for p in accepted))
+    current_keys = [f"{c}:current" for c in codes]
+    yesterday_keys = [f"{c}:yesterday" for c in codes]
+    quotes_keys = [sources_key(c) for c in codes]
+
+    # history buckets that the new prices fall in
+    timestamps = [price_timestamp(p) for p in accepted]
+    starts = [{r: bucket_start(ts, HISTORY_UTC_OFFSET, r) for r in HISTORY_RESOLUTIONS} for ts, _ in timestamps]
+    buckets_touched = list(dict.fromkeys((p.code, r, s[r]) for p, s in zip(accepted, starts) for r in s))
+    bucket_keys = [bucket_key(*b) for b in buckets_touched]
+
+    async def transaction(pipe: redis.client.Pipeline):
+        # get current and yesterday prices, quotes and history buckets in db, in one round-trip. the pipeline is in
+        # immediate mode after WATCH, so the reads use the watching connection and no other one of the pool is held
+        values, stored_quotes = await read_with_quotes(pipe, current_keys + yesterday_keys + bucket_keys, codes)
+        current_prices = {c: decode_price(v) for c, v in zip(codes, values[: len(codes)]) if v is not None}
+        yesterday_prices = {c: decode_price(v) for c, v in zip(codes, values[len(codes) : 2 * len(codes)]) if v is not None}
+        buckets = dict(zip(bucket_keys, values[2 * len(codes) :]))
+        quotes = {c: {s.decode("utf-8"): decode_price(v) for s, v in q.items()} for c, q in zip(codes, stored_quotes)}
+
+        to_store = {}
+        quotes_to_store = {}  # code: {source: quote}
+        ticks = {}  # code: {tick: timestamp}
+        merged = set()  # keys of the buckets the ticks were merged into
+        for i, quote in enumerate(accepted):
+            code = quote.code
+            quotes[code][quote.source] = quote
+            quotes_to_store.setdefault(code, {})[quote.source] = quote
+            newprice = aggregator.aggregate(code, quotes[code])
+            current_price = current_prices.get(code, newprice)
+            if current_price is not newprice and _same_price(current_price, newprice):
+                continue
+
+            # check if the newprice is for new day, store the current_price as yesterday's price
+            if not is_prices_same_day(newprice, current_price):
+                if datetime.fromisoformat(newprice.time) > datetime.fromisoformat(current_price.time):
+                    yesterday_prices[code] = current_price
+                    to_store[f"{code}:yesterday"] = current_price
+
+            # calculate price changes compared to yesterday
+            yesterday_price = yesterday_prices.get(code)
+            if yesterday_price:
+                if newprice.price_high_change == 0:
+                    newprice.price_high_change = newprice.price_high - yesterday_price.price_high
+                if newprice.price_low_change == 0:
+                    newprice.price_low_change = newprice.price_low - yesterday_price.price_low
+
+            current_prices[code] = newprice
+            to_store[f"{code}:current"] = newprice
+
+            # add the new price to the history
+            ts = timestamps[i][0]
+            ticks.setdefault(code, {})[encode_tick(ts, newprice)] = ts
+            for r, start in starts[i].items():
+                key = bucket_key(code, r, start)
+                buckets[key] = merge_tick(buckets[key], start, ts, newprice)
+                merged.add(key)
+
+        # store the new prices in db
+        pipe.multi()
+        for key, price in to_store.items():
+            await store_price_in_db(key, price, pipe)
+        for code, code_quotes in quotes_to_store.items():
+            pipe.hset(sources_key(code), mapping={s: encode_price(q) for s, q in code_quotes.items()})
+
+        # store the history, dropping what is older than the retention
+        now = time.time()
+        for code, code_ticks in ticks.items():
+            pipe.zadd(ticks_key(code), code_ticks)
+            pipe.zremrangebyscore(ticks_key(code), "-inf", now - HISTORY_RETENTION["ticks"])
+        for (code, r, start), key in zip(buckets_touched, bucket_keys):
+            if key not in merged:
+                continue
+            pipe.set(key, buckets[key], ex=HISTORY_RETENTION[r])
+            pipe.zadd(index_key(code, r), {str(start): start})
+        for code in codes:
+            for r in HISTORY_RESOLUTIONS:
+                pipe.zremrangebyscore(index_key(code, r), "-inf", now - HISTORY_RETENTION[r])
+
+    await redisdb.transaction(transaction, *current_keys, *yesterday_keys, *quotes_keys, *bucket_keys)
+    return [p.code for p in accepted], rejected
+
+
+def _same_price(price1: PriceData, price2: PriceData) -> bool:
+    # same published price, regardless of the changes computed for it
+    return (price1.source, price1.price_high, price1.price_low, price1.time) == (
+        price2.source,
+        price2.price_high,
+        price2.price_low,
+        price2.time,
+    )
+
+
+async def analyze_and_store_price(newprice: PriceData, redisdb: redis.Redis):
     """
     Analyze a new price and stores it in the database.
 
@@ -86,68 +445,69 @@ def analyze_and_store_price(newprice: PriceData, redisdb: redis.Redis):
         redisdb (redis.Redis): connection to redis database.
 
     Raises:
-        ValueError: the newprice.code must be valid.
+        KeyError: the newprice.code must be valid.
     """
-    newprice = newprice.model_copy()
-    code = newprice.code
-    if code not in MAIN_CODES:
-        raise KeyError(f"code '{code}' not valid. valid codes: {MAIN_CODES.keys()}")
-
-    # get current price in db
-    current_price = newprice.model_copy()
-    current_key = f"{code}:current"
-    if redisdb.exists(current_key):
-        current_price = get_price_from_db(current_key, redisdb)
-
-    # check if the newprice is for new day, store the current_price as yesterday's price
-    yesterday_key = f"{code}:yesterday"
-    if not is_prices_same_day(newprice, current_price):
-        if datetime.fromisoformat(newprice.time) > datetime.fromisoformat(current_price.time):
-            store_price_in_db(yesterday_key, current_price, redisdb)
+    _, rejected = await analyze_and_store_prices([newprice], redisdb)
+    if rejected:
+        raise KeyError(f"code '{newprice.code}' not valid. valid codes: {MAIN_CODES.keys()}")
 
-    # get yesterday price in db
-    yesterday_price = None
-    if redisdb.exists(yesterday_key):
-        yesterday_price = get_price_from_db(yesterday_key, redisdb)
 
-    # calculate price changes compared to yesterday
-    if yesterday_price:
-        if newprice.price_high_change == 0:
-            newprice.price_high_change = newprice.price_high - yesterday_price.price_high
-        if newprice.price_low_change == 0:
-            newprice.price_low_change = newprice.price_low - yesterday_price.price_low
-
-    # store the new price in db
-    store_price_in_db(current_key, newprice, redisdb)
+@app.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    # prometheus metrics of the api, see metrics_tools
+    return metrics_response()
 
 
 @app.get("/")
-def index() -> str:
+async def index() -> str:
     """
     Home Page
     """
     return "Nerkh API. see /docs for details."
 
 
-@app.post("/submit_prices")
-def submit_prices(payload: PricesPayload, authenticated: bool = Depends(authenticate_token)) -> str:
+async def store_submitted_prices(prices: List[PriceData]) -> str:
+    # store submitted prices and notify all workers, return the report of the submission
+    accepted, rejected = await analyze_and_store_prices(prices, app.state.redis)
+    SUBMITTED_PRICES.labels("accepted").inc(len(accepted))
+    SUBMITTED_PRICES.labels("rejected").inc(len(rejected))
+    if accepted:
+        app.state.price_cache.invalidate()
+        await publish_prices_update(app.state.redis, list(dict.fromkeys(accepted)))
+    n_success = len(accepted)
+
+    return f"{n_success}/{len(prices)} prices stored successfully. rejected: {rejected}."
+
+
+@app.post("/submit_prices", dependencies=[Depends(rate_limit("submit_prices", authenticated=True))])
+async def submit_prices(payload: PricesPayload, authenticated: bool = Depends(authenticate_token)) -> str:
     """
     Submit prices to the server. you need a token for this action.
     """
-    n_success = 0
-    rejected = []
-    for price in payload.prices:
-        try:
-            analyze_and_store_price(price, app.state.redis)
-            n_success += 1
-        except KeyError:
-            rejected.append(price.code)
+    return await store_submitted_prices(payload.prices)
 
-    return f"{n_success}/{len(payload.prices)} prices stored successfully. rejected: {rejected}."
+
+@app.post("/submit_prices_delta", dependencies=[Depends(rate_limit("submit_prices", authenticated=True))])
+async def submit_prices_delta(payload: PricesDeltaPayload, authenticated: bool = Depends(authenticate_token)) -> str:
+    """
+    Submit prices to the server in the compact form, normally only the changed ones. you need a token for this action.
+
+    prices of the same source and time are grouped as (code, price_high, price_low). for example:
+
+    ```
+    {"deltas": [{"source": "bonbast", "time": "2024-05-01T12:30:00+03:30", "prices": [["USD-TMN", 61000, 60900]]}]}
+    ```
+    """
+    return await store_submitted_prices(expand_prices(payload))
 
 
-@app.post("/get_prices")
-def get_prices(payload: CodesPayload = CodesPayload(codes=[]), compression: bool = False) -> PricesPayload:
+@app.post("/get_prices", dependencies=[Depends(rate_limit("get_prices"))])
+async def get_prices(
+    payload: CodesPayload = CodesPayload(codes=[]),
+    compression: bool = False,
+    if_none_match: Union[str, None] = Header(None),
+    accept_encoding: Union[str, None] = Header(None),
+) -> PricesPayload:
     """
     *Gets prices from the server.*
 
@@ -178,10 +538,11 @@ def get_prices(payload: CodesPayload = CodesPayload(codes=[]), compression: bool
         }'
     ```
     
-    **gzip compression:**
-    
-    By default the json response is not compressed.
-    However, you can get gzip compressed data by passing `?compression=true` in query:
+    **compression:**
+
+    The response is compressed with brotli or gzip according to the `Accept-Encoding` header of the request
+    (most http clients send it and decompress the response transparently).
+    For backward compatibility, passing `?compression=true` in query always gives gzip compressed data:
 
     ```
     curl --compressed -X 'POST' \\
@@ -193,6 +554,11 @@ def get_prices(payload: CodesPayload = CodesPayload(codes=[]), compression: bool
         }'
     ```
 
+    **caching:**
+
+    Every response carries an `ETag` header. Send it back in the `If-None-Match` header and, if the prices have not
+    changed since, you get an empty `304 Not Modified` response.
+
     **Raises:**
 
     *HTTPException 404*: if one of the input codes is invalid (passing "USD" instead of "USD-TMN" for example), you'll get this error.
@@ -225,25 +591,371 @@ def get_prices(payload: CodesPayload = CodesPayload(codes=[]), compression: bool
         "time": str                     # register time of the data in the iso format: "yyyy-mm-ddThh:mm:ss.ms".
     }
     ```
-    Alternatively, if an error occurs, you get a string as the error message.
     """
-    prices = []
-    codes = payload.codes
-    if not codes:
-        codes = list(MAIN_CODES.keys())
-    for c in codes:
+    try:
+        rendered = await app.state.price_cache.get_rendered(payload.codes)
+    except KeyError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{e.args[0]} Valid codes: {list(MAIN_CODES)}.")
+
+    encoding = "gzip" if compression else choose_encoding(accept_encoding, available=("br", "gzip"))
+    return await prices_response(rendered, encoding, if_none_match)
+
+
+async def prices_response(
+    rendered: RenderedPrices,
+    encoding: str,
+    if_none_match: Union[str, None],
+    if_modified_since: Union[str, None] = None,
+    cacheable: bool = False,
+) -> Response:
+    """
+    response of rendered prices in the given content encoding, or an empty 304 if the client has them already.
+
+    Args:
+        rendered (RenderedPrices): the rendered prices.
+        encoding (str): content encoding of the body.
+        if_none_match (Union[str, None]): If-None-Match header of the request.
+        if_modified_since (Union[str, None], optional): If-Modified-Since header of the request, only used without
+            If-None-Match. Defaults to None.
+        cacheable (bool, optional): add Cache-Control and Last-Modified headers for shared caches. Defaults to False.
+
+    Returns:
+        Response: the response.
+    """
+    response_headers = {"ETag": rendered.etag(encoding), "Vary": "Accept-Encoding"}
+    not_modified = rendered.etag_matches(if_none_match, encoding)
+    if cacheable:
+        response_headers["Cache-Control"] = f"public, max-age={prices_max_age(rendered.last_modified)}"
+        if rendered.last_modified:
+            response_headers["Last-Modified"] = formatdate(rendered.last_modified, usegmt=True)
+            if if_none_match is None and if_modified_since:
+                try:
+                    not_modified = int(rendered.last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+                except (TypeError, ValueError):
+                    pass  # invalid date, ignored
+    if not_modified:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=response_headers)
+    if encoding != "identity":
+        response_headers["Content-Encoding"] = encoding
+    body = await rendered.body(encoding)
+    return Response(content=body, media_type="application/json", headers=response_headers)
+
+
+def prices_max_age(last_modified: float) -> int:
+    # seconds until the next ingestion is expected after the newest price, within PRICES_MIN_MAX_AGE and PRICES_MAX_AGE
+    next_ingestion = last_modified + PRICES_INGESTION_INTERVAL
+    return int(min(PRICES_MAX_AGE, max(PRICES_MIN_MAX_AGE, next_ingestion - time.time())))
+
+
+def parse_codes_query(codes: str) -> List[str]:
+    # comma separated codes of a query, raises KeyError for the unknown ones
+    codes = [c.strip() for c in codes.split(",") if c.strip()]
+    unknown = [c for c in codes if c not in MAIN_CODES]
+    if unknown:
+        raise KeyError(f"Codes {unknown} do not exist.")
+    return codes
+
+
+@app.get("/prices", dependencies=[Depends(rate_limit("get_prices"))])
+async def get_prices_cacheable(
+    request: Request,
+    codes: str = "",
+    if_none_match: Union[str, None] = Header(None),
+    if_modified_since: Union[str, None] = Header(None),
+    accept_encoding: Union[str, None] = Header(None),
+) -> PricesPayload:
+    """
+    *Gets prices from the server, with a response that browsers, proxies and CDNs can cache.*
+
+    the same prices as /get_prices. pass the codes as a comma separated list, or nothing to get all prices:
+
+    ```
+    curl --compressed 'https://nerkh-api-dev.liara.run/prices?codes=USD-TMN,EUR-TMN'
+    ```
+
+    the url is canonical: the codes are in the order of the server, without duplicates. other urls are redirected
+    (301) to the canonical one, so every set of codes is cached once. the prices are in the canonical order.
+
+    **caching:**
+
+    `Cache-Control` allows caching until the next update of the prices is expected (one minute at most).
+    `Last-Modified` is the time of the newest price. `If-None-Match` and `If-Modified-Since` give `304 Not Modified`.
+
+    **Raises:**
+
+    *HTTPException 404*: if one of the codes is invalid.
+    """
+    try:
+        requested = parse_codes_query(codes)
+    except KeyError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{e.args[0]} Valid codes: {list(MAIN_CODES)}.")
+    canonical = [c for c in MAIN_CODES if c in requested]
+    query = f"codes={','.join(canonical)}" if canonical else ""
+    if request.url.query != query:
+        url = f"{request.url.path}?{query}" if query else request.url.path
+        return RedirectResponse(url, status_code=status.HTTP_301_MOVED_PERMANENTLY)
+    try:
+        rendered = await app.state.price_cache.get_rendered(canonical)
+    except KeyError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=e.args[0])
+    encoding = choose_encoding(accept_encoding, available=("br", "gzip"))
+    return await prices_response(rendered, encoding, if_none_match, if_modified_since, cacheable=True)
+
+
+@app.get("/prices/{category}", dependencies=[Depends(rate_limit("get_prices"))])
+async def get_category_prices(
+    category: str,
+    if_none_match: Union[str, None] = Header(None),
+    if_modified_since: Union[str, None] = Header(None),
+    accept_encoding: Union[str, None] = Header(None),
+) -> PricesPayload:
+    """
+    *Gets the prices of all assets of a category*, like /prices. for example:
+
+    ```
+    curl --compressed 'https://nerkh-api-dev.liara.run/prices/currency'
+    ```
+
+    **Raises:**
+
+    *HTTPException 404*: if the category is invalid.
+    """
+    if category not in CODES_BY_CATEGORY:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Category '{category}' does not exist. Valid categories: {list(CODES_BY_CATEGORY)}.",
+        )
+    snapshot = await app.state.price_cache.get_snapshot()
+    codes = [c for c in CODES_BY_CATEGORY[category] if c in snapshot]
+    if codes:
+        rendered = await app.state.price_cache.get_rendered(codes)
+    else:
+        # no price of the category is stored yet. an empty list of codes would get all prices from the cache
+        rendered = RenderedPrices([])
+    encoding = choose_encoding(accept_encoding, available=("br", "gzip"))
+    return await prices_response(rendered, encoding, if_none_match, if_modified_since, cacheable=True)
+
+
+@app.get("/quotes", dependencies=[Depends(rate_limit("get_prices"))])
+async def get_quotes(codes: str = "") -> PricesPayload:
+    """
+    *Gets the latest price reported by every source*, from which the published prices are aggregated.
+
+    pass the codes as a comma separated list, or nothing to get the quotes of all codes. the quotes of each code
+    are sorted by source. for example:
+
+    ```
+    curl 'https://nerkh-api-dev.liara.run/quotes?codes=USD-TMN'
+    ```
+
+    **Raises:**
+
+    *HTTPException 404*: if one of the codes is invalid.
+    """
+    try:
+        codes = parse_codes_query(codes) or list(MAIN_CODES)
+    except KeyError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=e.args[0])
+    pipe = app.state.redis.pipeline(transaction=False)
+    for code in codes:
+        pipe.hgetall(sources_key(code))
+    quotes = []
+    for stored in await pipe.execute():
+        quotes += sorted((decode_price(v) for v in stored.values()), key=lambda p: p.source)
+    return PricesPayload(prices=quotes)
+
+
+@app.get("/assets", dependencies=[Depends(rate_limit("get_prices"))])
+async def get_assets(category: str = "") -> AssetsPayload:
+    """
+    *Gets the assets whose prices are served*: their codes, categories, descriptions and their codes in the
+    sources of the prices (aliases). pass a category to get its assets only. for example:
+
+    ```
+    curl 'https://nerkh-api-dev.liara.run/assets?category=currency'
+    ```
+
+    **Raises:**
+
+    *HTTPException 404*: if the category is invalid.
+    """
+    if not category:
+        return AssetsPayload(assets=list(ASSETS.values()))
+    if category not in CODES_BY_CATEGORY:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Category '{category}' does not exist. Valid categories: {list(CODES_BY_CATEGORY)}.",
+        )
+    return AssetsPayload(assets=[ASSETS[c] for c in CODES_BY_CATEGORY[category]])
+
+
+async def push_current_prices(stream: PriceStream):
+    # queue the current prices of the subscribed codes, so a new subscriber doesn't have to poll them first
+    await app.state.price_cache.get_snapshot()
+    stream.push(app.state.price_cache.fragments)
+
+
+@app.get("/stream", dependencies=[Depends(rate_limit("stream"))])
+async def stream_prices(codes: str = "") -> StreamingResponse:
+    """
+    *Streams price updates as server-sent events.*
+
+    pass the codes to follow as a comma separated list, or nothing to follow all codes. the first event carries the
+    current prices and every next one the prices updated since the previous event. for example:
+
+    ```
+    curl -N 'https://nerkh-api-dev.liara.run/stream?codes=USD-TMN,EUR-TMN'
+    ```
+
+    each event is a line `data: {"prices": [PriceData1, ...]}`, in the same form as the response of /get_prices.
+    a comment line (`: keep-alive`) is sent when there are no updates for a while.
+
+    **Raises:**
+
+    *HTTPException 404*: if one of the codes is invalid.
+
+    *HTTPException 503*: if the server has too many open streams.
+    """
+    try:
+        codes = parse_codes_query(codes)
+    except KeyError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=e.args[0])
+    stream = app.state.price_streams.open(codes)
+    if stream is None:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Too many open streams")
+
+    async def events():
         try:
-            prices.append(get_price_from_db(f"{c}:current", app.state.redis))
-        except KeyError as e:
-            return str(e) + f"\nValid codes: {MAIN_CODES.keys()}."
+            await push_current_prices(stream)
+            while True:
+                data = await stream.next(timeout=STREAM_KEEPALIVE_INTERVAL)
+                yield b": keep-alive\n\n" if data is None else b"data: " + data + b"\n\n"
+        finally:
+            app.state.price_streams.close(stream)
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-    response = PricesPayload(prices=prices)
-    if compression:
-        data_gzip = gzip.compress(response.model_dump_json().encode("utf-8"))
-        response_headers = {"Content-Type": "application/json", "Content-Encoding": "gzip"}
-        response = Response(content=data_gzip, headers=response_headers)
 
-    return response
+@app.websocket("/stream/ws", dependencies=[Depends(rate_limit("stream"))])
+async def stream_prices_ws(websocket: WebSocket, codes: str = ""):
+    """
+    streams price updates over a websocket. the messages are the same as the events of /stream.
+    the client can change its codes at any time by sending `{"codes": [...]}` (an empty list for all codes), which
+    is answered with the current prices of the new codes.
+    """
+    try:
+        codes = parse_codes_query(codes)
+    except KeyError as e:
+        raise WebSocketException(code=status.WS_1008_POLICY_VIOLATION, reason=e.args[0])
+    stream = app.state.price_streams.open(codes)
+    if stream is None:
+        raise WebSocketException(code=status.WS_1013_TRY_AGAIN_LATER, reason="Too many open streams")
+    await websocket.accept()
+    await push_current_prices(stream)
+
+    async def send_updates():
+        while True:
+            await websocket.send_text((await stream.next()).decode("utf-8"))
+
+    async def receive_subscriptions():
+        async for message in websocket.iter_text():
+            try:
+                stream.codes = set(parse_codes_query(",".join(CodesPayload.model_validate_json(message).codes)))
+            except (ValueError, KeyError) as e:
+                await websocket.send_text(json.dumps({"error": str(e.args[0])}))
+                continue
+            stream.pending.clear()
+            await push_current_prices(stream)
+
+    tasks = [asyncio.create_task(send_updates()), asyncio.create_task(receive_subscriptions())]
+    try:
+        # until the client disconnects
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        app.state.price_streams.close(stream)
+
+
+@app.post("/history", dependencies=[Depends(rate_limit("history"))])
+async def get_history(payload: HistoryPayload):
+    """
+    *Gets price history of several assets.*
+
+    Prices are aggregated into buckets of the given size (a multiple of 15 minutes, for example "15m", "1h", "4h",
+    "1d" or "1w"). buckets are aligned to the utc offset of "start", and their times are in it. with an offset other
+    than +03:30 (HISTORY_UTC_OFFSET), buckets of an hour or more are made of the 15 minute history, which is kept for
+    a shorter time. for example:
+
+    ```
+    curl -X 'POST' \\
+    'https://nerkh-api-dev.liara.run/history' \\
+    -H 'accept: application/json' \\
+    -H 'Content-Type: application/json' \\
+    -d '{
+            "codes": ["USD-TMN", "EUR-TMN"],
+            "start": "2024-05-01T00:00:00+03:30",
+            "end": "2024-05-08T00:00:00+03:30",
+            "bucket": "1d"
+        }'
+    ```
+
+    **Raises:**
+
+    *HTTPException 404*: if one of the input codes is invalid.
+
+    *HTTPException 400*: if the time range or the bucket size is invalid.
+
+    **Returns:**
+
+    ```
+    {
+        "history": {
+            "USD-TMN": [
+                {
+                    "time": str                 # start of the bucket in the iso format.
+                    "count": int                # number of submitted prices in the bucket.
+                    "price_high_open": float    # first price_high in the bucket.
+                    "price_high_max": float
+                    "price_high_min": float
+                    "price_high_close": float   # last price_high in the bucket.
+                    "price_high_mean": float
+                    "price_low_open": float
+                    ...                         # same fields for price_low.
+                },
+                ...
+            ],
+            ...
+        }
+    }
+    ```
+
+    with `"columnar": true`, each code maps to a dict of lists instead: {"time": [...], "count": [...], ...}.
+    """
+    codes = payload.codes or list(MAIN_CODES)
+    invalid = [c for c in codes if c not in MAIN_CODES]
+    if invalid:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Codes {invalid} are not valid.")
+    try:
+        bucket_size = parse_bucket_size(payload.bucket)
+        start = datetime.fromisoformat(payload.start)
+        end = datetime.fromisoformat(payload.end) if payload.end else datetime.now(timezone.utc)
+        # times without timezone are considered utc
+        start = start if start.tzinfo else start.replace(tzinfo=timezone.utc)
+        end = end if end.tzinfo else end.replace(tzinfo=timezone.utc)
+        utc_offset = int(start.utcoffset().total_seconds())
+        resolution = stored_resolution(bucket_size, utc_offset, HISTORY_UTC_OFFSET)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    buckets = await get_history_from_db(codes, start.timestamp(), end.timestamp(), resolution, app.state.redis)
+    history = {
+        code: format_history(aggregate_buckets(b, bucket_size, utc_offset), utc_offset, payload.columnar)
+        for code, b in buckets.items()
+    }
+    return Response(content=json.dumps({"history": history}), media_type="application/json")
 
 
 if __name__ == "__main__":
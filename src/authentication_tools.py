@@ -1,6 +1,13 @@
 import jwt
+import asyncio
+import hashlib
+import time
+import redis.asyncio as redis
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
+from typing import Tuple, Union
+from metrics_tools import CACHE_LOOKUPS
 import os
 
 load_dotenv
@@ -8,6 +15,10 @@ load_dotenv
 # Define your secret key
 SECRET_KEY = os.environ["SECRET_KEY"]
 
+# redis set of the hashes of revoked tokens, and the channel notifying the workers of a revocation
+REVOKED_TOKENS_KEY = "tokens:revoked"
+REVOCATIONS_CHANNEL = "tokens:revocations"
+
 
 # Function to generate a token
 def generate_token(username, expiration_duration=timedelta(days=3650)) -> str:
@@ -23,17 +34,23 @@ def generate_token(username, expiration_duration=timedelta(days=3650)) -> str:
 
 
 # Function to validate a token
-def validate_token(token) -> bool:
+def validate_token(token) -> Union[Tuple[bool, str, str, datetime], Tuple[bool, str]]:
+    """
+    verify the signature and the expiration of a token. it never raises on an invalid token.
+
+    Args:
+        token (str): the token.
+
+    Returns:
+        Union[Tuple[bool, str, str, datetime], Tuple[bool, str]]: (True, message, subject, expiration time) of a valid
+            token, or (False, reason) of an invalid or expired one.
+    """
     try:
-        # Decode the token using the secret key and algorithm
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-        # Check if the token is expired
+        # Decode the token using the secret key and algorithm, it also checks the expiration
+        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"], options={"require": ["exp", "sub"]})
         expiration_time = datetime.fromtimestamp(payload["exp"], tz=timezone.utc)
-        if expiration_time < datetime.now(timezone.utc):
-            return False, "Token has expired"
 
-        # If no exceptions are raised during decoding and expiration check,
-        # the token is considered valid
+        # If no exceptions are raised during decoding, the token is considered valid
         return True, "Token is valid", payload["sub"], expiration_time
 
     except jwt.ExpiredSignatureError:
@@ -44,8 +61,128 @@ def validate_token(token) -> bool:
         return False, "Invalid token"
 
 
+def hash_token(token: str) -> str:
+    """
+    sha256 of a token. tokens are cached and revoked by their hash, so they're never kept in redis.
+    """
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class TokenCache:
+    """
+    bounded LRU cache of verified tokens, so a known token is not decoded and verified on every request.
+
+    a token is kept for `ttl` seconds at most, and never after its expiration. the ttl bounds the time a worker
+    that missed a revocation notification still accepts the revoked token.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300):
+        """
+        Args:
+            max_size (int, optional): maximum number of cached tokens. Defaults to 1024.
+            ttl (float, optional): maximum seconds a token is cached. Defaults to 300.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        # hash of the token: (subject, expiration time of the entry)
+        self.tokens: OrderedDict[str, Tuple[str, float]] = OrderedDict()
+
+    def get(self, token: str) -> Union[str, None]:
+        """
+        get the subject of a cached token, or None if it's not cached or its entry has expired.
+        """
+        hashed = hash_token(token)
+        entry = self.tokens.get(hashed)
+        if entry is not None and entry[1] <= time.time():
+            del self.tokens[hashed]
+            entry = None
+        CACHE_LOOKUPS.labels("token", "miss" if entry is None else "hit").inc()
+        if entry is None:
+            return None
+        self.tokens.move_to_end(hashed)
+        return entry[0]
+
+    def put(self, token: str, subject: str, expiration_time: datetime):
+        """
+        cache a verified token.
+
+        Args:
+            token (str): the token.
+            subject (str): subject of the token.
+            expiration_time (datetime): expiration time of the token.
+        """
+        hashed = hash_token(token)
+        self.tokens[hashed] = (subject, min(time.time() + self.ttl, expiration_time.timestamp()))
+        self.tokens.move_to_end(hashed)
+        while len(self.tokens) > self.max_size:
+            self.tokens.popitem(last=False)
+
+    def discard(self, hashed: str):
+        self.tokens.pop(hashed, None)
+
+    def clear(self):
+        self.tokens.clear()
+
+
+async def is_token_revoked(token: str, redisdb: redis.Redis) -> bool:
+    return bool(await redisdb.sismember(REVOKED_TOKENS_KEY, hash_token(token)))
+
+
+async def revoke_token(token: str, redisdb: redis.Redis):
+    """
+    revoke a token and notify the workers to drop it from their caches.
+
+    Args:
+        token (str): the token.
+        redisdb (redis.Redis): connection to redis database.
+    """
+    hashed = hash_token(token)
+    await redisdb.sadd(REVOKED_TOKENS_KEY, hashed)
+    await redisdb.publish(REVOCATIONS_CHANNEL, hashed)
+
+
+async def listen_for_revocations(redisdb: redis.Redis, cache: TokenCache, retry_delay: float = 1):
+    """
+    listen for revocations and drop the revoked tokens from the cache.
+    this coroutine runs until it's cancelled. on redis errors, the cache is cleared and it resubscribes.
+
+    Args:
+        redisdb (redis.Redis): connection to redis database.
+        cache (TokenCache): the cache of verified tokens.
+        retry_delay (float, optional): seconds to wait before resubscribing after a connection error. Defaults to 1.
+    """
+    while True:
+        try:
+            async with redisdb.pubsub() as pubsub:
+                await pubsub.subscribe(REVOCATIONS_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    hashed = message["data"]
+                    cache.discard(hashed.decode() if isinstance(hashed, bytes) else hashed)
+        except redis.RedisError:
+            # we may have missed some revocations
+            cache.clear()
+            await asyncio.sleep(retry_delay)
+
+
 if __name__ == "__main__":
-    # Generate a token
-    username = input("username for token:")
-    token = generate_token(username)
-    print("Generated Token:", token)
+    import argparse
+
+    parser = argparse.ArgumentParser(description="generate a token, or revoke one.")
+    parser.add_argument("--revoke", metavar="TOKEN", help="revoke the token in the redis database of settings.py")
+    args = parser.parse_args()
+    if args.revoke:
+        from settings import REDIS_HOST, REDIS_PORT, REDIS_PASSWORD, REDIS_INDEX
+
+        async def revoke():
+            async with redis.Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=REDIS_INDEX) as r:
+                await revoke_token(args.revoke, r)
+
+        asyncio.run(revoke())
+        print("Token revoked.")
+    else:
+        # Generate a token
+        username = input("username for token:")
+        token = generate_token(username)
+        print("Generated Token:", token)
@@ -0,0 +1,288 @@
+import asyncio
+import json
+import time
+import gzip
+import hashlib
+import logging
+import brotli
+import redis.asyncio as redis
+from collections import OrderedDict
+from functools import partial
+from typing import Awaitable, Callable, Dict, List, Tuple, Union
+from data_tools import PriceData, MAIN_CODES
+from storage_tools import decode_price
+from history_tools import price_timestamp
+from metrics_tools import CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+# redis pub/sub channel to notify all workers that some prices have been stored
+PRICES_CHANNEL = "prices:updates"
+
+
+def render_price(price: PriceData) -> bytes:
+    """
+    json of a price, as it appears in the list of a PricesPayload.
+    """
+    return price.model_dump_json().encode("utf-8")
+
+
+class RenderedPrices:
+    """
+    response bodies of a list of prices, serialized once and compressed once per content encoding.
+    the json body is spliced from the rendered json of each price, see `render_price`. it's the same as the
+    serialization of a PricesPayload of the prices.
+
+    a compressed body is made on its first request, in a thread of the default executor, so a refresh of the
+    snapshot doesn't compress bodies that nobody asks for and compression doesn't block the event loop.
+    """
+
+    def __init__(self, fragments: List[bytes], last_modified: float = 0, gzip_level: int = 6, brotli_quality: int = 4):
+        """
+        Args:
+            fragments (List[bytes]): rendered json of the prices.
+            last_modified (float, optional): unix timestamp of the newest price. Defaults to 0 (unknown).
+            gzip_level (int, optional): gzip compression level. Defaults to 6.
+            brotli_quality (int, optional): brotli compression quality. Defaults to 4.
+        """
+        self.last_modified = last_modified
+        body = b'{"prices":[' + b",".join(fragments) + b"]}"
+        self.bodies: Dict[str, bytes] = {"identity": body}  # content encoding: body
+        self.digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self._compressors: Dict[str, Callable[[bytes], bytes]] = {
+            "gzip": partial(gzip.compress, compresslevel=gzip_level),
+            "br": partial(brotli.compress, quality=brotli_quality),
+        }
+        self._compressing: Dict[str, asyncio.Future] = {}
+
+    async def body(self, encoding: str = "identity") -> bytes:
+        """
+        get the body in the given content encoding ("identity", "gzip" or "br"), compressing it on first use.
+        """
+        body = self.bodies.get(encoding)
+        if body is not None:
+            return body
+        future = self._compressing.get(encoding)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(None, self._compressors[encoding], self.bodies["identity"])
+            self._compressing[encoding] = future
+        # shielded: a cancelled request must not cancel the compression awaited by the others
+        body = await asyncio.shield(future)
+        self.bodies[encoding] = body
+        self._compressing.pop(encoding, None)
+        return body
+
+    def etag(self, encoding: str = "identity") -> str:
+        """
+        strong ETag of the body with the given content encoding.
+        """
+        if encoding == "identity":
+            return f'"{self.digest}"'
+        return f'"{self.digest}-{encoding}"'
+
+    def etag_matches(self, if_none_match: Union[str, None], encoding: str = "identity") -> bool:
+        """
+        check the value of an If-None-Match header against the ETag of the body.
+        """
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        return self.etag(encoding) in [tag.strip() for tag in if_none_match.split(",")]
+
+
+class PriceSnapshotCache:
+    """
+    in-process snapshot of the current prices of all codes.
+
+    the snapshot is loaded from the database at once and then served from memory. it is reloaded when
+    `invalidate` is called (after a submission or a pub/sub notification) or when it gets older than `max_staleness`.
+
+    stored records are trusted, they were validated when they were submitted. each record is decoded, rendered
+    to json and timestamped once, and kept while it's in the snapshot, so a reload after a submission only decodes
+    the changed prices. response bodies are spliced from the rendered prices: the full snapshot eagerly and
+    requested subsets of codes on first use (the last `max_rendered` subsets are kept).
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[], Awaitable[List[bytes]]],
+        max_staleness: float = 60,
+        max_rendered: int = 64,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+    ):
+        """
+        Args:
+            loader (Callable[[], Awaitable[List[bytes]]]): coroutine function returning the stored records of the current prices from the database.
+            max_staleness (float, optional): maximum age of the snapshot in seconds. Defaults to 60.
+            max_rendered (int, optional): maximum number of rendered subsets of codes. Defaults to 64.
+            gzip_level (int, optional): gzip compression level of the bodies. Defaults to 6.
+            brotli_quality (int, optional): brotli compression quality of the bodies. Defaults to 4.
+        """
+        self.loader = loader
+        self.max_staleness = max_staleness
+        self.max_rendered = max_rendered
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.prices: Dict[str, PriceData] = {}
+        self.fragments: Dict[str, bytes] = {}  # rendered json of each price
+        self.timestamps: Dict[str, float] = {}  # unix timestamp of each price, 0 if unknown
+        self._decoded: Dict[bytes, Tuple[PriceData, bytes, float]] = {}  # record: (price, rendered json, timestamp)
+        self.rendered: OrderedDict[Tuple[str, ...], RenderedPrices] = OrderedDict()
+        self.loaded_at = 0.0
+        self.valid = False
+        self._lock = asyncio.Lock()
+
+    def is_fresh(self) -> bool:
+        return self.valid and time.monotonic() - self.loaded_at < self.max_staleness
+
+    def invalidate(self):
+        self.valid = False
+
+    async def refresh(self):
+        """
+        reload the snapshot from the database.
+        """
+        records = await self.loader()
+        previous, self._decoded = self._decoded, {}
+        for record in records:
+            decoded = previous.get(record)
+            if decoded is None:
+                price = decode_price(record)
+                try:
+                    timestamp = price_timestamp(price)[0]
+                except ValueError:
+                    timestamp = 0  # no time, or not an iso time
+                decoded = (price, render_price(price), timestamp)
+            self._decoded[record] = decoded
+        self.prices = {p.code: p for p, _, _ in self._decoded.values()}
+        self.fragments = {p.code: fragment for p, fragment, _ in self._decoded.values()}
+        self.timestamps = {p.code: timestamp for p, _, timestamp in self._decoded.values()}
+        # all available prices in the order of MAIN_CODES
+        codes = [c for c in MAIN_CODES if c in self.prices]
+        self.rendered = OrderedDict({(): self._render(codes)})
+        self.loaded_at = time.monotonic()
+        self.valid = True
+
+    async def get_snapshot(self) -> Dict[str, PriceData]:
+        """
+        get the snapshot, reloading it first if it is invalid or too old.
+
+        Returns:
+            Dict[str, PriceData]: current prices by code.
+        """
+        CACHE_LOOKUPS.labels("snapshot", "hit" if self.is_fresh() else "miss").inc()
+        if not self.is_fresh():
+            async with self._lock:
+                # another request may have refreshed the snapshot while we were waiting for the lock
+                if not self.is_fresh():
+                    await self.refresh()
+        return self.prices
+
+    async def get_prices(self, codes: List[str]) -> List[PriceData]:
+        """
+        get prices of the given codes from the snapshot.
+
+        Args:
+            codes (List[str]): codes of the assets.
+
+        Raises:
+            KeyError: if some of the codes do not exist in the database. all missing codes are reported.
+
+        Returns:
+            List[PriceData]: prices in the same order as the codes.
+        """
+        snapshot = await self.get_snapshot()
+        missing = [c for c in codes if c not in snapshot]
+        if missing:
+            raise KeyError(f"Codes {missing} do not exist in the database.")
+        return [snapshot[c] for c in codes]
+
+    async def get_rendered(self, codes: List[str]) -> RenderedPrices:
+        """
+        get the rendered response bodies of the prices of the given codes.
+
+        Args:
+            codes (List[str]): codes of the assets. an empty list means all available prices.
+
+        Raises:
+            KeyError: if some of the codes do not exist in the database.
+
+        Returns:
+            RenderedPrices: rendered bodies.
+        """
+        await self.get_snapshot()
+        key = tuple(codes)
+        rendered = self.rendered.get(key)
+        CACHE_LOOKUPS.labels("rendered", "miss" if rendered is None else "hit").inc()
+        if rendered is None:
+            await self.get_prices(codes)  # check that all codes exist
+            rendered = self._render(codes)
+            self.rendered[key] = rendered
+            if len(self.rendered) > self.max_rendered + 1:
+                # drop the oldest subset, but always keep the full snapshot
+                oldest = next(k for k in self.rendered if k != ())
+                del self.rendered[oldest]
+        else:
+            self.rendered.move_to_end(key)
+        return rendered
+
+    def _render(self, codes: List[str]) -> RenderedPrices:
+        return RenderedPrices(
+            [self.fragments[c] for c in codes],
+            max((self.timestamps[c] for c in codes), default=0),
+            gzip_level=self.gzip_level,
+            brotli_quality=self.brotli_quality,
+        )
+
+
+async def publish_prices_update(redisdb: redis.Redis, codes: List[str]):
+    """
+    notify all workers (including this one) that prices of the given codes have been stored.
+
+    Args:
+        redisdb (redis.Redis): connection to redis database.
+        codes (List[str]): codes of the stored prices.
+    """
+    await redisdb.publish(PRICES_CHANNEL, json.dumps({"codes": codes}))
+
+
+async def listen_for_prices_updates(
+    redisdb: redis.Redis,
+    cache: PriceSnapshotCache,
+    retry_delay: float = 1,
+    on_update: Union[Callable[[List[str]], None], None] = None,
+):
+    """
+    listen for notifications of the workers and refresh the cache when prices are updated.
+    this coroutine runs until it's cancelled. on errors, of redis or of refreshing the cache or `on_update`, the cache
+    is invalidated and it resubscribes.
+
+    Args:
+        redisdb (redis.Redis): connection to redis database.
+        cache (PriceSnapshotCache): the cache to refresh.
+        retry_delay (float, optional): seconds to wait before resubscribing after an error. Defaults to 1.
+        on_update (Union[Callable[[List[str]], None], None], optional): called with the updated codes after the
+            cache is refreshed. Defaults to None.
+    """
+    while True:
+        try:
+            async with redisdb.pubsub() as pubsub:
+                await pubsub.subscribe(PRICES_CHANNEL)
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    cache.invalidate()
+                    await cache.get_snapshot()
+                    if on_update is not None:
+                        on_update(json.loads(message["data"])["codes"])
+        except Exception as e:
+            # we may have missed some notifications
+            if isinstance(e, redis.RedisError):
+                logger.warning("Redis error while listening for price updates: %r", e)
+            else:
+                logger.exception("Failed to refresh the price cache")
+            cache.invalidate()
+            await asyncio.sleep(retry_delay)
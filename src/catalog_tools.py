@@ -0,0 +1,129 @@
+"""
+the asset catalog shared by all workers, hot-reloadable.
+
+the catalog is read from data_tools.ASSETS_FILE at import. a catalog stored in redis (CATALOG_KEY) replaces it, so
+assets can be added, renamed or given new source aliases without a redeploy: `store_assets` saves a catalog and
+notifies the workers, which reload it at once (`listen_for_catalog_updates`). `reset_assets` drops the stored
+catalog, and the workers go back to the file.
+
+    python src/catalog_tools.py --upload my_assets.json
+    python src/catalog_tools.py --reset
+"""
+
+import asyncio
+import logging
+import redis.asyncio as redis
+from typing import Callable, List, Union
+from data_tools import ASSETS_FILE, AssetInfo, AssetsPayload, load_assets, read_assets_file
+
+logger = logging.getLogger(__name__)
+
+# redis key of the stored catalog (json of an AssetsPayload), and the channel notifying the workers of a change
+CATALOG_KEY = "assets:catalog"
+CATALOG_CHANNEL = "assets:updates"
+
+
+async def reload_assets(redisdb: redis.Redis) -> List[AssetInfo]:
+    """
+    load the catalog stored in redis, or the one of ASSETS_FILE if none is stored.
+
+    Args:
+        redisdb (redis.Redis): connection to redis database.
+
+    Raises:
+        ValueError: if the catalog is invalid. the current one is kept.
+
+    Returns:
+        List[AssetInfo]: the loaded assets.
+    """
+    value = await redisdb.get(CATALOG_KEY)
+    assets = read_assets_file() if value is None else AssetsPayload.model_validate_json(value).assets
+    load_assets(assets)
+    return assets
+
+
+async def store_assets(assets: List[AssetInfo], redisdb: redis.Redis):
+    """
+    store a catalog in redis and notify the workers to load it.
+
+    Args:
+        assets (List[AssetInfo]): the assets.
+        redisdb (redis.Redis): connection to redis database.
+
+    Raises:
+        ValueError: if the catalog is invalid. nothing is stored.
+    """
+    load_assets(assets)  # validates the catalog
+    await redisdb.set(CATALOG_KEY, AssetsPayload(assets=assets).model_dump_json())
+    await redisdb.publish(CATALOG_CHANNEL, "stored")
+
+
+async def reset_assets(redisdb: redis.Redis):
+    """
+    drop the catalog stored in redis and notify the workers to go back to the one of ASSETS_FILE.
+
+    Args:
+        redisdb (redis.Redis): connection to redis database.
+    """
+    await redisdb.delete(CATALOG_KEY)
+    await redisdb.publish(CATALOG_CHANNEL, "reset")
+
+
+async def listen_for_catalog_updates(
+    redisdb: redis.Redis, retry_delay: float = 1, on_update: Union[Callable[[], None], None] = None
+):
+    """
+    listen for changes of the catalog and reload it. this coroutine runs until it's cancelled. on redis errors, it
+    resubscribes and reloads the catalog, in case it missed a change.
+
+    Args:
+        redisdb (redis.Redis): connection to redis database.
+        retry_delay (float, optional): seconds to wait before resubscribing after a connection error. Defaults to 1.
+        on_update (Union[Callable[[], None], None], optional): called after the catalog is reloaded. Defaults to None.
+    """
+    missed = False
+    while True:
+        try:
+            async with redisdb.pubsub() as pubsub:
+                await pubsub.subscribe(CATALOG_CHANNEL)
+                if missed:
+                    await _reload(redisdb, on_update)
+                    missed = False
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        await _reload(redisdb, on_update)
+        except redis.RedisError:
+            missed = True
+            await asyncio.sleep(retry_delay)
+
+
+async def _reload(redisdb: redis.Redis, on_update: Union[Callable[[], None], None]):
+    try:
+        await reload_assets(redisdb)
+    except ValueError:
+        logger.exception("Invalid asset catalog in redis, the current one is kept")
+        return
+    if on_update is not None:
+        on_update()
+
+
+if __name__ == "__main__":
+    import argparse
+    from settings import REDIS_HOST, REDIS_PORT, REDIS_PASSWORD, REDIS_INDEX
+
+    parser = argparse.ArgumentParser(description="replace the asset catalog of the workers, or restore the default.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--upload", metavar="JSON", help=f"store this catalog, in the format of {ASSETS_FILE}")
+    group.add_argument("--reset", action="store_true", help=f"drop the stored catalog, to use {ASSETS_FILE}")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    async def update():
+        async with redis.Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=REDIS_INDEX) as r:
+            if args.upload:
+                await store_assets(read_assets_file(args.upload), r)
+            else:
+                await reset_assets(r)
+
+    asyncio.run(update())
+    logger.info("Asset catalog updated.")
@@ -0,0 +1,256 @@
+import json
+import zlib
+import brotli
+from typing import Dict, Iterable, Union
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import zstandard
+except ImportError:
+    # zstd is only offered when the optional `zstandard` package is installed
+    zstandard = None
+
+
+# preferred encodings first, used when the client accepts several of them with the same quality
+SUPPORTED_ENCODINGS = ("br", "zstd", "gzip") if zstandard else ("br", "gzip")
+
+# responses of these types are not compressed
+_UNCOMPRESSED_MEDIA_TYPES = ("text/event-stream", "image/", "video/", "audio/", "application/zip", "application/gzip")
+
+
+def parse_accept_encoding(accept_encoding: Union[str, None]) -> Dict[str, float]:
+    """
+    parse an Accept-Encoding header into the quality value of each encoding.
+
+    Args:
+        accept_encoding (Union[str, None]): value of the header. for example: "gzip, br;q=0.8".
+
+    Returns:
+        Dict[str, float]: quality of each encoding. for example: {"gzip": 1.0, "br": 0.8}.
+    """
+    qualities = {}
+    for item in (accept_encoding or "").split(","):
+        encoding, _, params = item.partition(";")
+        encoding = encoding.strip().lower()
+        if not encoding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        qualities[encoding] = q
+    return qualities
+
+
+def choose_encoding(accept_encoding: Union[str, None], available: Iterable[str] = SUPPORTED_ENCODINGS) -> str:
+    """
+    choose the content encoding of a response according to the Accept-Encoding header of the request.
+
+    Args:
+        accept_encoding (Union[str, None]): value of the Accept-Encoding header.
+        available (Iterable[str], optional): encodings we can provide, preferred ones first. Defaults to SUPPORTED_ENCODINGS.
+
+    Returns:
+        str: the chosen encoding, or "identity" if the client accepts none of the available encodings.
+    """
+    qualities = parse_accept_encoding(accept_encoding)
+    best, best_q = "identity", 0.0
+    for encoding in available:
+        q = qualities.get(encoding, qualities.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+class _Compressor:
+    """
+    incremental compressor of a response body.
+    """
+
+    def __init__(self, encoding: str, gzip_level: int, brotli_quality: int, zstd_level: int):
+        if encoding == "gzip":
+            compressor = zlib.compressobj(gzip_level, zlib.DEFLATED, 31)  # wbits=31: gzip container
+            self.compress, self.finish = compressor.compress, compressor.flush
+        elif encoding == "br":
+            compressor = brotli.Compressor(quality=brotli_quality)
+            self.compress, self.finish = compressor.process, compressor.finish
+        elif encoding == "zstd":
+            compressor = zstandard.ZstdCompressor(level=zstd_level).compressobj()
+            self.compress, self.finish = compressor.compress, compressor.flush
+        else:
+            raise ValueError(f"unsupported encoding '{encoding}'")
+
+
+class CompressionMiddleware:
+    """
+    compress responses with br/gzip/zstd according to the Accept-Encoding header of the request.
+
+    bodies smaller than `minimum_size` and responses that already have a Content-Encoding (like the
+    pre-compressed bodies of /get_prices) are sent as they are. streamed bodies are compressed chunk by chunk.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        minimum_size: int = 500,
+        gzip_level: int = 6,
+        brotli_quality: int = 4,
+        zstd_level: int = 3,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.zstd_level = zstd_level
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        if encoding == "identity":
+            await self.app(scope, receive, send)
+            return
+        await _CompressedResponder(self, encoding, send).run(scope, receive)
+
+
+class _CompressedResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send: Send):
+        self.middleware = middleware
+        self.app = middleware.app
+        self.encoding = encoding
+        self.send = send
+        self.start_message: Union[Message, None] = None
+        self.compressor: Union[_Compressor, None] = None
+        self.passthrough = False
+
+    async def run(self, scope: Scope, receive: Receive):
+        await self.app(scope, receive, self.send_wrapper)
+
+    async def send_wrapper(self, message: Message):
+        if message["type"] == "http.response.start":
+            # hold the headers until we see the body and know whether to compress it
+            self.start_message = {**message, "headers": list(message["headers"])}
+            headers = Headers(raw=message["headers"])
+            media_type = headers.get("content-type", "")
+            self.passthrough = (
+                "content-encoding" in headers
+                or message["status"] < 200
+                or message["status"] in (204, 304)
+                or media_type.startswith(_UNCOMPRESSED_MEDIA_TYPES)
+            )
+            if self.passthrough:
+                await self.send(message)
+            return
+
+        if message["type"] != "http.response.body" or self.passthrough:
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.compressor is None:
+            headers = MutableHeaders(raw=self.start_message["headers"])
+            if not more_body and len(body) < self.middleware.minimum_size:
+                # too small to be worth compressing
+                self.passthrough = True
+                await self.send(self.start_message)
+                await self.send(message)
+                return
+            self.compressor = _Compressor(
+                self.encoding, self.middleware.gzip_level, self.middleware.brotli_quality, self.middleware.zstd_level
+            )
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                # streamed response: the compressed length is unknown
+                del headers["Content-Length"]
+            else:
+                body = self.compressor.compress(body) + self.compressor.finish()
+                headers["Content-Length"] = str(len(body))
+                await self.send(self.start_message)
+                await self.send({"type": "http.response.body", "body": body})
+                return
+            await self.send(self.start_message)
+
+        if more_body:
+            await self.send({"type": "http.response.body", "body": self.compressor.compress(body), "more_body": True})
+        else:
+            body = self.compressor.compress(body) + self.compressor.finish()
+            await self.send({"type": "http.response.body", "body": body})
+
+
+class RequestDecompressionMiddleware:
+    """
+    decompress request bodies sent with "Content-Encoding: gzip" (like the submissions of the data submitter),
+    so the endpoints see plain bodies.
+
+    bodies that decompress to more than `max_size` bytes are rejected with 413, invalid ones with 400 and other
+    encodings with 415.
+    """
+
+    def __init__(self, app: ASGIApp, max_size: int = 10 * 1024 * 1024):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = Headers(scope=scope).get("content-encoding", "identity").strip().lower()
+        if encoding == "identity":
+            await self.app(scope, receive, send)
+            return
+        if encoding != "gzip":
+            await _send_error(send, 415, f"unsupported content encoding '{encoding}'")
+            return
+
+        decompressor = zlib.decompressobj(31)  # wbits=31: gzip container
+        chunks, size = [], 0
+        more_body = True
+        try:
+            while more_body:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                more_body = message.get("more_body", False)
+                # never inflate more than one byte past the limit
+                chunk = decompressor.decompress(message.get("body", b""), self.max_size - size + 1)
+                size += len(chunk)
+                if size > self.max_size or decompressor.unconsumed_tail:
+                    await _send_error(send, 413, "request body is too large")
+                    return
+                chunks.append(chunk)
+            chunks.append(decompressor.flush())
+            if not decompressor.eof:
+                raise zlib.error("incomplete gzip stream")
+        except zlib.error:
+            await _send_error(send, 400, "invalid gzip request body")
+            return
+        body = b"".join(chunks)
+
+        headers = MutableHeaders(raw=list(scope["headers"]))
+        del headers["content-encoding"]
+        headers["content-length"] = str(len(body))
+        scope = {**scope, "headers": headers.raw}
+        sent = False
+
+        async def receive_decompressed() -> Message:
+            nonlocal sent
+            if sent:
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await self.app(scope, receive_decompressed, send)
+
+
+async def _send_error(send: Send, status_code: int, detail: str):
+    body = json.dumps({"detail": detail}).encode("utf-8")
+    headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    await send({"type": "http.response.start", "status": status_code, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
@@ -1,14 +1,38 @@
 """
-TODO: use httpx.AsyncClient (pip install httpx) instead of requests.get
+crawlers of the price sources.
+
+every source is described by a `CrawlerSource` in CRAWLER_SOURCES: how to fetch it, its timeout, retries and
+crawl interval. `crawl_all` crawls the sources concurrently over one pooled http/2 client, so a crawl takes as long
+as the slowest source, and `run_schedules` crawls every source on its own interval.
+
+the pages are parsed by plain functions of their content (`parse_*_prices`), so they can be tested on saved pages.
+the html parser backend is chosen per source (CrawlerSource.parser), see HTML_PARSERS.
+
+with a `CrawlCache`, pages are fetched with conditional requests and unchanged sources are reported as such,
+so their prices don't need to be parsed or submitted again.
 """
 
+import asyncio
+import hashlib
+import json
+import os
+import time
 import bonbast.main
 import bonbast.models
-import requests
-from bs4 import BeautifulSoup
-from data_tools import PriceData, translate_prices
+import httpx
+from bs4 import BeautifulSoup, SoupStrainer
+from pydantic import BaseModel
+from data_tools import PriceData, RawPrice, translate_prices, translation_index
 from datetime import datetime, timezone, timedelta
-from typing import List
+from functools import partial
+from metrics_tools import CRAWL_DURATION, CRAWL_PRICES, CRAWLS
+from typing import Awaitable, Callable, Dict, Iterator, List, Tuple, Union
+
+try:
+    import lxml.html
+except ImportError:
+    # without lxml, pages are parsed by the pure-python html.parser
+    lxml = None
 
 # Define the offset for Tehran timezone (UTC+3:30)
 tehran_offset = timedelta(hours=3, minutes=30)
@@ -16,115 +40,408 @@ tehran_offset = timedelta(hours=3, minutes=30)
 # Create a timezone object for Tehran
 tehran_tz = timezone(tehran_offset)
 
+# html parser backends of the pages, fastest first:
+# - "lxml": lxml.html, the C parser of libxml2.
+# - "soup": BeautifulSoup with html.parser, building the tree of the <tr> rows only (SoupStrainer).
+HTML_PARSERS = ("lxml", "soup") if lxml else ("soup",)
 
-def get_bonbast_prices(check_website_is_available_first: bool = False) -> List[PriceData]:
-    if check_website_is_available_first:
-        try:
-            requests.get("https://bonbast.com", timeout=20)
-        except requests.exceptions.ConnectTimeout as e:
-            return [PriceData(code="ERROR", description=str(e))]
-    collections = bonbast.main.get_prices()
-    prices = []
+BONBAST_URL = "https://bonbast.com"
+TGJU_URL = "https://www.tgju.org/currency"
+IRANJIB_CAR_URL = "https://www.iranjib.ir/showgroup/45/%D9%82%DB%8C%D9%85%D8%AA-%D8%AE%D9%88%D8%AF%D8%B1%D9%88-%D8%AA%D9%88%D9%84%DB%8C%D8%AF-%D8%AF%D8%A7%D8%AE%D9%84/"
+
+
+def parse_bonbast_prices(collections) -> List[PriceData]:
+    """
+    convert the models returned by `bonbast.main.get_prices` into prices.
+
+    Args:
+        collections: tuple of the lists of currencies, coins and golds.
+
+    Returns:
+        List[PriceData]: translated prices.
+    """
+    now = datetime.now(tz=tehran_tz).isoformat()
+    prices: List[RawPrice] = []
     for collection in collections:
         for model in collection:
             if isinstance(model, bonbast.models.Currency) or isinstance(model, bonbast.models.Coin):
-                prices.append(
-                    PriceData(
-                        code=model.code,
-                        source="bonbast",
-                        price_high=model.sell,
-                        price_low=model.buy,
-                        time=datetime.now(tz=tehran_tz).isoformat(),
-                    )
-                )
+                prices.append((model.code, "bonbast", model.sell, model.buy, now))
             elif isinstance(model, bonbast.models.Gold):
-                prices.append(
-                    PriceData(
-                        code=model.code,
-                        source="bonbast",
-                        price_high=float(model.price),
-                        time=datetime.now(tz=tehran_tz).isoformat(),
-                    )
-                )
-    prices = translate_prices(prices)
-    return prices
+                prices.append((model.code, "bonbast", float(model.price), 0, now))
+    return translate_prices(prices)
 
 
-def get_tgju_prices() -> List[PriceData]:
-    url = "https://www.tgju.org/currency"
-    response = requests.get(url)
-    prices = []
-
-    # Check if the request was successful (status code 200)
-    if response.status_code == 200:
-        # Parse the HTML content using BeautifulSoup
-        soup = BeautifulSoup(response.text, "html.parser")
-
-        # Find all links (a tags) on the page
-        sections = soup.find_all("tr")
-
-        # Extract and print the URLs of the links
-        for sec in sections:
-            name = sec.get("data-market-nameslug")
-            price = sec.get("data-price")
-            try:
-                prices.append(
-                    PriceData(
-                        code=name,
-                        source="tgju",
-                        price_high=float(price.replace(",", "")),
-                        price_low=float(price.replace(",", "")),
-                        time=datetime.now(tz=tehran_tz).isoformat(),
-                    )
-                )
-            except Exception as e:
-                pass
+def _tgju_rows(html: str, parser: str) -> Iterator[Tuple[str, str]]:
+    # (name slug, price) of the rows of the price tables
+    if parser == "lxml":
+        for tr in lxml.html.fromstring(html).iterfind(".//tr[@data-market-nameslug]"):
+            yield tr.get("data-market-nameslug"), tr.get("data-price")
     else:
-        print(f"Failed to retrieve webpage: {response.status_code}")
-    prices = translate_prices(prices)
-    return prices
+        strainer = SoupStrainer("tr", attrs={"data-market-nameslug": True})
+        for tr in BeautifulSoup(html, "html.parser", parse_only=strainer).find_all("tr"):
+            yield tr.get("data-market-nameslug"), tr.get("data-price")
 
 
-def get_car_prices() -> List[PriceData]:
+def _car_rows(html: str, parser: str) -> Iterator[Tuple[str, Union[str, None], Union[str, None]]]:
+    # (name, market price, factory price) of the rows of the price tables. a price is None if its cell has no <span>
+    if parser == "lxml":
+        for tr in lxml.html.fromstring(html).iter("tr"):
+            tds = tr.findall("td")
+            a = tds[0].find(".//a") if len(tds) >= 3 else None
+            if a is None:
+                continue
+            market, factory = [td.find(".//span") for td in tds[1:3]]
+            yield (
+                a.text_content(),
+                None if market is None else market.text_content(),
+                None if factory is None else factory.text_content(),
+            )
+    else:
+        for tr in BeautifulSoup(html, "html.parser", parse_only=SoupStrainer("tr")).find_all("tr"):
+            tds = tr.find_all("td", recursive=False)
+            a = tds[0].a if len(tds) >= 3 else None
+            if a is None:
+                continue
+            market, factory = tds[1].span, tds[2].span
+            yield a.text, None if market is None else market.text, None if factory is None else factory.text
+
+
+def parse_tgju_prices(html: str, parser: str = HTML_PARSERS[0]) -> List[PriceData]:
     """
-    get car price from iranjib.ir
+    extract prices from the currency page of tgju.org.
+
+    Args:
+        html (str): content of the page.
+        parser (str, optional): one of HTML_PARSERS. Defaults to the fastest available.
+
+    Returns:
+        List[PriceData]: translated prices.
     """
-    url = "https://www.iranjib.ir/showgroup/45/%D9%82%DB%8C%D9%85%D8%AA-%D8%AE%D9%88%D8%AF%D8%B1%D9%88-%D8%AA%D9%88%D9%84%DB%8C%D8%AF-%D8%AF%D8%A7%D8%AE%D9%84/"
-    response = requests.get(url)
-    prices = []
-
-    if response.status_code == 200:
-        # Parse the HTML content using BeautifulSoup
-        soup = BeautifulSoup(response.text, "html.parser")
-        for tr in soup.find_all("tr"):
-            try:
-                tds = tr.find_all("td")
-                code = tds[0].a.text
-                pr_market, pr_factory = 0, 0
-                try:
-                    pr_market = float(tds[1].span.text.replace(",", ""))
-                    pr_factory = float(tds[2].span.text.replace(",", ""))
-                except AttributeError:
-                    pass
-                if pr_market == 0 and pr_factory == 0:
-                    continue
-                prices.append(
-                    PriceData(
-                        code=code,
-                        source="iranjib",
-                        price_high=pr_market,
-                        price_low=pr_factory,
-                        time=datetime.now(tz=tehran_tz).isoformat(),
-                    )
-                )
-            except Exception as e:
-                pass
-    else:
-        print(f"Failed to retrieve webpage: {response.status_code}")
-    prices = translate_prices(prices)
+    translate_dict = translation_index.get("tgju", {})
+    now = datetime.now(tz=tehran_tz).isoformat()
+    prices: List[RawPrice] = []
+    for name, price in _tgju_rows(html, parser):
+        # skip the rows we can't translate before converting anything
+        if name not in translate_dict or not price:
+            continue
+        try:
+            value = float(price.replace(",", ""))
+        except ValueError:
+            continue
+        prices.append((name, "tgju", value, value, now))
+    return translate_prices(prices)
+
+
+def parse_car_prices(html: str, parser: str = HTML_PARSERS[0]) -> List[PriceData]:
+    """
+    extract car prices from the car group page of iranjib.ir.
+
+    Args:
+        html (str): content of the page.
+        parser (str, optional): one of HTML_PARSERS. Defaults to the fastest available.
+
+    Returns:
+        List[PriceData]: translated prices.
+    """
+    translate_dict = translation_index["iranjib"]
+    now = datetime.now(tz=tehran_tz).isoformat()
+    prices: List[RawPrice] = []
+    for name, market, factory in _car_rows(html, parser):
+        # skip the rows we can't translate, and the ones without market price
+        if name not in translate_dict or market is None:
+            continue
+        try:
+            pr_market = float(market.replace(",", ""))
+            pr_factory = float(factory.replace(",", "")) if factory is not None else 0
+        except ValueError:
+            continue
+        if pr_market == 0 and pr_factory == 0:
+            continue
+        prices.append((name, "iranjib", pr_market, pr_factory, now))
+    return translate_prices(prices)
+
+
+async def fetch_page_prices(
+    client: httpx.AsyncClient, url: str, parse: Callable[[str], List[PriceData]], result: "CrawlResult"
+) -> Union[List[PriceData], None]:
+    """
+    fetch a page and parse its prices. the request is conditional on the validators of the last crawl
+    (`result.validators`), which are replaced by the ones of the response.
+
+    Args:
+        client (httpx.AsyncClient): the shared http client.
+        url (str): url of the page.
+        parse (Callable[[str], List[PriceData]]): parser of the page.
+        result (CrawlResult): result of the crawl in progress.
+
+    Returns:
+        Union[List[PriceData], None]: prices, or None if the page is not modified.
+    """
+    headers = {}
+    if "etag" in result.validators:
+        headers["If-None-Match"] = result.validators["etag"]
+    if "last-modified" in result.validators:
+        headers["If-Modified-Since"] = result.validators["last-modified"]
+    response = await client.get(url, headers=headers)
+    if response.status_code == 304:
+        return None
+    response.raise_for_status()
+    prices = parse(response.text)
+    result.validators = {k: response.headers[k] for k in ("etag", "last-modified") if k in response.headers}
     return prices
 
 
-# prices = get_car_prices()
-# prices = get_bonbast_prices()
-# print(prices)
+async def fetch_bonbast_prices(
+    client: httpx.AsyncClient, source: "CrawlerSource", result: "CrawlResult"
+) -> List[PriceData]:
+    # the bonbast library is blocking (requests), run it in a thread so it doesn't hold the other sources
+    try:
+        collections = await asyncio.to_thread(bonbast.main.get_prices)
+    except SystemExit as e:
+        # the library exits on connection errors
+        raise ConnectionError(str(e))
+    return parse_bonbast_prices(collections)
+
+
+async def fetch_tgju_prices(
+    client: httpx.AsyncClient, source: "CrawlerSource", result: "CrawlResult"
+) -> Union[List[PriceData], None]:
+    return await fetch_page_prices(client, TGJU_URL, partial(parse_tgju_prices, parser=source.parser), result)
+
+
+async def fetch_car_prices(
+    client: httpx.AsyncClient, source: "CrawlerSource", result: "CrawlResult"
+) -> Union[List[PriceData], None]:
+    return await fetch_page_prices(client, IRANJIB_CAR_URL, partial(parse_car_prices, parser=source.parser), result)
+
+
+class CrawlerSource(BaseModel):
+    name: str  # name of the source, for example, "tgju".
+    # coroutine function fetching the prices, or returning None if the source is not modified since the last crawl.
+    fetch: Callable[[httpx.AsyncClient, "CrawlerSource", "CrawlResult"], Awaitable[Union[List[PriceData], None]]]
+    parser: str = HTML_PARSERS[0]  # html parser backend of the pages, one of HTML_PARSERS.
+    timeout: float = 20  # seconds allowed for each attempt.
+    retries: int = 2  # number of retries after a failed attempt.
+    backoff: float = 1  # seconds to wait before the first retry, doubled for each next retry.
+    interval: float = 15 * 60  # seconds between two crawls of the source, see `run_schedules`.
+
+
+class CrawlResult(BaseModel):
+    source: str  # name of the source.
+    prices: List[PriceData] = []  # crawled prices, empty if the crawl failed or the page was not modified.
+    error: str = ""  # error of the last attempt if all attempts failed.
+    attempts: int = 0  # number of attempts made.
+    elapsed: float = 0  # seconds spent on the crawl, including retries.
+    unchanged: bool = False  # the prices are the same as the ones of the last committed crawl, see `CrawlCache`.
+    validators: Dict[str, str] = {}  # "etag" and "last-modified" headers of the crawled page.
+    digest: str = ""  # hash of the crawled prices, see `prices_digest`.
+
+
+def prices_digest(prices: List[PriceData]) -> str:
+    """
+    hash of the codes and values of prices. their times are not included, so it only changes when a price changes.
+    """
+    content = json.dumps([(p.code, p.price_high, p.price_low) for p in prices])
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class CrawlCache:
+    """
+    on-disk state of the last committed crawl of every source: the validators (ETag, Last-Modified) of its page
+    and the digest of its prices.
+
+    a crawl with a cache sends conditional requests and marks its result as `unchanged` when the page is not
+    modified (without parsing it) or its prices have the same digest. the consumer of the results should `commit`
+    a result only after it has handled it (submitted the prices), so a failed submission is retried on the next crawl.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Args:
+            directory (str): directory of the cache files. it's created if it doesn't exist.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, source: str) -> str:
+        return os.path.join(self.directory, f"{source}.json")
+
+    def load(self, source: str) -> dict:
+        """
+        get the state of the last committed crawl of a source: {"validators": {...}, "digest": "..."}.
+        """
+        try:
+            with open(self._path(source), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"validators": {}, "digest": ""}
+
+    def clear(self):
+        """
+        forget the state of all sources.
+        """
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                os.remove(os.path.join(self.directory, name))
+
+    def commit(self, result: CrawlResult):
+        """
+        store the state of a handled crawl. failed crawls are ignored.
+        """
+        if result.error:
+            return
+        state = self.load(result.source)
+        state["validators"] = result.validators
+        if result.digest:  # a not modified page is not parsed and keeps the digest of the last crawl
+            state["digest"] = result.digest
+        tmp = self._path(result.source) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, self._path(result.source))
+
+
+CRAWLER_SOURCES = {
+    "bonbast": CrawlerSource(name="bonbast", fetch=fetch_bonbast_prices, timeout=30),
+    "tgju": CrawlerSource(name="tgju", fetch=fetch_tgju_prices),
+    "iranjib": CrawlerSource(name="iranjib", fetch=fetch_car_prices, interval=60 * 60),
+}
+
+
+def create_client(**kwargs) -> httpx.AsyncClient:
+    """
+    create the http client shared by the crawlers: http/2, keep-alive connections and redirects followed.
+    keyword arguments are passed to `httpx.AsyncClient`, for example, `transport` in tests.
+    """
+    return httpx.AsyncClient(
+        http2=True,
+        follow_redirects=True,
+        limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        **kwargs,
+    )
+
+
+async def crawl_source(
+    client: httpx.AsyncClient, source: CrawlerSource, cache: Union[CrawlCache, None] = None
+) -> CrawlResult:
+    """
+    crawl a source, retrying failed attempts with exponential backoff. it never raises, errors are reported in the result.
+
+    Args:
+        client (httpx.AsyncClient): the shared http client.
+        source (CrawlerSource): the source to crawl.
+        cache (Union[CrawlCache, None], optional): state of the last crawls, to detect unchanged sources. Defaults to None.
+
+    Returns:
+        CrawlResult: prices or error of the crawl.
+    """
+    t0 = time.perf_counter()
+    state = cache.load(source.name) if cache else {"validators": {}, "digest": ""}
+    result = CrawlResult(source=source.name, validators=state["validators"])
+    for attempt in range(source.retries + 1):
+        if attempt > 0:
+            await asyncio.sleep(source.backoff * 2 ** (attempt - 1))
+        result.attempts += 1
+        try:
+            prices = await asyncio.wait_for(source.fetch(client, source, result), source.timeout)
+            result.error = ""
+            break
+        except asyncio.TimeoutError:
+            result.error = f"timed out after {source.timeout} seconds"
+        except Exception as e:
+            result.error = f"{type(e).__name__}: {e}"
+    if not result.error:
+        if prices is None:
+            result.unchanged = True
+        else:
+            result.prices = prices
+            result.digest = prices_digest(prices)
+            result.unchanged = result.digest == state["digest"]
+    result.elapsed = time.perf_counter() - t0
+    CRAWL_DURATION.labels(source.name).observe(result.elapsed)
+    CRAWLS.labels(source.name, "error" if result.error else "unchanged" if result.unchanged else "changed").inc()
+    if not result.error:
+        CRAWL_PRICES.labels(source.name).set(len(result.prices))
+    return result
+
+
+async def crawl_all(
+    sources: Union[List[CrawlerSource], None] = None,
+    client: Union[httpx.AsyncClient, None] = None,
+    cache: Union[CrawlCache, None] = None,
+) -> Dict[str, CrawlResult]:
+    """
+    crawl the sources concurrently.
+
+    Args:
+        sources (Union[List[CrawlerSource], None], optional): sources to crawl. Defaults to all CRAWLER_SOURCES.
+        client (Union[httpx.AsyncClient, None], optional): http client to use. Defaults to a new one from `create_client`.
+        cache (Union[CrawlCache, None], optional): state of the last crawls, to detect unchanged sources. Defaults to None.
+
+    Returns:
+        Dict[str, CrawlResult]: result of each source by its name.
+    """
+    if sources is None:
+        sources = list(CRAWLER_SOURCES.values())
+    if client is None:
+        async with create_client() as client:
+            return await crawl_all(sources, client, cache)
+    results = await asyncio.gather(*[crawl_source(client, source, cache) for source in sources])
+    return {result.source: result for result in results}
+
+
+async def run_schedules(
+    on_result: Callable[[CrawlResult], Awaitable[None]],
+    sources: Union[List[CrawlerSource], None] = None,
+    client: Union[httpx.AsyncClient, None] = None,
+    cache: Union[CrawlCache, None] = None,
+):
+    """
+    crawl every source on its own interval, until cancelled. the interval is counted from the start of a crawl,
+    so a slow source doesn't delay the others or drift its own schedule.
+
+    Args:
+        on_result (Callable[[CrawlResult], Awaitable[None]]): coroutine function called with the result of every crawl.
+        sources (Union[List[CrawlerSource], None], optional): sources to crawl. Defaults to all CRAWLER_SOURCES.
+        client (Union[httpx.AsyncClient, None], optional): http client to use. Defaults to a new one from `create_client`.
+        cache (Union[CrawlCache, None], optional): state of the last crawls, to detect unchanged sources. Defaults to None.
+    """
+    if sources is None:
+        sources = list(CRAWLER_SOURCES.values())
+    if client is None:
+        async with create_client() as client:
+            return await run_schedules(on_result, sources, client, cache)
+
+    async def schedule(source: CrawlerSource):
+        while True:
+            t0 = time.monotonic()
+            await on_result(await crawl_source(client, source, cache))
+            await asyncio.sleep(max(0, source.interval - (time.monotonic() - t0)))
+
+    await asyncio.gather(*[schedule(source) for source in sources])
+
+
+def _crawl_sync(name: str) -> List[PriceData]:
+    result = asyncio.run(crawl_all([CRAWLER_SOURCES[name]]))[name]
+    if result.error:
+        print(f"Failed to crawl {name}: {result.error}")
+    return result.prices
+
+
+def get_bonbast_prices(check_website_is_available_first: bool = False) -> List[PriceData]:
+    if check_website_is_available_first:
+        try:
+            httpx.get(BONBAST_URL, timeout=20)
+        except httpx.ConnectTimeout as e:
+            return [PriceData(code="ERROR", description=str(e))]
+    return _crawl_sync("bonbast")
+
+
+def get_tgju_prices() -> List[PriceData]:
+    return _crawl_sync("tgju")
+
+
+def get_car_prices() -> List[PriceData]:
+    """
+    get car price from iranjib.ir
+    """
+    return _crawl_sync("iranjib")
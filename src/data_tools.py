@@ -1,115 +1,24 @@
 from pydantic import BaseModel
-from typing import List
+from typing import Dict, Iterable, List, Tuple, Union
 from datetime import datetime
+from functools import lru_cache
 import numpy as np
+import os
 
 
-# Supported asset categories
-_CURRENCY = "currency"
-_COMMODITY = "commodity"
-_DIGITAL_CURRENCY = "digital_currency"
-_CAR = "car"
-
-
-MAIN_CODES = {
-    # Currencies
-    "USD-TMN": (_CURRENCY, "US Dollar - IR Toman"),  # code: (category, description)
-    "EUR-TMN": (_CURRENCY, "EURO - IR Toman"),
-    "GBP-TMN": (_CURRENCY, "British Pound - IR Toman"),
-    "CHF-TMN": (_CURRENCY, "Swiss Franc - IR Toman"),
-    "CAD-TMN": (_CURRENCY, "Canadian Dollar - IR Toman"),
-    "AUD-TMN": (_CURRENCY, "Australian Dollar - IR Toman"),
-    "SEK-TMN": (_CURRENCY, "Swedish Krona - IR Toman"),
-    "NOK-TMN": (_CURRENCY, "Norwegian Krone - IR Toman"),
-    "RUB-TMN": (_CURRENCY, "Russian Ruble - IR Toman"),
-    "THB-TMN": (_CURRENCY, "Thai Baht - IR Toman"),
-    "SGD-TMN": (_CURRENCY, "Singapore Dollar - IR Toman"),
-    "HKD-TMN": (_CURRENCY, "Hong Kong Dollar - IR Toman"),
-    "AZN-TMN": (_CURRENCY, "Azerbaijani Manat - IR Toman"),
-    "AMD-TMN": (_CURRENCY, "10Armenian Dram - IR Toman"),
-    "DKK-TMN": (_CURRENCY, "Danish Krone - IR Toman"),
-    "AED-TMN": (_CURRENCY, "UAE Dirham - IR Toman"),
-    "JPY-TMN": (_CURRENCY, "10Japanese Yen - IR Toman"),
-    "TRY-TMN": (_CURRENCY, "Turkish Lira - IR Toman"),
-    "CNY-TMN": (_CURRENCY, "Chinese Yuan - IR Toman"),
-    "SAR-TMN": (_CURRENCY, "KSA Riyal - IR Toman"),
-    "INR-TMN": (_CURRENCY, "Indian Rupee - IR Toman"),
-    "MYR-TMN": (_CURRENCY, "Ringgit - IR Toman"),
-    "AFN-TMN": (_CURRENCY, "Afghan Afghani - IR Toman"),
-    "KWD-TMN": (_CURRENCY, "Kuwaiti Dinar - IR Toman"),
-    "IQD-TMN": (_CURRENCY, "100Iraqi Dinar - IR Toman"),
-    "BHD-TMN": (_CURRENCY, "Bahraini Dinar - IR Toman"),
-    "OMR-TMN": (_CURRENCY, "Omani Rial - IR Toman"),
-    "QAR-TMN": (_CURRENCY, "Qatari Riyal - IR Toman"),
-    # Assets
-    "SEKKE-EMAMI-TMN": (_COMMODITY, "Sekke Emami Tamam - IR Toman"),
-    "SEKKE-GERAMI-TMN": (_COMMODITY, "Sekke 1Gerami - IR Toman"),
-    "SEKKE-AZADI-TMN": (_COMMODITY, "Sekke Azadi Tamam - IR Toman"),
-    "SEKKE-NIM-TMN": (_COMMODITY, "Sekke Azadi Nim - IR Toman"),
-    "SEKKE-ROB-TMN": (_COMMODITY, "Sekke Azadi Rob - IR Toman"),
-    "TALA-MESGHAL-TMN": (_COMMODITY, "Tala18 Mesghal - IR Toman"),
-    "TALA-GERAM-TMN": (_COMMODITY, "Tala18 Gerami - IR Toman"),
-    "OUNCE-USD": (_COMMODITY, "Ounce Jahani - US Dollar"),
-    "BITCOIN-USD": (_DIGITAL_CURRENCY, "Bitcoin - US Dollar"),
-    # Cars Irankhodro
-    "CAR-ARISAN": (_CAR, "ایرانخودرو وانت آریسان (ارتقاء)"),
-    "CAR-SOREN": (_CAR, "ایرانخودرو سورن پلاس موتور XU7P"),
-    "CAR-DENA": (_CAR, "دنا پلاس توربو 6 سرعته (ارتقاء)"),
-    "CAR-PEUGEOT-PARS": (_CAR, "پژو پارس"),
-    # Cars Saipa
-    "CAR-ATLAS": (_CAR, "سایپا اطلس"),
-    "CAR-SAINA-S": (_CAR, "سایپا ساینا اس"),
-}
+# the asset catalog (see load_assets), loaded from ASSETS_FILE and possibly replaced at runtime by catalog_tools.
+# the dicts below are its indexes: they are updated in place, so they can be imported by the other modules.
+ASSETS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets.json")
 
-bonbast_translate_dict = {
-    "USD": "USD-TMN",
-    "EUR": "EUR-TMN",
-    "GBP": "GBP-TMN",
-    "CHF": "CHF-TMN",
-    "CAD": "CAD-TMN",
-    "AUD": "AUD-TMN",
-    "SEK": "SEK-TMN",
-    "NOK": "NOK-TMN",
-    "RUB": "RUB-TMN",
-    "THB": "THB-TMN",
-    "SGD": "SGD-TMN",
-    "HKD": "HKD-TMN",
-    "AZN": "AZN-TMN",
-    "AMD": "AMD-TMN",
-    "DKK": "DKK-TMN",
-    "AED": "AED-TMN",
-    "JPY": "JPY-TMN",
-    "TRY": "TRY-TMN",
-    "CNY": "CNY-TMN",
-    "SAR": "SAR-TMN",
-    "INR": "INR-TMN",
-    "MYR": "MYR-TMN",
-    "AFN": "AFN-TMN",
-    "KWD": "KWD-TMN",
-    "IQD": "IQD-TMN",
-    "BHD": "BHD-TMN",
-    "OMR": "OMR-TMN",
-    "QAR": "QAR-TMN",
-    "emami1": "SEKKE-EMAMI-TMN",
-    "azadi1g": "SEKKE-GERAMI-TMN",
-    "azadi1": "SEKKE-AZADI-TMN",
-    "azadi1_2": "SEKKE-NIM-TMN",
-    "azadi1_4": "SEKKE-ROB-TMN",
-    "mithqal": "TALA-MESGHAL-TMN",
-    "gol18": "TALA-GERAM-TMN",
-    "ounce": "OUNCE-USD",
-    "bitcoin": "BITCOIN-USD",
-}
+MAIN_CODES: Dict[str, Tuple[str, str]] = {}  # code: (category, description), in the order of the catalog
+CODES_BY_CATEGORY: Dict[str, List[str]] = {}  # category: codes of its assets, in the order of the catalog
 
-iranjib_transtale_dict = {
-    # Irankhodro
-    "وانت آریسان (ارتقاء)": "CAR-ARISAN",
-    "سورن پلاس موتور XU7P": "CAR-SOREN",
-    "دنا پلاس توربو 6 سرعته (ارتقاء)": "CAR-DENA",
-    "پژو پارس": "CAR-PEUGEOT-PARS",
-    # Saipa
-    "اطلس": "CAR-ATLAS",
-    "ساینا S": "CAR-SAINA-S",
+# translation dict of each source: code of the asset in the source: our code
+bonbast_translate_dict: Dict[str, str] = {}
+iranjib_transtale_dict: Dict[str, str] = {}
+source_translate_dicts: Dict[str, Dict[str, str]] = {
+    "bonbast": bonbast_translate_dict,
+    "iranjib": iranjib_transtale_dict,
 }
 
 
@@ -125,6 +34,17 @@ class PriceData(BaseModel):
     time: str = ""  # register time of the data in the iso format: "yyyy-mm-ddThh:mm:ss.ms".
 
 
+class AssetInfo(BaseModel):
+    code: str  # code of the asset, for example, "USD-TMN".
+    category: str  # category of the asset, for example, "currency", "commodity", "digital_currency" or "car".
+    description: str = ""  # a description about the asset.
+    aliases: Dict[str, str] = {}  # source: code of the asset in the source, for example, {"bonbast": "USD"}.
+
+
+class AssetsPayload(BaseModel):
+    assets: List[AssetInfo]
+
+
 class PricesPayload(BaseModel):
     prices: List[PriceData]
 
@@ -133,39 +53,201 @@ class CodesPayload(BaseModel):
     codes: List[str]
 
 
-def translate_prices(prices: List[PriceData], prune: bool = True) -> List[PriceData]:
+class PricesDelta(BaseModel):
+    source: str = ""  # source of the prices.
+    time: str = ""  # register time of the prices in the iso format.
+    prices: List[Tuple[str, float, float]] = []  # (code, price_high, price_low) of the prices.
+
+
+class PricesDeltaPayload(BaseModel):
+    # compact form of PricesPayload: prices of the same source and time are grouped and their codes determine
+    # their category and description. it's meant for submitting only the changed prices.
+    deltas: List[PricesDelta]
+
+
+class HistoryPayload(BaseModel):
+    codes: List[str] = []  # codes of the assets. an empty list means all codes.
+    start: str  # start of the time range in the iso format. the buckets are aligned to its utc offset (utc if none).
+    end: str = ""  # end of the time range in the iso format. defaults to now.
+    bucket: str = "1h"  # bucket size, for example: "15m", "1h", "4h", "1d", "1w".
+    columnar: bool = False  # return a dict of columns for each code instead of a list of rows.
+
+
+# (code, source, price_high, price_low, time) of a price as scraped, the raw form of a PriceData
+RawPrice = Tuple[str, str, float, float, str]
+
+
+def build_translation_index(
+    translate_dicts: Dict[str, Dict[str, str]] = source_translate_dicts,
+) -> Dict[str, Dict[str, Tuple[str, str, str]]]:
+    """
+    index the translation dicts by source and raw code.
+
+    Args:
+        translate_dicts (Dict[str, Dict[str, str]], optional): translation dict of each source. Defaults to
+            source_translate_dicts.
+
+    Returns:
+        Dict[str, Dict[str, Tuple[str, str, str]]]: source: raw code: (code, category, description).
+    """
+    return {
+        source: {raw: (code, *MAIN_CODES[code]) for raw, code in translate_dict.items()}
+        for source, translate_dict in translate_dicts.items()
+    }
+
+
+# the translations of all sources, see build_translation_index
+translation_index: Dict[str, Dict[str, Tuple[str, str, str]]] = {}
+
+ASSETS: Dict[str, AssetInfo] = {}  # code: asset, in the order of the catalog
+
+
+def read_assets_file(path: str = ASSETS_FILE) -> List[AssetInfo]:
+    """
+    read an asset catalog file, the json of an AssetsPayload.
+
+    Args:
+        path (str, optional): path of the file. Defaults to ASSETS_FILE.
+
+    Returns:
+        List[AssetInfo]: the assets.
+    """
+    with open(path, encoding="utf-8") as f:
+        return AssetsPayload.model_validate_json(f.read()).assets
+
+
+def load_assets(assets: List[AssetInfo]):
+    """
+    replace the asset catalog: MAIN_CODES, CODES_BY_CATEGORY, the translation dicts and translation_index are
+    rebuilt in place, at once.
+
+    Args:
+        assets (List[AssetInfo]): the assets, in the order their prices are served.
+
+    Raises:
+        ValueError: if a code is repeated, or two assets have the same alias in a source. the catalog is unchanged.
+    """
+    by_code: Dict[str, AssetInfo] = {}
+    by_category: Dict[str, List[str]] = {}
+    translate_dicts: Dict[str, Dict[str, str]] = {}
+    for asset in assets:
+        if not asset.code or asset.code in by_code:
+            raise ValueError(f"asset code '{asset.code}' is empty or repeated.")
+        by_code[asset.code] = asset
+        by_category.setdefault(asset.category, []).append(asset.code)
+        for source, alias in asset.aliases.items():
+            translate_dict = translate_dicts.setdefault(source, {})
+            if alias in translate_dict:
+                raise ValueError(f"alias '{alias}' of source '{source}' is repeated.")
+            translate_dict[alias] = asset.code
+
+    ASSETS.clear()
+    ASSETS.update(by_code)
+    MAIN_CODES.clear()
+    MAIN_CODES.update({a.code: (a.category, a.description) for a in assets})
+    CODES_BY_CATEGORY.clear()
+    CODES_BY_CATEGORY.update(by_category)
+    for source, translate_dict in source_translate_dicts.items():
+        translate_dict.clear()
+        translate_dict.update(translate_dicts.pop(source, {}))
+    source_translate_dicts.update(translate_dicts)  # new sources
+    translation_index.clear()
+    translation_index.update(build_translation_index())
+
+
+load_assets(read_assets_file())
+
+
+def translate_prices(prices: Iterable[Union[PriceData, RawPrice]], prune: bool = True) -> List[PriceData]:
     """
     translate PriceData.code and PriceData.name according to the translation dicts.
 
     Args:
-        prices (List[PriceData]): list of price data.
+        prices (Iterable[Union[PriceData, RawPrice]]): price data, or raw prices as (code, source, price_high,
+            price_low, time) tuples so the crawlers don't build a model of every scraped row.
         prune (bool, optional): eliminate the prices whose codes/source does not exist in our dictionaries. Defaults to True.
 
     Returns:
-        List[PriceData]: translated list of the price data.
+        List[PriceData]: translated list of the price data. the input prices are not modified.
     """
-    source_dict = {
-        "bonbast": bonbast_translate_dict,
-        "iranjib": iranjib_transtale_dict,
-    }
     translated_prices = []
     for price in prices:
-        p = price.model_copy()
-        if p.source in source_dict.keys():
-            if p.code in source_dict[p.source].keys():
-                p.code = source_dict[p.source][p.code]
-                p.category = MAIN_CODES[p.code][0]
-                p.description = MAIN_CODES[p.code][1]
-                translated_prices.append(p)
+        if isinstance(price, PriceData):
+            translation = translation_index.get(price.source, {}).get(price.code)
+            if translation is not None:
+                code, category, description = translation
+                price = price.model_copy(update={"code": code, "category": category, "description": description})
+            elif prune:
+                continue
             else:
-                if not prune:
-                    translated_prices.append(p)
+                price = price.model_copy()
         else:
-            if not prune:
-                translated_prices.append(p)
+            raw_code, source, price_high, price_low, time = price
+            translation = translation_index.get(source, {}).get(raw_code)
+            if translation is not None:
+                code, category, description = translation
+                price = PriceData(
+                    code=code,
+                    category=category,
+                    description=description,
+                    source=source,
+                    price_high=price_high,
+                    price_low=price_low,
+                    time=time,
+                )
+            elif prune:
+                continue
+            else:
+                price = PriceData(code=raw_code, source=source, price_high=price_high, price_low=price_low, time=time)
+        translated_prices.append(price)
     return translated_prices
 
 
+def compact_prices(prices: List[PriceData]) -> PricesDeltaPayload:
+    """
+    convert prices into the compact PricesDeltaPayload.
+
+    Args:
+        prices (List[PriceData]): translated prices.
+
+    Returns:
+        PricesDeltaPayload: the prices grouped by source and time.
+    """
+    deltas: Dict[Tuple[str, str], PricesDelta] = {}
+    for p in prices:
+        delta = deltas.setdefault((p.source, p.time), PricesDelta(source=p.source, time=p.time))
+        delta.prices.append((p.code, p.price_high, p.price_low))
+    return PricesDeltaPayload(deltas=list(deltas.values()))
+
+
+def expand_prices(payload: PricesDeltaPayload) -> List[PriceData]:
+    """
+    convert a PricesDeltaPayload back into prices. category and description are taken from MAIN_CODES.
+
+    Args:
+        payload (PricesDeltaPayload): compact prices.
+
+    Returns:
+        List[PriceData]: the prices.
+    """
+    prices = []
+    for delta in payload.deltas:
+        for code, price_high, price_low in delta.prices:
+            category, description = MAIN_CODES.get(code, ("", ""))
+            prices.append(
+                PriceData(
+                    code=code,
+                    category=category,
+                    description=description,
+                    source=delta.source,
+                    price_high=price_high,
+                    price_low=price_low,
+                    time=delta.time,
+                )
+            )
+    return prices
+
+
 def is_prices_same_day(price1: PriceData, price2: PriceData):
     d1 = datetime.fromisoformat(price1.time)
     d2 = datetime.fromisoformat(price2.time)
@@ -174,6 +256,64 @@ def is_prices_same_day(price1: PriceData, price2: PriceData):
     return False
 
 
+@lru_cache(maxsize=None)
+def _quantize_levels(quantize_level: float) -> np.ndarray:
+    # start of every quantization level of a day, in hours. computed once per quantize_level.
+    levels = np.arange(start=0, stop=24, step=quantize_level)
+    levels.flags.writeable = False
+    return levels
+
+
+def time_of_day(times: Union[List[datetime], List[PriceData], np.ndarray]) -> np.ndarray:
+    """
+    Convert times to float numbers representing hour and minute. e.g: 10:30:35 --> 10.5
+
+    Args:
+        times (Union[List[datetime], List[PriceData], np.ndarray]): datetime objects, PriceData (their time is used)
+            or an array of np.datetime64.
+
+    Returns:
+        np.ndarray: hour + minute / 60 of every time.
+    """
+    if isinstance(times, np.ndarray) and np.issubdtype(times.dtype, np.datetime64):
+        minutes = (times - times.astype("datetime64[D]")).astype("timedelta64[m]").astype(int)
+        return minutes // 60 + minutes % 60 / 60
+    dts = [datetime.fromisoformat(t.time) if isinstance(t, PriceData) else t for t in times]
+    return np.array([dt.hour + dt.minute / 60 for dt in dts], dtype=float)
+
+
+def quantize_indices(
+    times: Union[List[datetime], List[PriceData], np.ndarray], quantize_level: float = 0.25
+) -> np.ndarray:
+    """
+    Find the quantization level of a day that every time falls in, in one vectorized search.
+
+    Args:
+        times (Union[List[datetime], List[PriceData], np.ndarray]): see `time_of_day`.
+        quantize_level (float): quantization levels. for example 0.25 means 15 minutes, 1.50 means 1 hour and 30 minutes.
+
+    Returns:
+        np.ndarray: index of the level of every time. level i starts at i * quantize_level hours.
+    """
+    return np.searchsorted(_quantize_levels(quantize_level), time_of_day(times), side="right") - 1
+
+
+def quantize_datetimes(
+    times: Union[List[datetime], List[PriceData], np.ndarray], quantize_level: float = 0.25
+) -> np.ndarray:
+    """
+    Batched version of `quantize_datetime`.
+
+    Args:
+        times (Union[List[datetime], List[PriceData], np.ndarray]): see `time_of_day`.
+        quantize_level (float): quantization levels. for example 0.25 means 15 minutes, 1.50 means 1 hour and 30 minutes.
+
+    Returns:
+        np.ndarray: time represented in hour and minute as a float number, for every time.
+    """
+    return _quantize_levels(quantize_level)[quantize_indices(times, quantize_level)]
+
+
 def quantize_datetime(dt: datetime, quantize_level: float = 0.25) -> float:
     """
     Convert datetime to a float number representing hour and minute.
@@ -185,16 +325,4 @@ def quantize_datetime(dt: datetime, quantize_level: float = 0.25) -> float:
     Returns:
         float: time represented in hour and minute as a float number.
     """
-
-    def quantize_num(num, qlist):
-        # Iterate through the list to find the closest number
-        for i in range(len(qlist) - 1):
-            if num >= qlist[i] and num < qlist[i + 1]:
-                return qlist[i]
-
-        return qlist[-1]
-
-    float_time = dt.hour + dt.minute / 60
-    qlist = np.arange(start=0, stop=24, step=quantize_level)
-    qtime = quantize_num(float_time, qlist)
-    return qtime
+    return float(quantize_datetimes([dt], quantize_level)[0])
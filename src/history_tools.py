@@ -0,0 +1,287 @@
+"""
+price history is kept in redis in two forms:
+
+- raw ticks: a sorted set per code, "{code}:ticks", scored by the timestamp of the tick.
+  members are "timestamp,price_high,price_low".
+- OHLC rollups: for each resolution in HISTORY_RESOLUTIONS, every bucket is stored in its own key,
+  "{code}:ohlc:{resolution}:{bucket start}", with a TTL equal to the retention of the resolution.
+  the starts of the buckets are indexed in the sorted set "{code}:ohlc:{resolution}", so a range query
+  reads only the buckets in the range.
+
+the buckets of all prices are on one grid, aligned to a fixed utc offset (HISTORY_UTC_OFFSET in settings.py),
+whatever the utc offset of the time of each price. buckets on this grid are regrouped into buckets of another
+offset only from a resolution whose buckets don't straddle them, see `stored_resolution`.
+
+a bucket is stored as comma separated numbers, in the order of BUCKET_FIELDS.
+"""
+
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import List, Tuple, Union
+import math
+import numpy as np
+from data_tools import PriceData
+
+
+# resolution name: bucket size in seconds
+HISTORY_RESOLUTIONS = {
+    "15m": 15 * 60,
+    "1h": 60 * 60,
+    "1d": 24 * 60 * 60,
+}
+
+BUCKET_FIELDS = (
+    "start",  # start of the bucket (unix timestamp)
+    "count",  # number of ticks in the bucket
+    "first",  # timestamp of the first tick
+    "last",  # timestamp of the last tick
+    "price_high_open",
+    "price_high_max",
+    "price_high_min",
+    "price_high_close",
+    "price_high_sum",
+    "price_low_open",
+    "price_low_max",
+    "price_low_min",
+    "price_low_close",
+    "price_low_sum",
+)
+
+
+def ticks_key(code: str) -> str:
+    return f"{code}:ticks"
+
+
+def index_key(code: str, resolution: str) -> str:
+    return f"{code}:ohlc:{resolution}"
+
+
+def bucket_key(code: str, resolution: str, start: int) -> str:
+    return f"{code}:ohlc:{resolution}:{start}"
+
+
+def price_timestamp(price: PriceData) -> Tuple[float, int]:
+    """
+    get the unix timestamp of a price and the utc offset of its time.
+    times without timezone are considered utc.
+
+    Args:
+        price (PriceData): price data.
+
+    Returns:
+        Tuple[float, int]: unix timestamp and utc offset in seconds.
+    """
+    return _parse_time(price.time)
+
+
+@lru_cache(maxsize=1024)
+def _parse_time(time: str) -> Tuple[float, int]:
+    # the prices of a submission mostly share their time
+    dt = datetime.fromisoformat(time)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp(), int(dt.utcoffset().total_seconds())
+
+
+def bucket_start(timestamp: float, utc_offset: int, resolution: str) -> int:
+    """
+    get the start of the bucket that a timestamp falls in.
+    buckets are aligned to a local time, so daily buckets start at local midnight.
+
+    Args:
+        timestamp (float): unix timestamp.
+        utc_offset (int): utc offset of the local time in seconds. the offset of the grid of the history, not the one
+            of the price, so all the buckets of a resolution are on the same grid.
+        resolution (str): one of HISTORY_RESOLUTIONS.
+
+    Returns:
+        int: unix timestamp of the start of the bucket.
+    """
+    size = HISTORY_RESOLUTIONS[resolution]
+    return math.floor((timestamp + utc_offset) / size) * size - utc_offset
+
+
+def encode_tick(timestamp: float, price: PriceData) -> str:
+    return f"{timestamp!r},{price.price_high!r},{price.price_low!r}"
+
+
+def merge_tick(bucket: Union[str, bytes, None], start: int, timestamp: float, price: PriceData) -> str:
+    """
+    add a tick to an OHLC bucket.
+
+    Args:
+        bucket (Union[str, bytes, None]): the stored bucket, or None for a new bucket.
+        start (int): start of the bucket.
+        timestamp (float): timestamp of the tick.
+        price (PriceData): the tick.
+
+    Returns:
+        str: the updated bucket.
+    """
+    high, low = price.price_high, price.price_low
+    if bucket is None:
+        values = [start, 1, timestamp, timestamp, high, high, high, high, high, low, low, low, low, low]
+    else:
+        if isinstance(bucket, bytes):
+            bucket = bucket.decode("utf-8")
+        values = [float(v) for v in bucket.split(",")]
+        _, count, first, last, h_open, h_max, h_min, h_close, h_sum, l_open, l_max, l_min, l_close, l_sum = values
+        if timestamp < first:
+            first, h_open, l_open = timestamp, high, low
+        if timestamp >= last:
+            last, h_close, l_close = timestamp, high, low
+        values = [
+            start,
+            count + 1,
+            first,
+            last,
+            h_open,
+            max(h_max, high),
+            min(h_min, high),
+            h_close,
+            h_sum + high,
+            l_open,
+            max(l_max, low),
+            min(l_min, low),
+            l_close,
+            l_sum + low,
+        ]
+    return ",".join(repr(float(v)) for v in values)
+
+
+def decode_buckets(buckets: List[Union[str, bytes]]) -> np.ndarray:
+    """
+    decode stored buckets into an array with one row per bucket and one column per field of BUCKET_FIELDS.
+
+    Args:
+        buckets (List[Union[str, bytes]]): stored buckets.
+
+    Returns:
+        np.ndarray: array of shape (len(buckets), len(BUCKET_FIELDS)).
+    """
+    if not buckets:
+        return np.empty((0, len(BUCKET_FIELDS)))
+    text = ",".join(b.decode("utf-8") if isinstance(b, bytes) else b for b in buckets)
+    return np.array(text.split(","), dtype=float).reshape(len(buckets), len(BUCKET_FIELDS))
+
+
+# fields of the aggregated history, see `aggregate_buckets`
+HISTORY_FIELDS = (
+    "time",
+    "count",
+    "price_high_open",
+    "price_high_max",
+    "price_high_min",
+    "price_high_close",
+    "price_high_mean",
+    "price_low_open",
+    "price_low_max",
+    "price_low_min",
+    "price_low_close",
+    "price_low_mean",
+)
+
+_BUCKET_UNITS = {"m": 60, "h": 3600, "d": 24 * 3600, "w": 7 * 24 * 3600}
+
+
+def parse_bucket_size(bucket: str) -> int:
+    """
+    parse a bucket size like "15m", "4h", "1d" or "1w" into seconds.
+
+    Args:
+        bucket (str): bucket size. it must be a multiple of 15 minutes.
+
+    Raises:
+        ValueError: if the bucket size is not valid.
+
+    Returns:
+        int: bucket size in seconds.
+    """
+    try:
+        size = int(bucket[:-1]) * _BUCKET_UNITS[bucket[-1]]
+    except (ValueError, KeyError, IndexError):
+        raise ValueError(f"invalid bucket size '{bucket}'. examples of valid sizes: 15m, 30m, 1h, 4h, 1d, 1w.")
+    if size <= 0 or size % HISTORY_RESOLUTIONS["15m"] != 0:
+        raise ValueError(f"bucket size '{bucket}' must be a positive multiple of 15m.")
+    return size
+
+
+def stored_resolution(bucket_size: int, utc_offset: int = 0, grid_offset: int = 0) -> str:
+    """
+    choose the coarsest stored resolution whose buckets can be combined into buckets of the given size, aligned to a
+    utc offset. for example, daily buckets on the grid of +03:30 make the days of +03:30 but not the days of utc,
+    which are made of 15m buckets.
+
+    Args:
+        bucket_size (int): bucket size in seconds. a multiple of 15 minutes.
+        utc_offset (int, optional): utc offset in seconds the output buckets are aligned to. Defaults to 0.
+        grid_offset (int, optional): utc offset in seconds of the grid of the stored buckets. Defaults to 0.
+
+    Raises:
+        ValueError: if the offsets differ by something else than a multiple of 15 minutes.
+
+    Returns:
+        str: one of HISTORY_RESOLUTIONS.
+    """
+    resolutions = [
+        r
+        for r, size in HISTORY_RESOLUTIONS.items()
+        if bucket_size % size == 0 and (utc_offset - grid_offset) % size == 0
+    ]
+    if not resolutions:
+        raise ValueError("the utc offset of the time range must be a multiple of 15 minutes.")
+    return max(resolutions, key=lambda r: HISTORY_RESOLUTIONS[r])
+
+
+def aggregate_buckets(buckets: np.ndarray, bucket_size: int, utc_offset: int = 0) -> np.ndarray:
+    """
+    combine stored buckets into larger buckets, vectorized over all buckets.
+
+    Args:
+        buckets (np.ndarray): stored buckets sorted by start, as returned by `decode_buckets`.
+        bucket_size (int): size of the output buckets in seconds. a multiple of the size of the stored buckets.
+        utc_offset (int, optional): utc offset in seconds of the local time the output buckets are aligned to. Defaults to 0.
+
+    Returns:
+        np.ndarray: one row per output bucket and one column per field of HISTORY_FIELDS.
+    """
+    if len(buckets) == 0:
+        return np.empty((0, len(HISTORY_FIELDS)))
+    f = {name: buckets[:, i] for i, name in enumerate(BUCKET_FIELDS)}
+    group = np.floor((f["start"] + utc_offset) / bucket_size)
+    first_rows = np.flatnonzero(np.r_[True, np.diff(group) != 0])
+    last_rows = np.r_[first_rows[1:] - 1, len(buckets) - 1]
+
+    count = np.add.reduceat(f["count"], first_rows)
+    columns = [group[first_rows] * bucket_size - utc_offset, count]
+    for p in ("price_high", "price_low"):
+        columns += [
+            f[f"{p}_open"][first_rows],
+            np.maximum.reduceat(f[f"{p}_max"], first_rows),
+            np.minimum.reduceat(f[f"{p}_min"], first_rows),
+            f[f"{p}_close"][last_rows],
+            np.add.reduceat(f[f"{p}_sum"], first_rows) / count,
+        ]
+    return np.column_stack(columns)
+
+
+def format_history(history: np.ndarray, utc_offset: int = 0, columnar: bool = False) -> Union[list, dict]:
+    """
+    convert aggregated history into json-serializable rows or columns.
+
+    Args:
+        history (np.ndarray): aggregated history, as returned by `aggregate_buckets`.
+        utc_offset (int, optional): utc offset in seconds of the returned times. Defaults to 0.
+        columnar (bool, optional): return a dict of columns instead of a list of rows. Defaults to False.
+
+    Returns:
+        Union[list, dict]: a list of {field: value} rows, or a {field: [values]} dict of columns.
+    """
+    sign = "+" if utc_offset >= 0 else "-"
+    suffix = f"{sign}{abs(utc_offset) // 3600:02d}:{abs(utc_offset) % 3600 // 60:02d}"
+    local_times = (history[:, 0] + utc_offset).astype("datetime64[s]").astype(str)
+    columns = [np.char.add(local_times, suffix).tolist(), history[:, 1].astype(int).tolist()]
+    columns += [history[:, i].tolist() for i in range(2, len(HISTORY_FIELDS))]
+    if columnar:
+        return dict(zip(HISTORY_FIELDS, columns))
+    return [dict(zip(HISTORY_FIELDS, row)) for row in zip(*columns)]
@@ -0,0 +1,136 @@
+"""
+prometheus metrics of the api and the crawlers, served by the /metrics endpoints.
+
+- `MetricsMiddleware` measures the requests per route.
+- `InstrumentedRedis` is a redis client that measures its commands and pipelines.
+- the crawlers, caches and submissions count their own events with the metrics below.
+
+with several worker processes, set the PROMETHEUS_MULTIPROC_DIR environment variable to an empty directory, so
+/metrics reports the metrics of all workers (see the multiprocess mode of prometheus_client).
+"""
+
+import os
+import time
+import redis.asyncio as redis
+from typing import List, Sequence
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram
+from prometheus_client import generate_latest, multiprocess
+from starlette.responses import Response
+from starlette.routing import BaseRoute, Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# most of the requests are served from memory, in a few milliseconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+HTTP_REQUESTS = Counter("nerkh_http_requests", "http requests", ["method", "route", "status"])
+HTTP_REQUEST_DURATION = Histogram(
+    "nerkh_http_request_duration_seconds", "time to serve an http request", ["method", "route"], buckets=LATENCY_BUCKETS
+)
+REDIS_COMMANDS = Counter("nerkh_redis_commands", "redis commands and pipelines", ["command", "status"])
+REDIS_COMMAND_DURATION = Histogram(
+    "nerkh_redis_command_duration_seconds", "time of a redis command or pipeline", ["command"], buckets=LATENCY_BUCKETS
+)
+CACHE_LOOKUPS = Counter("nerkh_cache_lookups", "lookups of the in-process caches", ["cache", "result"])
+SUBMITTED_PRICES = Counter("nerkh_submitted_prices", "submitted prices, accepted or rejected", ["result"])
+RATE_LIMITED = Counter("nerkh_rate_limited_requests", "requests rejected by the rate limiter", ["endpoint"])
+CRAWLS = Counter("nerkh_crawls", "crawls of the sources", ["source", "outcome"])
+CRAWL_DURATION = Histogram(
+    "nerkh_crawl_duration_seconds",
+    "time of a crawl, including retries",
+    ["source"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120),
+)
+CRAWL_PRICES = Gauge("nerkh_crawl_prices", "prices found by the last crawl", ["source"], multiprocess_mode="mostrecent")
+
+
+def metrics_response() -> Response:
+    """
+    response of a /metrics endpoint, in the prometheus text format.
+    """
+    registry = REGISTRY
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+class MetricsMiddleware:
+    """
+    count and time the http requests by method, route and status code.
+
+    requests are labeled with the path template of their route (for example, "/prices/{category}"), or "other" if
+    no route matches, so the number of series doesn't grow with the urls.
+    """
+
+    def __init__(self, app: ASGIApp, routes: Sequence[BaseRoute]):
+        """
+        Args:
+            app (ASGIApp): the wrapped app.
+            routes (Sequence[BaseRoute]): routes of the app, for example `app.routes` of a FastAPI app.
+        """
+        self.app = app
+        self.routes = routes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = self._route(scope)
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_REQUEST_DURATION.labels(scope["method"], route).observe(time.perf_counter() - t0)
+            HTTP_REQUESTS.labels(scope["method"], route, str(status_code)).inc()
+
+    def _route(self, scope: Scope) -> str:
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", "other")
+        return "other"
+
+
+async def _measure(command: str, coroutine):
+    t0 = time.perf_counter()
+    status = "error"
+    try:
+        result = await coroutine
+        status = "ok"
+        return result
+    finally:
+        REDIS_COMMAND_DURATION.labels(command).observe(time.perf_counter() - t0)
+        REDIS_COMMANDS.labels(command, status).inc()
+
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    """
+    pipeline measured as a whole ("PIPELINE", or "MULTI" for a transaction). the commands run right away while keys
+    are watched are measured one by one.
+    """
+
+    async def execute(self, raise_on_error: bool = True) -> List:
+        return await _measure("MULTI" if self.is_transaction else "PIPELINE", super().execute(raise_on_error))
+
+    async def immediate_execute_command(self, *args, **options):
+        return await _measure(str(args[0]).upper(), super().immediate_execute_command(*args, **options))
+
+
+class InstrumentedRedis(redis.Redis):
+    """
+    redis client counting and timing its commands. pub/sub connections are not measured.
+    """
+
+    async def execute_command(self, *args, **options):
+        return await _measure(str(args[0]).upper(), super().execute_command(*args, **options))
+
+    def pipeline(self, transaction: bool = True, shard_hint=None) -> InstrumentedPipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
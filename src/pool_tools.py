@@ -0,0 +1,70 @@
+"""
+connection pool of the redis clients of the api.
+
+redis.asyncio's BlockingConnectionPool wakes a waiting task when a connection is released, but the task must take the
+lock of the pool again before it can have the connection, and a task arriving in the meantime may take it first. when
+the event loop is busy, as under load, the arrivals win again and again: most requests get a connection at once while
+some are passed over until their timeout, and fail with "No connection available" although redis has capacity to
+spare. `FairConnectionPool` hands every released connection to the oldest waiting task directly, so requests wait in
+their order of arrival, like they queued for the threadpool of the synchronous handlers.
+"""
+
+import asyncio
+import redis.asyncio as redis
+from collections import deque
+from typing import Deque
+from redis.asyncio.connection import AbstractConnection
+
+
+class FairConnectionPool(redis.BlockingConnectionPool):
+    """
+    blocking connection pool serving the waiting tasks first in, first out.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def get_connection(self, command_name, *keys, **options):
+        """
+        get a connection from the pool, waiting after the tasks already waiting until one is released.
+
+        Raises:
+            redis.ConnectionError: if no connection is available within the timeout of the pool.
+        """
+        if self._waiters or not self.can_get_connection():
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                connection = await asyncio.wait_for(asyncio.shield(waiter), self.timeout)
+            except BaseException as e:
+                if waiter.done() and not waiter.cancelled():
+                    # the connection was handed over just as the wait ended
+                    await self.release(waiter.result())
+                else:
+                    waiter.cancel()
+                if isinstance(e, asyncio.TimeoutError):
+                    raise redis.ConnectionError("No connection available.") from e
+                raise
+        else:
+            connection = self.get_available_connection()
+
+        try:
+            await self.ensure_connection(connection)
+            return connection
+        except BaseException:
+            await self.release(connection)
+            raise
+
+    async def release(self, connection: AbstractConnection):
+        """
+        hand a connection over to the oldest waiting task, or return it to the pool.
+        """
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # it stays in use, by the waiter
+                waiter.set_result(connection)
+                return
+        self._in_use_connections.remove(connection)
+        self._available_connections.append(connection)
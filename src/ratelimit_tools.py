@@ -0,0 +1,151 @@
+"""
+rate limiting of the clients of the api, shared by all workers.
+
+every (endpoint, client) pair has a token bucket in redis: it holds up to `burst` requests and refills at `rate`
+requests per second. a request takes one token, atomically in a lua script, or is rejected with the seconds until
+the next token. a worker remembers the clients it has rejected until their next token, so a client hammering the api
+while it's limited is rejected without a round-trip to redis.
+
+buckets are refilled by the clock of the workers, which are assumed to be in sync.
+
+anonymous clients are identified by their ip. behind proxies, it's taken from the X-Forwarded-For header, which is
+trusted only from the configured proxies (`client_ip`), so a client can't pick its own bucket by forging the header.
+"""
+
+import ipaddress
+import time
+import redis.asyncio as redis
+from collections import OrderedDict
+from typing import Dict, List, Sequence, Tuple, Union
+
+# KEYS[1]: bucket. ARGV: rate, burst, now (seconds). returns {allowed, seconds to wait as text}.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "time")
+local tokens = tonumber(bucket[1]) or burst
+local last = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - last) * rate)
+local allowed, wait = 0, 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "time", tostring(now))
+redis.call("PEXPIRE", KEYS[1], math.ceil(burst / rate * 1000))
+return {allowed, tostring(wait)}
+"""
+
+
+TrustedProxies = Union[List[Union[ipaddress.IPv4Network, ipaddress.IPv6Network]], None]
+
+
+def parse_trusted_proxies(proxies: Sequence[str]) -> TrustedProxies:
+    """
+    parse the ips and networks (for example "10.0.0.0/8") of the trusted proxies.
+
+    Args:
+        proxies (Sequence[str]): ips or networks. "*" trusts every peer.
+
+    Raises:
+        ValueError: if an item isn't an ip or a network.
+
+    Returns:
+        TrustedProxies: the networks, or None if every peer is trusted.
+    """
+    if "*" in proxies:
+        return None
+    return [ipaddress.ip_network(p, strict=False) for p in proxies]
+
+
+def _is_trusted(host: str, trusted: TrustedProxies) -> bool:
+    if trusted is None:
+        return True
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted)
+
+
+def client_ip(peer: str, forwarded_for: Union[str, None], trusted: TrustedProxies) -> str:
+    """
+    get the ip of a client, through the proxies in front of the api.
+
+    every proxy appends the ip of its own peer to X-Forwarded-For, so the client is the last address that isn't a
+    trusted proxy, walking back from the peer. the addresses before it may be forged by the client, they're ignored.
+
+    Args:
+        peer (str): ip of the peer of the connection.
+        forwarded_for (Union[str, None]): the X-Forwarded-For header(s), comma separated.
+        trusted (TrustedProxies): the trusted proxies, see `parse_trusted_proxies`.
+
+    Returns:
+        str: ip of the client.
+    """
+    if not forwarded_for or not _is_trusted(peer, trusted):
+        return peer
+    hosts = [h.strip() for h in forwarded_for.split(",") if h.strip()]
+    if trusted is None:
+        return hosts[0] if hosts else peer
+    for host in reversed(hosts):
+        if not _is_trusted(host, trusted):
+            return host
+    return hosts[0] if hosts else peer
+
+
+class RateLimiter:
+    """
+    token buckets of the clients in redis, with the rejected clients remembered in-process.
+    """
+
+    def __init__(self, redisdb: redis.Redis, limits: Dict[str, Tuple[float, int]], max_blocked: int = 10000):
+        """
+        Args:
+            redisdb (redis.Redis): connection to redis database.
+            limits (Dict[str, Tuple[float, int]]): (requests per second, burst) of each endpoint. a rate of 0 or an
+                endpoint missing from the limits is not limited.
+            max_blocked (int, optional): maximum number of rejected clients remembered. Defaults to 10000.
+        """
+        self.redisdb = redisdb
+        self.limits = limits
+        self.max_blocked = max_blocked
+        # (endpoint, client): time.monotonic() of the next token
+        self.blocked: OrderedDict[Tuple[str, str], float] = OrderedDict()
+        self.script = redisdb.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def hit(self, endpoint: str, client: str) -> float:
+        """
+        count a request of a client to an endpoint.
+
+        Args:
+            endpoint (str): name of the endpoint in the limits.
+            client (str): identity of the client.
+
+        Returns:
+            float: 0 if the request is allowed, otherwise the seconds the client should wait before retrying.
+        """
+        rate, burst = self.limits.get(endpoint, (0, 0))
+        if rate <= 0:
+            return 0
+        now = time.monotonic()
+        blocked_until = self.blocked.get((endpoint, client))
+        if blocked_until is not None:
+            if blocked_until > now:
+                return blocked_until - now
+            del self.blocked[(endpoint, client)]
+        try:
+            allowed, wait = await self.script(keys=[f"ratelimit:{endpoint}:{client}"], args=[rate, burst, time.time()])
+        except redis.RedisError:
+            # the limiter fails open, an unavailable redis must not reject every request
+            return 0
+        if allowed:
+            return 0
+        wait = float(wait)
+        self.blocked[(endpoint, client)] = now + wait
+        while len(self.blocked) > self.max_blocked:
+            self.blocked.popitem(last=False)
+        return wait
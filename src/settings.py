@@ -17,3 +17,85 @@ REDIS_HOST = os.environ["REDIS_HOST"]
 REDIS_PORT = os.environ["REDIS_PORT"]
 REDIS_PASSWORD = os.environ["REDIS_PASSWORD"]
 REDIS_INDEX = get_redis_index()
+
+# redis connection pool
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", 50))
+REDIS_POOL_TIMEOUT = float(os.environ.get("REDIS_POOL_TIMEOUT", 5))  # seconds to wait for a free connection
+REDIS_SOCKET_TIMEOUT = float(os.environ.get("REDIS_SOCKET_TIMEOUT", 5))
+REDIS_SOCKET_CONNECT_TIMEOUT = float(os.environ.get("REDIS_SOCKET_CONNECT_TIMEOUT", 5))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get("REDIS_HEALTH_CHECK_INTERVAL", 30))
+
+# maximum age (seconds) of the in-process snapshot of current prices. it's normally refreshed via pub/sub on submission.
+PRICE_CACHE_MAX_STALENESS = float(os.environ.get("PRICE_CACHE_MAX_STALENESS", 60))
+# number of requested subsets of codes whose serialized/compressed response bodies are kept per snapshot
+PRICE_CACHE_MAX_RENDERED = int(os.environ.get("PRICE_CACHE_MAX_RENDERED", 64))
+
+# verified tokens cached per worker. a revoked token may be accepted for up to TOKEN_CACHE_TTL seconds by a worker
+# that missed the revocation notification.
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 1024))
+TOKEN_CACHE_TTL = float(os.environ.get("TOKEN_CACHE_TTL", 300))
+
+# rate limits of each client (the subject of its token, or its ip for anonymous requests) per endpoint:
+# (requests per second, burst). a rate of 0 disables the limit of the endpoint.
+RATE_LIMITS = {
+    "get_prices": (
+        float(os.environ.get("RATE_LIMIT_GET_PRICES", 10)),
+        int(os.environ.get("RATE_LIMIT_GET_PRICES_BURST", 30)),
+    ),
+    "history": (float(os.environ.get("RATE_LIMIT_HISTORY", 2)), int(os.environ.get("RATE_LIMIT_HISTORY_BURST", 10))),
+    "submit_prices": (
+        float(os.environ.get("RATE_LIMIT_SUBMIT_PRICES", 1)),
+        int(os.environ.get("RATE_LIMIT_SUBMIT_PRICES_BURST", 10)),
+    ),
+    # opening of streams
+    "stream": (float(os.environ.get("RATE_LIMIT_STREAM", 0.2)), int(os.environ.get("RATE_LIMIT_STREAM_BURST", 5))),
+}
+
+# ips or networks (for example "10.0.0.0/8") of the proxies in front of the api, comma separated. anonymous clients
+# are identified by the ip that these proxies forward in X-Forwarded-For, the header of other peers is ignored. "*"
+# trusts every peer, only if the proxy replaces the header of the clients. also given to uvicorn in the Dockerfile.
+TRUSTED_PROXIES = [p.strip() for p in os.environ.get("TRUSTED_PROXIES", "127.0.0.1").split(",") if p.strip()]
+
+# Cache-Control max-age of GET /prices: the seconds until the next ingestion is expected after the newest price
+# (PRICES_INGESTION_INTERVAL, the interval of the crawlers), within PRICES_MIN_MAX_AGE and PRICES_MAX_AGE.
+PRICES_INGESTION_INTERVAL = float(os.environ.get("PRICES_INGESTION_INTERVAL", 900))
+PRICES_MIN_MAX_AGE = int(os.environ.get("PRICES_MIN_MAX_AGE", 5))
+PRICES_MAX_AGE = int(os.environ.get("PRICES_MAX_AGE", 60))
+
+# streams of /stream and /stream/ws
+STREAM_MAX_CONNECTIONS = int(os.environ.get("STREAM_MAX_CONNECTIONS", 1000))  # per worker
+STREAM_KEEPALIVE_INTERVAL = float(os.environ.get("STREAM_KEEPALIVE_INTERVAL", 15))  # seconds, for server-sent events
+
+# aggregation of the prices of a code reported by several sources, see aggregation_tools: the policy of all codes
+# ("priority", "freshest" or "median"), the policies of some categories ("currency=median,car=priority"), the
+# sources in order of preference, the age (seconds) of the quotes ignored next to the latest one, and the relative
+# deviation from the median of the outliers (0 keeps them)
+AGGREGATION_POLICY = os.environ.get("AGGREGATION_POLICY", "priority")
+AGGREGATION_CATEGORY_POLICIES = dict(
+    item.split("=", 1) for item in os.environ.get("AGGREGATION_CATEGORY_POLICIES", "").split(",") if item
+)
+SOURCE_PRIORITY = [s for s in os.environ.get("SOURCE_PRIORITY", "bonbast,tgju,iranjib").split(",") if s]
+QUOTE_MAX_AGE = float(os.environ.get("QUOTE_MAX_AGE", 3600))
+QUOTE_OUTLIER_THRESHOLD = float(os.environ.get("QUOTE_OUTLIER_THRESHOLD", 0.1))
+
+# response compression (br/gzip/zstd, negotiated by Accept-Encoding). the gzip and brotli levels are also the ones
+# of the cached bodies of /get_prices and /prices
+COMPRESSION_MINIMUM_SIZE = int(os.environ.get("COMPRESSION_MINIMUM_SIZE", 500))  # bytes
+COMPRESSION_GZIP_LEVEL = int(os.environ.get("COMPRESSION_GZIP_LEVEL", 6))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get("COMPRESSION_BROTLI_QUALITY", 4))
+COMPRESSION_ZSTD_LEVEL = int(os.environ.get("COMPRESSION_ZSTD_LEVEL", 3))
+# gzip request bodies (submissions) are rejected if they decompress to more than this many bytes
+REQUEST_MAX_DECOMPRESSED_SIZE = int(os.environ.get("REQUEST_MAX_DECOMPRESSED_SIZE", 10 * 1024 * 1024))
+
+# utc offset in seconds of the grid of the stored OHLC buckets of the history, the same for all prices: daily
+# buckets start at the midnight of this offset. +03:30, the local time of the prices. a history query with another
+# offset is served from the finest resolution, see history_tools.stored_resolution.
+HISTORY_UTC_OFFSET = int(os.environ.get("HISTORY_UTC_OFFSET", 3 * 3600 + 30 * 60))
+
+# history retention in seconds, for raw ticks and each OHLC resolution of history_tools.HISTORY_RESOLUTIONS
+HISTORY_RETENTION = {
+    "ticks": int(os.environ.get("HISTORY_TICKS_RETENTION", 2 * 24 * 3600)),
+    "15m": int(os.environ.get("HISTORY_15M_RETENTION", 31 * 24 * 3600)),
+    "1h": int(os.environ.get("HISTORY_1H_RETENTION", 366 * 24 * 3600)),
+    "1d": int(os.environ.get("HISTORY_1D_RETENTION", 10 * 366 * 24 * 3600)),
+}
@@ -0,0 +1,191 @@
+"""
+binary storage format of the prices in redis ("{code}:current" and "{code}:yesterday" keys).
+
+a record is packed with `struct`, little endian:
+
+- header: version (B), flags (B).
+- numbers: price_high, price_low, price_high_change, price_low_change (4d).
+- time: microseconds since the epoch (q) and utc offset in minutes (h), or the raw text if FLAG_TIME_TEXT is set.
+- strings, each prefixed by its length in bytes (H): code, source, then category and description unless
+  FLAG_DERIVED_INFO is set, in which case they are taken from MAIN_CODES.
+
+records stored as pydantic json by the previous versions are still decoded, and `migrate_legacy_prices`
+rewrites them in the binary format.
+"""
+
+import struct
+import redis.asyncio as redis
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import List, Union
+from data_tools import PriceData, MAIN_CODES
+
+STORAGE_VERSION = 1
+
+FLAG_DERIVED_INFO = 1  # category and description are the ones of the code in MAIN_CODES
+FLAG_TIME_TEXT = 2  # time is stored as text, it's not an iso time that the compact form reproduces
+FLAG_TIME_NAIVE = 4  # time has no utc offset
+
+_HEADER = struct.Struct("<BB")
+_NUMBERS = struct.Struct("<4d")
+_TIME = struct.Struct("<qh")
+_LENGTH = struct.Struct("<H")
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _pack_text(text: str) -> bytes:
+    data = text.encode("utf-8")
+    return _LENGTH.pack(len(data)) + data
+
+
+def _unpack_text(value: bytes, offset: int):
+    (length,) = _LENGTH.unpack_from(value, offset)
+    offset += _LENGTH.size
+    return value[offset : offset + length].decode("utf-8"), offset + length
+
+
+def _pack_time(time: str) -> Union[bytes, None]:
+    # compact form of an iso time, or None if it doesn't reproduce the same text
+    try:
+        dt = datetime.fromisoformat(time)
+    except ValueError:
+        return None
+    naive = dt.tzinfo is None
+    offset = dt.utcoffset() if not naive else timedelta(0)
+    if offset % timedelta(minutes=1):
+        return None
+    micros = (dt.replace(tzinfo=timezone.utc) - offset - _EPOCH) // timedelta(microseconds=1)
+    packed = _TIME.pack(micros, offset // timedelta(minutes=1))
+    if _unpack_time(packed, 0, naive) != time:
+        return None
+    return packed
+
+
+@lru_cache(maxsize=None)
+def _timezone(offset_minutes: int) -> timezone:
+    return timezone(timedelta(minutes=offset_minutes))
+
+
+@lru_cache(maxsize=1024)
+def _format_time(packed: bytes, naive: bool) -> str:
+    # formatting is the costly part of decoding, and most reads are of prices already read once
+    micros, offset_minutes = _TIME.unpack(packed)
+    seconds, microsecond = divmod(micros, 1000000)
+    dt = datetime.fromtimestamp(seconds, _timezone(offset_minutes)).replace(microsecond=microsecond)
+    if naive:
+        dt = dt.replace(tzinfo=None)
+    return dt.isoformat()
+
+
+def _unpack_time(value: bytes, offset: int, naive: bool) -> str:
+    return _format_time(value[offset : offset + _TIME.size], naive)
+
+
+def encode_price(price: PriceData) -> bytes:
+    """
+    pack a price into a binary record.
+
+    Args:
+        price (PriceData): price data.
+
+    Returns:
+        bytes: the record.
+    """
+    flags = 0
+    if MAIN_CODES.get(price.code) == (price.category, price.description):
+        flags |= FLAG_DERIVED_INFO
+    packed_time = _pack_time(price.time)
+    if packed_time is None:
+        flags |= FLAG_TIME_TEXT
+        packed_time = _pack_text(price.time)
+    elif price.time and datetime.fromisoformat(price.time).tzinfo is None:
+        flags |= FLAG_TIME_NAIVE
+    parts = [
+        _HEADER.pack(STORAGE_VERSION, flags),
+        _NUMBERS.pack(price.price_high, price.price_low, price.price_high_change, price.price_low_change),
+        packed_time,
+        _pack_text(price.code),
+        _pack_text(price.source),
+    ]
+    if not flags & FLAG_DERIVED_INFO:
+        parts += [_pack_text(price.category), _pack_text(price.description)]
+    return b"".join(parts)
+
+
+def decode_price(value: Union[bytes, str]) -> PriceData:
+    """
+    unpack a stored price, either a binary record or the json of the previous versions.
+
+    Args:
+        value (Union[bytes, str]): the stored value.
+
+    Raises:
+        ValueError: if the record has an unknown version.
+
+    Returns:
+        PriceData: price data.
+    """
+    if is_legacy(value):
+        return PriceData.model_validate_json(value)
+    version, flags = _HEADER.unpack_from(value, 0)
+    if version != STORAGE_VERSION:
+        raise ValueError(f"unknown version {version} of a stored price.")
+    offset = _HEADER.size
+    price_high, price_low, price_high_change, price_low_change = _NUMBERS.unpack_from(value, offset)
+    offset += _NUMBERS.size
+    if flags & FLAG_TIME_TEXT:
+        time, offset = _unpack_text(value, offset)
+    else:
+        time = _unpack_time(value, offset, bool(flags & FLAG_TIME_NAIVE))
+        offset += _TIME.size
+    code, offset = _unpack_text(value, offset)
+    source, offset = _unpack_text(value, offset)
+    if flags & FLAG_DERIVED_INFO:
+        # the code may have been removed from the catalog since the record was stored
+        category, description = MAIN_CODES.get(code, ("", ""))
+    else:
+        category, offset = _unpack_text(value, offset)
+        description, offset = _unpack_text(value, offset)
+    return PriceData(
+        code=code,
+        category=category,
+        description=description,
+        source=source,
+        price_high=price_high,
+        price_low=price_low,
+        price_high_change=price_high_change,
+        price_low_change=price_low_change,
+        time=time,
+    )
+
+
+def is_legacy(value: Union[bytes, str]) -> bool:
+    # json records start with "{", binary ones with the version byte
+    return value[:1] in (b"{", "{")
+
+
+async def migrate_legacy_prices(keys: List[str], redisdb: redis.Redis) -> int:
+    """
+    rewrite the prices stored as json in the binary format. keys are watched, so a price stored by a submission
+    in the meantime is never overwritten by its old value.
+
+    Args:
+        keys (List[str]): keys of the prices, for example, "USD-TMN:current".
+        redisdb (redis.Redis): connection to redis database.
+
+    Returns:
+        int: number of migrated keys.
+    """
+
+    async def transaction(pipe: redis.client.Pipeline) -> int:
+        values = await pipe.mget(keys)
+        legacy = {k: encode_price(decode_price(v)) for k, v in zip(keys, values) if v is not None and is_legacy(v)}
+        pipe.multi()
+        if legacy:
+            pipe.mset(legacy)
+        return len(legacy)
+
+    if not keys:
+        return 0
+    return await redisdb.transaction(transaction, *keys, value_from_callable=True)
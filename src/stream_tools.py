@@ -0,0 +1,99 @@
+"""
+streaming of price updates to the clients of /stream (server-sent events) and /stream/ws (websocket).
+
+every worker fans the updates out to its own connections: the pub/sub listener of cache_tools refreshes the price
+snapshot on each notification and then publishes the rendered json of the updated prices to the `PriceStreamHub`.
+a connection keeps only the latest pending price of each code, so a slow client gets the current prices when it
+catches up instead of a growing backlog of stale ones.
+"""
+
+import asyncio
+from typing import Dict, Iterable, Set, Union
+
+
+class PriceStream:
+    """
+    updates pending for one connection, filtered by its subscribed codes.
+    """
+
+    def __init__(self, codes: Iterable[str] = ()):
+        """
+        Args:
+            codes (Iterable[str], optional): subscribed codes, all codes if empty. Defaults to ().
+        """
+        self.codes: Set[str] = set(codes)
+        self.pending: Dict[str, bytes] = {}  # code: rendered json of its latest price
+        self._event = asyncio.Event()
+
+    def subscribes(self, code: str) -> bool:
+        return not self.codes or code in self.codes
+
+    def push(self, fragments: Dict[str, bytes]):
+        """
+        queue updated prices, replacing the pending ones of the same codes.
+
+        Args:
+            fragments (Dict[str, bytes]): rendered json of the updated prices by code, see cache_tools.render_price.
+        """
+        for code, fragment in fragments.items():
+            if self.subscribes(code):
+                self.pending[code] = fragment
+        if self.pending:
+            self._event.set()
+
+    async def next(self, timeout: Union[float, None] = None) -> Union[bytes, None]:
+        """
+        wait for pending updates.
+
+        Args:
+            timeout (Union[float, None], optional): maximum seconds to wait. Defaults to None (no limit).
+
+        Returns:
+            Union[bytes, None]: json of the pending prices, in the form of a PricesPayload, or None on timeout.
+        """
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._event.clear()
+        pending, self.pending = self.pending, {}
+        return b'{"prices":[' + b",".join(pending.values()) + b"]}"
+
+
+class PriceStreamHub:
+    """
+    the open streams of a worker.
+    """
+
+    def __init__(self, max_streams: int = 1000):
+        """
+        Args:
+            max_streams (int, optional): maximum number of open streams. Defaults to 1000.
+        """
+        self.max_streams = max_streams
+        self.streams: Set[PriceStream] = set()
+
+    def open(self, codes: Iterable[str] = ()) -> Union[PriceStream, None]:
+        """
+        open a stream of the given codes (all codes if empty), or return None if there are too many open streams.
+        """
+        if len(self.streams) >= self.max_streams:
+            return None
+        stream = PriceStream(codes)
+        self.streams.add(stream)
+        return stream
+
+    def close(self, stream: PriceStream):
+        self.streams.discard(stream)
+
+    def publish(self, fragments: Dict[str, bytes]):
+        """
+        push updated prices to all open streams.
+
+        Args:
+            fragments (Dict[str, bytes]): rendered json of the updated prices by code.
+        """
+        if not fragments:
+            return
+        for stream in self.streams:
+            stream.push(fragments)
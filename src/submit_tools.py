@@ -0,0 +1,231 @@
+"""
+tools of the data submitter (data_submitter/main.py).
+
+prices are posted to all servers concurrently by `submit_all`, over the pooled http client of the crawlers, with a
+gzip compressed body and a timeout and retries for each server (`SubmitTarget`).
+
+the submitter keeps the last submitted value of every code in a `SubmittedSnapshot` on disk. each crawl submits the
+prices that differ from the snapshot, and every `full_sync_interval` seconds a crawl of a source submits all of its
+prices instead (a heartbeat), so the servers catch up on anything they missed and the day rollover of unchanged
+prices happens.
+
+the submitter can also follow the asset catalog of a server (`fetch_assets`), so it translates the assets added to
+the catalog without a redeploy.
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import random
+import time
+import httpx
+from pydantic import BaseModel
+from typing import Dict, List, Tuple
+from datetime import datetime
+from data_tools import AssetsPayload, PriceData, compact_prices, load_assets
+from crawlers import CrawlResult, tehran_tz
+
+
+class SubmittedSnapshot:
+    """
+    last submitted values of every code of every source. sources reporting the same code are tracked separately, so
+    the server can aggregate their quotes.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path (str): json file of the snapshot. it's created on the first `update`.
+        """
+        self.path = path
+        # source: code: (price_high, price_low)
+        self.values: Dict[str, Dict[str, Tuple[float, float]]] = {}
+        # source: time of its last full sync
+        self.full_synced_at: Dict[str, float] = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                state = json.load(f)
+            for key, value in state["values"].items():
+                if isinstance(value, list):
+                    # snapshot of the previous versions, code: (source, price_high, price_low)
+                    source, high, low = value
+                    self.values.setdefault(source, {})[key] = (high, low)
+                else:
+                    self.values[key] = {code: tuple(v) for code, v in value.items()}
+            self.full_synced_at = state["full_synced_at"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def full_sync_due(self, source: str, full_sync_interval: float) -> bool:
+        return time.time() - self.full_synced_at.get(source, 0) >= full_sync_interval
+
+    def changes(self, prices: List[PriceData]) -> List[PriceData]:
+        """
+        get the prices whose values differ from the snapshot.
+        """
+        return [p for p in prices if self.values.get(p.source, {}).get(p.code) != (p.price_high, p.price_low)]
+
+    def source_prices(self, source: str, price_time: str) -> List[PriceData]:
+        """
+        get the snapshot prices of a source, registered at the given time. for a full sync of a source whose
+        prices are known to be unchanged.
+        """
+        return [
+            PriceData(code=code, source=source, price_high=high, price_low=low, time=price_time)
+            for code, (high, low) in self.values.get(source, {}).items()
+        ]
+
+    def to_submit(self, crawl: CrawlResult, full_sync: bool) -> List[PriceData]:
+        """
+        get the prices of a successful crawl that should be submitted.
+
+        Args:
+            crawl (CrawlResult): result of the crawl.
+            full_sync (bool): submit all prices of the source, not only the changed ones.
+
+        Returns:
+            List[PriceData]: prices to submit.
+        """
+        if full_sync:
+            # a not modified page has no prices, its last submitted ones are still valid
+            return crawl.prices or self.source_prices(crawl.source, datetime.now(tz=tehran_tz).isoformat())
+        if crawl.unchanged:
+            return []
+        return self.changes(crawl.prices)
+
+    def update(self, prices: List[PriceData], full_synced: List[str] = []):
+        """
+        record submitted prices and save the snapshot.
+
+        Args:
+            prices (List[PriceData]): the submitted prices.
+            full_synced (List[str], optional): sources whose all prices were submitted. Defaults to [].
+        """
+        for p in prices:
+            self.values.setdefault(p.source, {})[p.code] = (p.price_high, p.price_low)
+        for source in full_synced:
+            self.full_synced_at[source] = time.time()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"values": self.values, "full_synced_at": self.full_synced_at}, f)
+        os.replace(tmp, self.path)
+
+
+class SubmitTarget(BaseModel):
+    url: str  # url of the submit endpoint, for example, "https://nerkh-api.liara.run/submit_prices_delta".
+    timeout: float = 20  # seconds allowed for each attempt.
+    retries: int = 2  # number of retries after a failed attempt.
+    backoff: float = 1  # maximum seconds to wait before the first retry, doubled for each next retry.
+
+
+class SubmitResult(BaseModel):
+    url: str  # url of the target.
+    status_code: int = 0  # status code of the last response, 0 if there was no response.
+    response: str = ""  # body of the last response.
+    error: str = ""  # error of the last attempt if it got no response.
+    attempts: int = 0  # number of attempts made.
+    elapsed: float = 0  # seconds spent on the submission, including retries.
+
+    @property
+    def ok(self) -> bool:
+        return self.status_code == 200
+
+
+def encode_prices(prices: List[PriceData]) -> bytes:
+    """
+    gzip compressed json body of the prices, in the compact form of /submit_prices_delta.
+    """
+    return gzip.compress(compact_prices(prices).model_dump_json().encode("utf-8"), compresslevel=6)
+
+
+def parse_retry_after(response: httpx.Response) -> float:
+    # seconds of the Retry-After header, only the delay-seconds form is sent by the servers
+    try:
+        return max(0.0, float(response.headers.get("Retry-After", 0)))
+    except ValueError:
+        return 0.0
+
+
+async def post_prices(client: httpx.AsyncClient, target: SubmitTarget, body: bytes, token: str) -> SubmitResult:
+    """
+    post an encoded body of prices to a target. failed attempts (no response, 429 or 5xx) are retried after a random
+    delay (full jitter), so the retries of several submitters don't hit a recovering server at once. a 429 is not
+    retried before its Retry-After.
+    it never raises, errors are reported in the result.
+
+    Args:
+        client (httpx.AsyncClient): the shared http client.
+        target (SubmitTarget): the server to post to.
+        body (bytes): body returned by `encode_prices`.
+        token (str): token of the submitter.
+
+    Returns:
+        SubmitResult: the response or error of the submission.
+    """
+    t0 = time.perf_counter()
+    result = SubmitResult(url=target.url)
+    headers = {"token": token, "Content-Type": "application/json", "Content-Encoding": "gzip"}
+    retry_after = 0.0
+    for attempt in range(target.retries + 1):
+        if attempt > 0:
+            await asyncio.sleep(max(retry_after, random.uniform(0, target.backoff * 2 ** (attempt - 1))))
+        result.attempts += 1
+        try:
+            response = await asyncio.wait_for(client.post(target.url, content=body, headers=headers), target.timeout)
+            result.status_code, result.response, result.error = response.status_code, response.text, ""
+            retry_after = parse_retry_after(response) if response.status_code == 429 else 0.0
+            if response.status_code != 429 and response.status_code < 500:
+                break
+        except asyncio.TimeoutError:
+            result.status_code, result.response = 0, ""
+            result.error = f"timed out after {target.timeout} seconds"
+        except httpx.HTTPError as e:
+            result.status_code, result.response = 0, ""
+            result.error = f"{type(e).__name__}: {e}"
+    result.elapsed = time.perf_counter() - t0
+    return result
+
+
+async def submit_all(
+    client: httpx.AsyncClient, targets: List[SubmitTarget], prices: List[PriceData], token: str
+) -> List[SubmitResult]:
+    """
+    post prices to all targets concurrently, so adding a target doesn't add to the submission time.
+
+    Args:
+        client (httpx.AsyncClient): the shared http client.
+        targets (List[SubmitTarget]): servers to post to.
+        prices (List[PriceData]): prices to post.
+        token (str): token of the submitter.
+
+    Returns:
+        List[SubmitResult]: result of each target, in the same order as the targets.
+    """
+    body = encode_prices(prices)
+    return list(await asyncio.gather(*[post_prices(client, target, body, token) for target in targets]))
+
+
+async def fetch_assets(client: httpx.AsyncClient, url: str, timeout: float = 10) -> str:
+    """
+    load the asset catalog served by a nerkh server (its /assets endpoint). on errors, the current catalog is kept.
+    it never raises.
+
+    Args:
+        client (httpx.AsyncClient): the shared http client.
+        url (str): url of the /assets endpoint.
+        timeout (float, optional): seconds to wait for the response. Defaults to 10.
+
+    Returns:
+        str: the error, or an empty string if the catalog was loaded.
+    """
+    try:
+        response = await asyncio.wait_for(client.get(url), timeout)
+        response.raise_for_status()
+        load_assets(AssetsPayload.model_validate_json(response.content).assets)
+    except asyncio.TimeoutError:
+        return f"timed out after {timeout} seconds"
+    except (httpx.HTTPError, ValueError) as e:
+        return f"{type(e).__name__}: {e}"
+    return ""
@@ -1,10 +1,22 @@
-from dotenv import load_dotenv
+"""
+settings of the tests: the ones of the app (src/settings.py), on the redis database of the tests.
+
+the tests and the app under test both import `settings`, which is this module when the tests are run, so it exposes
+all the settings of the app.
+"""
+
+import importlib.util
 import os
+import sys
+
+os.environ.setdefault("CURRENT_BRANCH", "testing")  # not set on ci
 
-load_dotenv()
+_spec = importlib.util.spec_from_file_location(
+    "app_settings", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "settings.py")
+)
+sys.modules["app_settings"] = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(sys.modules["app_settings"])
 
+from app_settings import *
 
-REDIS_HOST = os.environ["REDIS_HOST"]
-REDIS_PORT = os.environ["REDIS_PORT"]
-REDIS_PASSWORD = os.environ["REDIS_PASSWORD"]
-REDIS_INDEX = 2
+REDIS_INDEX = 2  # whatever the branch of the .env
@@ -0,0 +1,60 @@
+import unittest
+import sys
+
+sys.path.append("src")
+
+from data_tools import PriceData
+from aggregation_tools import PriceAggregator
+
+
+def quote(source: str, price: float, time: str = "2024-05-02T17:15:00") -> PriceData:
+    return PriceData(code="USD-TMN", source=source, price_high=price, price_low=price - 100, time=time)
+
+
+class TestPriceAggregator(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.quotes = {
+            "bonbast": quote("bonbast", 70000, "2024-05-02T17:15:00"),
+            "tgju": quote("tgju", 70400, "2024-05-02T17:30:00"),
+            "other": quote("other", 70200, "2024-05-02T17:20:00"),
+        }
+
+    def test_single_source(self):
+        price = PriceAggregator("median").aggregate("USD-TMN", {"bonbast": self.quotes["bonbast"]})
+        self.assertEqual(price, self.quotes["bonbast"])
+        self.assertIsNot(price, self.quotes["bonbast"])
+
+    def test_policies(self):
+        priority = PriceAggregator("priority", priority=["tgju", "bonbast"]).aggregate("USD-TMN", self.quotes)
+        self.assertEqual(priority.source, "tgju")
+        # sources missing from the priority list come last
+        priority = PriceAggregator("priority", priority=["bonbast"]).aggregate("USD-TMN", self.quotes)
+        self.assertEqual(priority.source, "bonbast")
+        freshest = PriceAggregator("freshest").aggregate("USD-TMN", self.quotes)
+        self.assertEqual(freshest.source, "tgju")
+        median = PriceAggregator("median").aggregate("USD-TMN", self.quotes)
+        self.assertEqual((median.source, median.price_high, median.price_low), ("bonbast,other,tgju", 70200, 70100))
+        self.assertEqual(median.time, "2024-05-02T17:30:00")
+
+    def test_category_policies(self):
+        aggregator = PriceAggregator("freshest", category_policies={"currency": "median"})
+        self.assertEqual(aggregator.policy_of("USD-TMN"), "median")
+        self.assertEqual(aggregator.policy_of("CAR-DENA"), "freshest")
+        with self.assertRaises(ValueError):
+            PriceAggregator("last")
+
+    def test_stale_and_outliers(self):
+        # the stale quote of the preferred source is ignored
+        quotes = dict(self.quotes, bonbast=quote("bonbast", 70000, "2024-05-02T10:00:00"))
+        aggregator = PriceAggregator("priority", priority=["bonbast", "other", "tgju"], max_age=3600)
+        self.assertEqual(aggregator.aggregate("USD-TMN", quotes).source, "other")
+        # and so is an outlier
+        quotes = dict(self.quotes, bonbast=quote("bonbast", 90000))
+        self.assertEqual(aggregator.aggregate("USD-TMN", quotes).source, "other")
+        aggregator.outlier_threshold = 0
+        self.assertEqual(aggregator.aggregate("USD-TMN", quotes).source, "bonbast")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import unittest
+from settings import *
+import sys
+import httpx
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+sys.path.append("src")
+
+from data_tools import PriceData
+from authentication_tools import generate_token, validate_token
+from app import analyze_and_store_prices, app
+
+
+class TestPricesEndpoints(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.lifespan = app.router.lifespan_context(app)
+        await self.lifespan.__aenter__()
+        await app.state.redis.flushdb()
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+    async def asyncTearDown(self) -> None:
+        await self.client.aclose()
+        await app.state.redis.flushdb()
+        await self.lifespan.__aexit__(None, None, None)
+
+    async def test_category_prices(self):
+        """
+        /prices/{category} serves the stored prices of the category only, and none if it has no stored price.
+        """
+        prices = [
+            PriceData(code=code, source="bonbast", price_high=70000, price_low=69000, time="2024-05-02T17:15:00")
+            for code in ("USD-TMN", "EUR-TMN")
+        ]
+        await analyze_and_store_prices(prices, app.state.redis)
+        app.state.price_cache.invalidate()
+
+        response = await self.client.get("/prices/currency")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p["code"] for p in response.json()["prices"]], ["USD-TMN", "EUR-TMN"])
+
+        response = await self.client.get("/prices/car")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"prices": []})
+
+        response = await self.client.get("/prices/nothing")
+        self.assertEqual(response.status_code, 404)
+
+    async def test_history_utc_offset(self):
+        """
+        prices of +03:30 are bucketed on the days and hours of the utc offset of the query.
+        """
+        tehran_tz = timezone(timedelta(hours=3, minutes=30))
+        day = datetime.now(tehran_tz).replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=2)
+        # 00:40 of the tehran day is 21:10 utc of the day before
+        times = [day + timedelta(minutes=40), day + timedelta(hours=12), day + timedelta(hours=23, minutes=50)]
+        prices = [
+            PriceData(code="USD-TMN", source="bonbast", price_high=70000 + i, time=t.isoformat())
+            for i, t in enumerate(times)
+        ]
+        await analyze_and_store_prices(prices, app.state.redis)
+
+        async def history(start: datetime, bucket: str) -> dict:
+            end = start + timedelta(days=2)
+            payload = {"codes": ["USD-TMN"], "start": start.isoformat(), "end": end.isoformat(), "bucket": bucket}
+            payload["columnar"] = True
+            response = await self.client.post("/history", json=payload)
+            self.assertEqual(response.status_code, 200)
+            return response.json()["history"]["USD-TMN"]
+
+        tehran_days = await history(day, "1d")
+        self.assertEqual((tehran_days["time"], tehran_days["count"]), ([day.isoformat()], [3]))
+
+        utc_day = day.astimezone(timezone.utc).replace(hour=0, minute=0)
+        utc_days = await history(utc_day, "1d")
+        expected = [utc_day.isoformat(), (utc_day + timedelta(days=1)).isoformat()]
+        self.assertEqual((utc_days["time"], utc_days["count"]), (expected, [1, 2]))
+
+        utc_hours = await history(utc_day, "1h")
+        expected = [t.astimezone(timezone.utc).replace(minute=0).isoformat() for t in times]
+        self.assertEqual(utc_hours["time"], expected)
+
+        response = await self.client.post("/history", json={"start": "2024-05-02T00:00:00+00:10", "bucket": "1h"})
+        self.assertEqual(response.status_code, 400)
+
+    async def test_submit_rate_limit(self):
+        """
+        submissions are verified once, then limited per subject of the token.
+        """
+        limiter = app.state.rate_limiter
+        time = "2024-05-02T17:15:00"
+        price = PriceData(code="USD-TMN", source="bonbast", price_high=70000, price_low=69000, time=time)
+        payload = {"prices": [price.model_dump()]}
+        with mock.patch.object(limiter, "hit", wraps=limiter.hit) as hit, mock.patch(
+            "app.validate_token", wraps=validate_token
+        ) as validate:
+            headers = {"token": generate_token("bot")}
+            response = await self.client.post("/submit_prices", json=payload, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            hit.assert_called_once_with("submit_prices", "sub:bot")
+            validate.assert_called_once()
+
+            response = await self.client.post("/submit_prices", json=payload, headers={"token": "invalid"})
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(hit.call_count, 1)
+
+    async def test_forwarded_rate_limit(self):
+        """
+        anonymous clients forwarded by a trusted proxy have their own buckets.
+        """
+        limiter = app.state.rate_limiter
+        with mock.patch.dict(limiter.limits, {"get_prices": (0.01, 1)}):
+            for ip in ("203.0.113.5", "203.0.113.6"):
+                response = await self.client.get("/assets", headers={"X-Forwarded-For": ip})
+                self.assertEqual(response.status_code, 200)
+            response = await self.client.get("/assets", headers={"X-Forwarded-For": "203.0.113.5"})
+            self.assertEqual(response.status_code, 429)
+
+
+if __name__ == "__main__":
+    unittest.main()
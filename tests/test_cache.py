@@ -0,0 +1,171 @@
+import unittest
+import asyncio
+from settings import *
+import redis.asyncio
+import sys
+import gzip
+import brotli
+
+sys.path.append("src")
+
+from data_tools import PriceData, PricesPayload
+from storage_tools import encode_price
+from cache_tools import PriceSnapshotCache, publish_prices_update, listen_for_prices_updates
+
+
+class TestPriceSnapshotCache(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.n_loads = 0
+        self.prices = [PriceData(code="USD-TMN", price_high=70000), PriceData(code="EUR-TMN", price_high=75000)]
+
+    async def loader(self):
+        self.n_loads += 1
+        return [encode_price(p) for p in self.prices]
+
+    async def test_snapshot(self):
+        """
+        the snapshot is loaded once and served from memory until it's invalidated.
+        """
+        cache = PriceSnapshotCache(self.loader)
+        prices = await cache.get_prices(["EUR-TMN", "USD-TMN"])
+        self.assertEqual([p.price_high for p in prices], [75000, 70000])
+        await cache.get_prices(["USD-TMN"])
+        self.assertEqual(self.n_loads, 1)
+
+        cache.invalidate()
+        await cache.get_prices(["USD-TMN"])
+        self.assertEqual(self.n_loads, 2)
+
+        with self.assertRaises(KeyError) as cm:
+            await cache.get_prices(["USD-TMN", "GBP-TMN"])
+        self.assertIn("GBP-TMN", str(cm.exception))
+
+    async def test_max_staleness(self):
+        """
+        the snapshot is reloaded when it gets older than max_staleness.
+        """
+        cache = PriceSnapshotCache(self.loader, max_staleness=0)
+        await cache.get_snapshot()
+        await cache.get_snapshot()
+        self.assertEqual(self.n_loads, 2)
+
+    async def test_rendered(self):
+        """
+        response bodies are rendered once per snapshot and carry a strong ETag.
+        """
+        cache = PriceSnapshotCache(self.loader, max_rendered=1)
+        rendered = await cache.get_rendered([])
+        body = PricesPayload(prices=self.prices).model_dump_json().encode("utf-8")
+        self.assertEqual(await rendered.body(), body)
+        # bodies are compressed on first use, once
+        self.assertEqual(list(rendered.bodies), ["identity"])
+        first, second = await asyncio.gather(rendered.body("gzip"), rendered.body("gzip"))
+        self.assertIs(first, second)
+        self.assertEqual(gzip.decompress(first), body)
+        self.assertEqual(brotli.decompress(await rendered.body("br")), body)
+        self.assertIs(rendered.bodies["br"], await rendered.body("br"))
+        self.assertTrue(rendered.etag_matches(f'"foo", {rendered.etag()}'))
+        self.assertFalse(rendered.etag_matches(rendered.etag(), "gzip"))
+        self.assertFalse(rendered.etag_matches(None))
+
+        subset = await cache.get_rendered(["EUR-TMN"])
+        self.assertIs(subset, await cache.get_rendered(["EUR-TMN"]))
+        self.assertNotEqual(subset.etag(), rendered.etag())
+        await cache.get_rendered(["USD-TMN"])
+        self.assertEqual(list(cache.rendered), [(), ("USD-TMN",)])  # the full snapshot is always kept
+
+        # the ETag changes only when the prices change
+        cache.invalidate()
+        self.assertEqual((await cache.get_rendered([])).etag(), rendered.etag())
+        self.prices = [PriceData(code="USD-TMN", price_high=72000)]
+        cache.invalidate()
+        self.assertNotEqual((await cache.get_rendered([])).etag(), rendered.etag())
+
+    async def test_last_modified(self):
+        """
+        rendered prices carry the time of their newest price.
+        """
+        self.prices[0].time = "2024-05-01T12:30:00+03:30"
+        self.prices[1].time = "2024-05-01T12:00:00+03:30"
+        cache = PriceSnapshotCache(self.loader)
+        self.assertEqual((await cache.get_rendered([])).last_modified, 1714554000)
+        self.assertEqual((await cache.get_rendered(["EUR-TMN"])).last_modified, 1714552200)
+        self.prices[0].time = self.prices[1].time = ""
+        cache.invalidate()
+        self.assertEqual((await cache.get_rendered([])).last_modified, 0)
+
+    async def test_unchanged_records(self):
+        """
+        a reload decodes only the records that changed.
+        """
+        cache = PriceSnapshotCache(self.loader)
+        eur = (await cache.get_snapshot())["EUR-TMN"]
+        self.prices[0] = PriceData(code="USD-TMN", price_high=72000)
+        cache.invalidate()
+        snapshot = await cache.get_snapshot()
+        self.assertIs(snapshot["EUR-TMN"], eur)
+        self.assertEqual(snapshot["USD-TMN"].price_high, 72000)
+        self.assertEqual(len(cache._decoded), 2)
+
+    async def test_pubsub_refresh(self):
+        """
+        a notification on the prices channel makes the listener refresh the cache.
+        """
+        r = redis.asyncio.Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=REDIS_INDEX)
+        cache = PriceSnapshotCache(self.loader)
+        await cache.get_snapshot()
+        updates = []
+        listener = asyncio.create_task(listen_for_prices_updates(r, cache, on_update=updates.append))
+        try:
+            await asyncio.sleep(0.2)  # wait for the subscription
+            self.prices = [PriceData(code="USD-TMN", price_high=72000)]
+            await publish_prices_update(r, ["USD-TMN"])
+            for _ in range(50):
+                if self.n_loads == 2:
+                    break
+                await asyncio.sleep(0.05)
+            self.assertEqual(self.n_loads, 2)
+            self.assertEqual(cache.prices["USD-TMN"].price_high, 72000)
+            self.assertEqual(updates, [["USD-TMN"]])
+        finally:
+            listener.cancel()
+            await r.aclose()
+
+    async def test_pubsub_error(self):
+        """
+        an error of a refresh is logged and doesn't stop the listener.
+        """
+        r = redis.asyncio.Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=REDIS_INDEX)
+        cache = PriceSnapshotCache(self.loader)
+        await cache.get_snapshot()
+        updates = []
+
+        def on_update(codes):
+            updates.append(codes)
+            if len(updates) == 1:
+                raise ValueError("invalid update")
+
+        listener = asyncio.create_task(listen_for_prices_updates(r, cache, retry_delay=0.1, on_update=on_update))
+        try:
+            await asyncio.sleep(0.2)  # wait for the subscription
+            with self.assertLogs("cache_tools", "ERROR") as logs:
+                await publish_prices_update(r, ["USD-TMN"])
+                await asyncio.sleep(0.5)  # wait for the resubscription
+            self.assertIs(logs.records[0].exc_info[0], ValueError)  # with its traceback
+            self.assertFalse(listener.done())
+            self.prices = [PriceData(code="USD-TMN", price_high=72000)]
+            await publish_prices_update(r, ["USD-TMN"])
+            for _ in range(50):
+                if len(updates) == 2:
+                    break
+                await asyncio.sleep(0.05)
+            self.assertEqual(updates, [["USD-TMN"], ["USD-TMN"]])
+            self.assertEqual(cache.prices["USD-TMN"].price_high, 72000)
+        finally:
+            listener.cancel()
+            await r.aclose()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import unittest
+import asyncio
+from settings import *
+import redis.asyncio
+import sys
+
+sys.path.append("src")
+
+from data_tools import (
+    ASSETS,
+    CODES_BY_CATEGORY,
+    MAIN_CODES,
+    AssetInfo,
+    PriceData,
+    bonbast_translate_dict,
+    load_assets,
+    read_assets_file,
+    translate_prices,
+)
+from catalog_tools import listen_for_catalog_updates, reload_assets, reset_assets, store_assets
+
+
+class TestAssets(unittest.TestCase):
+
+    def tearDown(self) -> None:
+        load_assets(read_assets_file())
+
+    def test_indexes(self):
+        """
+        the indexes of the catalog agree with each other.
+        """
+        self.assertEqual(list(ASSETS), list(MAIN_CODES))
+        self.assertEqual(sum(len(codes) for codes in CODES_BY_CATEGORY.values()), len(MAIN_CODES))
+        for category, codes in CODES_BY_CATEGORY.items():
+            for code in codes:
+                self.assertEqual(MAIN_CODES[code][0], category)
+        self.assertEqual(bonbast_translate_dict["USD"], "USD-TMN")
+
+    def test_load_assets(self):
+        """
+        a new catalog replaces the indexes in place, and an invalid one is rejected.
+        """
+        assets = read_assets_file() + [
+            AssetInfo(code="USDT-TMN", category="digital_currency", description="Tether", aliases={"bonbast": "usdt"})
+        ]
+        load_assets(assets)
+        self.assertEqual(MAIN_CODES["USDT-TMN"], ("digital_currency", "Tether"))
+        self.assertEqual(CODES_BY_CATEGORY["digital_currency"][-1], "USDT-TMN")
+        [price] = translate_prices([("usdt", "bonbast", 60000, 59900, "")])
+        self.assertEqual((price.code, price.category), ("USDT-TMN", "digital_currency"))
+
+        with self.assertRaises(ValueError):
+            load_assets(assets + [AssetInfo(code="USD-TMN", category="currency")])
+        with self.assertRaises(ValueError):
+            load_assets(assets + [AssetInfo(code="USD2-TMN", category="currency", aliases={"bonbast": "USD"})])
+        self.assertIn("USDT-TMN", MAIN_CODES)  # unchanged
+
+        load_assets([a for a in assets if a.category != "car"])
+        self.assertNotIn("car", CODES_BY_CATEGORY)
+        self.assertEqual(translate_prices([PriceData(code="پژو پارس", source="iranjib")]), [])
+
+
+class TestCatalogStorage(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.r = redis.asyncio.Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=REDIS_INDEX)
+        await self.r.flushdb()
+
+    async def asyncTearDown(self) -> None:
+        await self.r.flushdb()
+        await self.r.aclose()
+        load_assets(read_assets_file())
+
+    async def test_hot_reload(self):
+        """
+        a stored catalog is loaded by the listening workers, and a reset brings back the one of the file.
+        """
+        updates = []
+        listener = asyncio.create_task(listen_for_catalog_updates(self.r, on_update=lambda: updates.append(1)))
+
+        async def wait_for_updates(n: int):
+            for _ in range(50):
+                if len(updates) >= n:
+                    break
+                await asyncio.sleep(0.05)
+            self.assertEqual(len(updates), n)
+
+        try:
+            await asyncio.sleep(0.2)  # wait for the subscription
+            assets = [a for a in read_assets_file() if a.category == "currency"]
+            await store_assets(assets, self.r)
+            load_assets(read_assets_file())  # as if the catalog was stored by another process
+            await wait_for_updates(1)
+            self.assertEqual(list(CODES_BY_CATEGORY), ["currency"])
+
+            await reset_assets(self.r)
+            await wait_for_updates(2)
+            self.assertIn("car", CODES_BY_CATEGORY)
+            self.assertEqual(len(await reload_assets(self.r)), len(read_assets_file()))
+        finally:
+            listener.cancel()
+
+
+if __name__ == "__main__":
+    unittest.main()
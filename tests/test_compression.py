@@ -0,0 +1,169 @@
+import unittest
+import asyncio
+import gzip
+import brotli
+import sys
+
+sys.path.append("src")
+
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+from compression_tools import (
+    CompressionMiddleware,
+    RequestDecompressionMiddleware,
+    SUPPORTED_ENCODINGS,
+    choose_encoding,
+    parse_accept_encoding,
+)
+
+
+async def call_app(app, accept_encoding: str):
+    """
+    call an ASGI app with a GET request and return the status, headers and body of the response.
+    """
+    scope = {"type": "http", "method": "GET", "path": "/", "headers": [(b"accept-encoding", accept_encoding.encode())]}
+    messages = []
+    received = []
+
+    async def receive():
+        if received:
+            # the request is fully received, wait for the app to cancel us
+            await asyncio.Event().wait()
+        received.append(True)
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    headers = {k.decode(): v.decode() for k, v in messages[0]["headers"]}
+    body = b"".join(m.get("body", b"") for m in messages[1:])
+    return messages[0]["status"], headers, body
+
+
+async def post_app(app, body: bytes, content_encoding: str, chunk_size: int = 1000):
+    """
+    call an ASGI app with a POST request whose body is sent in chunks, and return the status, headers and body
+    of the response.
+    """
+    headers = [(b"content-encoding", content_encoding.encode()), (b"content-length", str(len(body)).encode())]
+    scope = {"type": "http", "method": "POST", "path": "/", "headers": headers}
+    chunks = [body[i : i + chunk_size] for i in range(0, len(body), chunk_size)] or [b""]
+    messages = []
+
+    async def receive():
+        if not chunks:
+            await asyncio.Event().wait()
+        chunk = chunks.pop(0)
+        return {"type": "http.request", "body": chunk, "more_body": bool(chunks)}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    headers = {k.decode(): v.decode() for k, v in messages[0]["headers"]}
+    return messages[0]["status"], headers, b"".join(m.get("body", b"") for m in messages[1:])
+
+
+async def echo(scope, receive, send):
+    # respond with the request body and the request headers the app sees
+    request = Request(scope, receive)
+    body = await request.body()
+    headers = {"x-content-length": request.headers["content-length"]}
+    if "content-encoding" in request.headers:
+        headers["x-content-encoding"] = request.headers["content-encoding"]
+    await Response(body, headers=headers)(scope, receive, send)
+
+
+class TestAcceptEncoding(unittest.TestCase):
+
+    def test_parse_accept_encoding(self):
+        self.assertEqual(parse_accept_encoding("gzip, br;q=0.8, *;q=0"), {"gzip": 1.0, "br": 0.8, "*": 0.0})
+        self.assertEqual(parse_accept_encoding(None), {})
+
+    def test_choose_encoding(self):
+        self.assertEqual(choose_encoding("gzip, deflate, br"), "br")
+        self.assertEqual(choose_encoding("gzip, br;q=0.5"), "gzip")
+        self.assertEqual(choose_encoding("deflate"), "identity")
+        self.assertEqual(choose_encoding("br;q=0, *"), SUPPORTED_ENCODINGS[1])
+        self.assertEqual(choose_encoding(None), "identity")
+        self.assertEqual(choose_encoding("br, gzip", available=("gzip",)), "gzip")
+
+
+class TestCompressionMiddleware(unittest.IsolatedAsyncioTestCase):
+
+    async def test_compress(self):
+        body = b'{"value": "' + b"x" * 2000 + b'"}'
+        app = CompressionMiddleware(Response(body, media_type="application/json"), minimum_size=500)
+
+        status, headers, compressed = await call_app(app, "gzip")
+        self.assertEqual(status, 200)
+        self.assertEqual(headers["content-encoding"], "gzip")
+        self.assertEqual(headers["vary"], "Accept-Encoding")
+        self.assertEqual(int(headers["content-length"]), len(compressed))
+        self.assertEqual(gzip.decompress(compressed), body)
+
+        _, headers, compressed = await call_app(app, "gzip, br")
+        self.assertEqual(headers["content-encoding"], "br")
+        self.assertEqual(brotli.decompress(compressed), body)
+
+        _, headers, uncompressed = await call_app(app, "deflate")
+        self.assertNotIn("content-encoding", headers)
+        self.assertEqual(uncompressed, body)
+
+    async def test_minimum_size(self):
+        app = CompressionMiddleware(Response(b"small", media_type="text/plain"), minimum_size=500)
+        _, headers, body = await call_app(app, "gzip")
+        self.assertNotIn("content-encoding", headers)
+        self.assertEqual(body, b"small")
+
+    async def test_already_encoded(self):
+        body = gzip.compress(b"x" * 2000)
+        app = CompressionMiddleware(Response(body, headers={"Content-Encoding": "gzip"}), minimum_size=500)
+        _, headers, sent = await call_app(app, "br")
+        self.assertEqual(headers["content-encoding"], "gzip")
+        self.assertEqual(sent, body)
+
+    async def test_streaming(self):
+        chunks = [b"x" * 1000 for _ in range(10)]
+
+        async def generate():
+            for chunk in chunks:
+                yield chunk
+
+        app = CompressionMiddleware(StreamingResponse(generate(), media_type="text/plain"), minimum_size=500)
+        _, headers, compressed = await call_app(app, "gzip")
+        self.assertEqual(headers["content-encoding"], "gzip")
+        self.assertNotIn("content-length", headers)
+        self.assertEqual(gzip.decompress(compressed), b"".join(chunks))
+
+
+class TestRequestDecompressionMiddleware(unittest.IsolatedAsyncioTestCase):
+
+    async def test_gzip(self):
+        body = b'{"value": "' + b"x" * 5000 + b'"}'
+        app = RequestDecompressionMiddleware(echo, max_size=10000)
+        status, headers, echoed = await post_app(app, gzip.compress(body), "gzip", chunk_size=10)
+        self.assertEqual(status, 200)
+        self.assertEqual(echoed, body)
+        self.assertEqual(headers["x-content-length"], str(len(body)))
+        self.assertNotIn("x-content-encoding", headers)
+
+        status, headers, echoed = await post_app(app, body, "identity")
+        self.assertEqual((status, echoed), (200, body))
+        self.assertEqual(headers["x-content-encoding"], "identity")
+
+    async def test_errors(self):
+        app = RequestDecompressionMiddleware(echo, max_size=1000)
+        for body, content_encoding, expected_status in [
+            (gzip.compress(b"x" * 1001), "gzip", 413),
+            (gzip.compress(b"x" * 1000)[:-4], "gzip", 400),
+            (b"not gzip", "gzip", 400),
+            (brotli.compress(b"x"), "br", 415),
+        ]:
+            status, _, _ = await post_app(app, body, content_encoding)
+            self.assertEqual(status, expected_status)
+
+
+if __name__ == "__main__":
+    unittest.main()
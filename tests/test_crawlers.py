@@ -0,0 +1,197 @@
+import unittest
+import asyncio
+import time
+import sys
+import tempfile
+import httpx
+from unittest import mock
+
+sys.path.append("src")
+
+from data_tools import PriceData, build_translation_index, translation_index
+from crawlers import (
+    HTML_PARSERS,
+    IRANJIB_CAR_URL,
+    TGJU_URL,
+    CrawlCache,
+    CrawlerSource,
+    CrawlResult,
+    crawl_all,
+    crawl_source,
+    create_client,
+    fetch_car_prices,
+    parse_car_prices,
+    parse_tgju_prices,
+    run_schedules,
+)
+
+
+def read_fixture(name: str) -> str:
+    with open(f"tests/fixtures/{name}", encoding="utf-8") as f:
+        return f.read()
+
+
+class TestParsers(unittest.TestCase):
+
+    def test_parse_car_prices(self):
+        for parser in HTML_PARSERS:
+            with self.subTest(parser=parser):
+                prices = parse_car_prices(read_fixture("iranjib_car.html"), parser)
+                self.assertEqual(
+                    [p.code for p in prices],
+                    ["CAR-ARISAN", "CAR-SOREN", "CAR-DENA", "CAR-PEUGEOT-PARS", "CAR-ATLAS", "CAR-SAINA-S"],
+                )
+                for p in prices:
+                    self.assertEqual(p.source, "iranjib")
+                    self.assertEqual(p.category, "car")
+                    self.assertGreater(p.price_high, 0)
+                    self.assertGreater(p.price_low, 0)
+
+    def test_parse_tgju_prices(self):
+        # tgju slugs have no translation yet, so all of them are pruned
+        self.assertEqual(parse_tgju_prices(read_fixture("tgju_currency.html")), [])
+        tgju_index = build_translation_index({"tgju": {"price_dollar_rl": "USD-TMN", "price_eur": "EUR-TMN"}})
+        with mock.patch.dict(translation_index, tgju_index):
+            for parser in HTML_PARSERS:
+                with self.subTest(parser=parser):
+                    prices = parse_tgju_prices(read_fixture("tgju_currency.html"), parser)
+                    # the slugs are repeated in 4 tables of the page
+                    self.assertEqual([p.code for p in prices], ["USD-TMN", "EUR-TMN"] * 4)
+                    self.assertEqual(prices[0].price_high, 577129)
+
+
+class TestCrawlEngine(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.requests = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            self.requests.append(request)
+            if request.url == IRANJIB_CAR_URL:
+                return httpx.Response(200, text=read_fixture("iranjib_car.html"))
+            return httpx.Response(503)
+
+        self.client = create_client(transport=httpx.MockTransport(handler))
+
+    async def asyncTearDown(self) -> None:
+        await self.client.aclose()
+
+    async def test_crawl_source(self):
+        result = await crawl_source(self.client, CrawlerSource(name="iranjib", fetch=fetch_car_prices))
+        self.assertEqual(result.error, "")
+        self.assertEqual(result.attempts, 1)
+        self.assertEqual(len(result.prices), 6)
+
+    async def test_retries(self):
+        """
+        failed attempts are retried with backoff and the error of the last attempt is reported.
+        """
+
+        async def fetch(client: httpx.AsyncClient, source: CrawlerSource, result: CrawlResult):
+            response = await client.get(TGJU_URL)
+            response.raise_for_status()
+
+        result = await crawl_source(self.client, CrawlerSource(name="tgju", fetch=fetch, retries=2, backoff=0.01))
+        self.assertEqual(result.attempts, 3)
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual(result.prices, [])
+        self.assertIn("503", result.error)
+
+    async def test_timeout(self):
+        async def fetch(client: httpx.AsyncClient, source: CrawlerSource, result: CrawlResult):
+            await asyncio.sleep(1)
+
+        result = await crawl_source(self.client, CrawlerSource(name="slow", fetch=fetch, timeout=0.05, retries=0))
+        self.assertEqual(result.attempts, 1)
+        self.assertIn("timed out", result.error)
+
+    async def test_concurrent(self):
+        """
+        sources are crawled concurrently, so the crawl takes as long as the slowest source.
+        """
+
+        def sleeper(seconds: float, code: str):
+            async def fetch(client: httpx.AsyncClient, source: CrawlerSource, result: CrawlResult):
+                await asyncio.sleep(seconds)
+                return [PriceData(code=code)]
+
+            return fetch
+
+        sources = [CrawlerSource(name=f"source{i}", fetch=sleeper(0.1 * i, f"CODE-{i}")) for i in range(1, 4)]
+        t0 = time.perf_counter()
+        results = await crawl_all(sources, self.client)
+        self.assertLess(time.perf_counter() - t0, 0.5)
+        self.assertEqual(list(results), ["source1", "source2", "source3"])
+        self.assertEqual(results["source3"].prices[0].code, "CODE-3")
+
+    async def test_cache(self):
+        """
+        with a cache, not modified pages and pages with the same prices are reported as unchanged,
+        once the previous crawl is committed.
+        """
+        page = {"etag": '"v1"', "html": read_fixture("iranjib_car.html")}
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            self.requests.append(request)
+            if request.headers.get("if-none-match") == page["etag"]:
+                return httpx.Response(304)
+            return httpx.Response(200, text=page["html"], headers={"ETag": page["etag"]})
+
+        source = CrawlerSource(name="iranjib", fetch=fetch_car_prices)
+        with tempfile.TemporaryDirectory() as directory:
+            cache = CrawlCache(directory)
+            async with create_client(transport=httpx.MockTransport(handler)) as client:
+                result = await crawl_source(client, source, cache)
+                self.assertFalse(result.unchanged)
+                self.assertEqual(len(result.prices), 6)
+                self.assertEqual(result.validators, {"etag": '"v1"'})
+
+                # not committed yet: nothing is known about the last crawl
+                self.assertFalse((await crawl_source(client, source, cache)).unchanged)
+                cache.commit(result)
+
+                result = await crawl_source(client, source, cache)
+                self.assertEqual(self.requests[-1].headers["if-none-match"], '"v1"')
+                self.assertTrue(result.unchanged)
+                self.assertEqual(result.prices, [])
+                cache.commit(result)
+
+                # a modified page with the same prices
+                page["etag"] = '"v2"'
+                result = await crawl_source(client, source, cache)
+                self.assertTrue(result.unchanged)
+                self.assertEqual(len(result.prices), 6)
+                cache.commit(result)
+                self.assertEqual(cache.load("iranjib")["validators"], {"etag": '"v2"'})
+
+                page["etag"] = '"v3"'
+                page["html"] = page["html"].replace(f"{result.prices[0].price_high:,.0f}", "1,000")
+                result = await crawl_source(client, source, cache)
+                self.assertFalse(result.unchanged)
+                self.assertEqual(result.prices[0].price_high, 1000)
+
+    async def test_run_schedules(self):
+        """
+        every source is crawled on its own interval.
+        """
+        counts = {"fast": 0, "slow": 0}
+
+        async def fetch(client: httpx.AsyncClient, source: CrawlerSource, result: CrawlResult):
+            return []
+
+        async def on_result(result):
+            counts[result.source] += 1
+
+        sources = [
+            CrawlerSource(name="fast", fetch=fetch, interval=0.05),
+            CrawlerSource(name="slow", fetch=fetch, interval=10),
+        ]
+        task = asyncio.create_task(run_schedules(on_result, sources, self.client))
+        await asyncio.sleep(0.28)
+        task.cancel()
+        self.assertGreaterEqual(counts["fast"], 4)
+        self.assertEqual(counts["slow"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
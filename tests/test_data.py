@@ -5,14 +5,19 @@ sys.path.append("src")
 
 from data_tools import (
     quantize_datetime,
+    quantize_datetimes,
+    quantize_indices,
     is_prices_same_day,
     PriceData,
     MAIN_CODES,
     bonbast_translate_dict,
     iranjib_transtale_dict,
     translate_prices,
+    compact_prices,
+    expand_prices,
 )
 from datetime import datetime, timezone, timedelta
+import numpy as np
 
 
 class TestDateTools(unittest.TestCase):
@@ -54,6 +59,23 @@ class TestDateTools(unittest.TestCase):
         dt = datetime(year=2024, month=2, day=15, hour=16, minute=30, second=59, microsecond=0, tzinfo=timezone.utc)
         self.assertEqual(quantize_datetime(dt, quantize_level=3), 15.0)
 
+    def test_quantize_datetimes(self):
+        """
+        the batched version must agree with quantize_datetime, for datetimes, PriceData and np.datetime64 arrays.
+        """
+        start = datetime(year=2024, month=2, day=15, tzinfo=timezone.utc)
+        dts = [start + timedelta(minutes=7 * i) for i in range(500)]
+        for quantize_level in (0.25, 0.5, 1, 1.5, 3):
+            expected = [quantize_datetime(dt, quantize_level) for dt in dts]
+            self.assertEqual(quantize_datetimes(dts, quantize_level).tolist(), expected)
+            prices = [PriceData(time=dt.isoformat()) for dt in dts]
+            self.assertEqual(quantize_datetimes(prices, quantize_level).tolist(), expected)
+            array = np.array([dt.replace(tzinfo=None) for dt in dts], dtype="datetime64[s]")
+            self.assertEqual(quantize_datetimes(array, quantize_level).tolist(), expected)
+
+        dts = [datetime(2024, 2, 15, 0, 0), datetime(2024, 2, 15, 10, 20), datetime(2024, 2, 15, 23, 59)]
+        self.assertEqual(quantize_indices(dts).tolist(), [0, 41, 95])
+
     def test_is_prices_same_day(self):
         """
         test if the two prices belong to the same day
@@ -120,6 +142,34 @@ class TestTranslator(unittest.TestCase):
         self.assertEqual(translated_no_prune[2].price_high, 3)
         self.assertEqual(translated_no_prune[0].code, "USD___")
         self.assertEqual(translated_no_prune[2].source, "bonbast___")
+        # the input prices are not modified
+        self.assertEqual(prices[1].code, "USD")
+
+    def test_translate_raw_prices(self):
+        """
+        raw (code, source, price_high, price_low, time) tuples are translated like the models.
+        """
+        raw = [("USD___", "bonbast", 1, 1, ""), ("USD", "bonbast", 2, 1.5, "2024-05-01T12:30:00")]
+        models = [PriceData(code=c, source=s, price_high=h, price_low=l, time=t) for c, s, h, l, t in raw]
+        self.assertEqual(translate_prices(raw), translate_prices(models))
+        self.assertEqual(translate_prices(raw, prune=False), translate_prices(models, prune=False))
+        self.assertEqual(translate_prices(raw)[0].category, MAIN_CODES["USD-TMN"][0])
+
+    def test_compact_prices(self):
+        """
+        prices survive the round trip through the compact delta payload.
+        """
+        prices = translate_prices(
+            [
+                PriceData(code="USD", source="bonbast", price_high=61000, price_low=60900, time="2024-05-01T12:30:00"),
+                PriceData(code="EUR", source="bonbast", price_high=65000, price_low=64900, time="2024-05-01T12:30:00"),
+                PriceData(code="پژو پارس", source="iranjib", price_high=8e8, price_low=6e8, time="2024-05-01T12:31:00"),
+            ]
+        )
+        payload = compact_prices(prices)
+        self.assertEqual(len(payload.deltas), 2)
+        self.assertEqual(payload.deltas[0].prices, [("USD-TMN", 61000, 60900), ("EUR-TMN", 65000, 64900)])
+        self.assertEqual(expand_prices(payload), prices)
 
 
 if __name__ == "__main__":
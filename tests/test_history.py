@@ -0,0 +1,110 @@
+import unittest
+import sys
+
+sys.path.append("src")
+
+from data_tools import PriceData
+from history_tools import (
+    BUCKET_FIELDS,
+    aggregate_buckets,
+    bucket_start,
+    decode_buckets,
+    format_history,
+    merge_tick,
+    parse_bucket_size,
+    price_timestamp,
+    stored_resolution,
+)
+from datetime import datetime, timezone, timedelta
+
+
+class TestHistoryTools(unittest.TestCase):
+
+    def test_bucket_start(self):
+        """
+        buckets are aligned to the local time of the price.
+        """
+        tehran_tz = timezone(timedelta(hours=3, minutes=30))
+        p = PriceData(time=datetime(2024, 5, 2, 17, 40, 12, tzinfo=tehran_tz).isoformat())
+        ts, offset = price_timestamp(p)
+        self.assertEqual(offset, 3 * 3600 + 30 * 60)
+        self.assertEqual(bucket_start(ts, offset, "15m"), datetime(2024, 5, 2, 17, 30, tzinfo=tehran_tz).timestamp())
+        self.assertEqual(bucket_start(ts, offset, "1h"), datetime(2024, 5, 2, 17, 0, tzinfo=tehran_tz).timestamp())
+        self.assertEqual(bucket_start(ts, offset, "1d"), datetime(2024, 5, 2, 0, 0, tzinfo=tehran_tz).timestamp())
+
+        # times without timezone are utc
+        ts, offset = price_timestamp(PriceData(time="2024-05-02T00:10:00"))
+        self.assertEqual(offset, 0)
+        self.assertEqual(bucket_start(ts, offset, "1d"), datetime(2024, 5, 2, tzinfo=timezone.utc).timestamp())
+
+    def test_merge_tick(self):
+        """
+        merge ticks into an OHLC bucket, including a tick that arrives out of order.
+        """
+        bucket = merge_tick(None, 0, 10, PriceData(price_high=100, price_low=90))
+        bucket = merge_tick(bucket.encode("utf-8"), 0, 20, PriceData(price_high=120, price_low=80))
+        bucket = merge_tick(bucket, 0, 5, PriceData(price_high=110, price_low=95))
+        row = dict(zip(BUCKET_FIELDS, decode_buckets([bucket])[0]))
+        self.assertEqual(row["count"], 3)
+        self.assertEqual((row["first"], row["last"]), (5, 20))
+        self.assertEqual(
+            [row[f"price_high_{f}"] for f in ("open", "max", "min", "close", "sum")], [110, 120, 100, 120, 330]
+        )
+        self.assertEqual([row[f"price_low_{f}"] for f in ("open", "max", "min", "close", "sum")], [95, 95, 80, 80, 265])
+
+    def test_decode_buckets(self):
+        buckets = [merge_tick(None, s, s + 1, PriceData(price_high=s)) for s in (0, 900, 1800)]
+        array = decode_buckets(buckets)
+        self.assertEqual(array.shape, (3, len(BUCKET_FIELDS)))
+        self.assertEqual(list(array[:, 0]), [0, 900, 1800])
+        self.assertEqual(decode_buckets([]).shape, (0, len(BUCKET_FIELDS)))
+
+    def test_parse_bucket_size(self):
+        self.assertEqual(parse_bucket_size("15m"), 900)
+        self.assertEqual(parse_bucket_size("4h"), 4 * 3600)
+        self.assertEqual(parse_bucket_size("1w"), 7 * 24 * 3600)
+        for bucket in ("10m", "h", "1y", "", "0h"):
+            with self.assertRaises(ValueError):
+                parse_bucket_size(bucket)
+        self.assertEqual(stored_resolution(900), "15m")
+        self.assertEqual(stored_resolution(4 * 3600), "1h")
+        self.assertEqual(stored_resolution(7 * 24 * 3600), "1d")
+        self.assertEqual(stored_resolution(45 * 60), "15m")
+        # days of utc are not made of the days of +03:30, nor hours of the hours
+        tehran = 3 * 3600 + 30 * 60
+        self.assertEqual(stored_resolution(24 * 3600, tehran, tehran), "1d")
+        self.assertEqual(stored_resolution(24 * 3600, 0, tehran), "15m")
+        self.assertEqual(stored_resolution(24 * 3600, 4 * 3600 + 30 * 60, tehran), "1h")
+        with self.assertRaises(ValueError):
+            stored_resolution(3600, 10 * 60, 0)
+
+    def test_aggregate_buckets(self):
+        """
+        combine hourly buckets into 2-hour buckets.
+        """
+        hourly = []
+        for hour, (high, low) in enumerate([(10, 1), (30, 3), (20, 2), (5, 4), (7, 0)]):
+            bucket = merge_tick(None, hour * 3600, hour * 3600 + 60, PriceData(price_high=high, price_low=low))
+            hourly.append(merge_tick(bucket, hour * 3600, hour * 3600 + 120, PriceData(price_high=high + 1, price_low=low)))
+        history = aggregate_buckets(decode_buckets(hourly), 2 * 3600)
+
+        rows = format_history(history)
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]["time"], "1970-01-01T00:00:00+00:00")
+        self.assertEqual(rows[0]["count"], 4)
+        self.assertEqual(
+            [rows[0][f"price_high_{f}"] for f in ("open", "max", "min", "close", "mean")], [10, 31, 10, 31, 20.5]
+        )
+        self.assertEqual([rows[1][f"price_low_{f}"] for f in ("open", "max", "min", "close")], [2, 4, 2, 4])
+        self.assertEqual(rows[2]["count"], 2)
+
+        columns = format_history(history, utc_offset=-3600, columnar=True)
+        self.assertEqual(columns["time"][1], "1970-01-01T01:00:00-01:00")
+        self.assertEqual(columns["count"], [4, 4, 2])
+
+        # aligned to a utc offset of 1 hour, the first bucket holds only the first hour
+        self.assertEqual(list(aggregate_buckets(decode_buckets(hourly), 2 * 3600, utc_offset=3600)[:, 1]), [2, 4, 4])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+from settings import *
+import sys
+
+sys.path.append("src")
+
+from prometheus_client import REGISTRY
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from metrics_tools import InstrumentedRedis, MetricsMiddleware, metrics_response
+from test_compression import call_app
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class TestMetricsMiddleware(unittest.IsolatedAsyncioTestCase):
+
+    async def test_routes(self):
+        """
+        requests are labeled with the path template of their route.
+        """
+
+        async def item(request):
+            return PlainTextResponse(request.path_params["name"])
+
+        app = Starlette(routes=[Route("/items/{name}", item)])
+        wrapped = MetricsMiddleware(app, app.routes)
+        labels = {"method": "GET", "route": "/items/{name}", "status": "200"}
+        before = sample("nerkh_http_requests_total", **labels)
+        others = sample("nerkh_http_requests_total", method="GET", route="other", status="404")
+        for path in ["/items/a", "/items/b", "/nothing"]:
+            scope_app = _with_path(wrapped, path)
+            await call_app(scope_app, "identity")
+        self.assertEqual(sample("nerkh_http_requests_total", **labels), before + 2)
+        self.assertEqual(sample("nerkh_http_requests_total", method="GET", route="other", status="404"), others + 1)
+        self.assertGreater(sample("nerkh_http_request_duration_seconds_count", method="GET", route="/items/{name}"), 0)
+        self.assertIn(b"nerkh_http_requests_total", metrics_response().body)
+
+
+def _with_path(app, path: str):
+    # call_app requests "/", route the request to another path
+    async def wrapper(scope, receive, send):
+        await app({**scope, "path": path, "query_string": b""}, receive, send)
+
+    return wrapper
+
+
+class TestInstrumentedRedis(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.r = InstrumentedRedis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=REDIS_INDEX)
+        await self.r.flushdb()
+
+    async def asyncTearDown(self) -> None:
+        await self.r.flushdb()
+        await self.r.aclose()
+
+    async def test_commands(self):
+        sets = sample("nerkh_redis_commands_total", command="SET", status="ok")
+        transactions = sample("nerkh_redis_commands_total", command="MULTI", status="ok")
+        await self.r.set("key", "value")
+        async with self.r.pipeline() as pipe:
+            await pipe.set("key", "a").get("key").execute()
+        self.assertEqual(sample("nerkh_redis_commands_total", command="SET", status="ok"), sets + 1)
+        self.assertEqual(sample("nerkh_redis_commands_total", command="MULTI", status="ok"), transactions + 1)
+        self.assertGreater(sample("nerkh_redis_command_duration_seconds_count", command="SET"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+import asyncio
+import itertools
+import time
+from unittest import mock
+from settings import *
+import redis.asyncio
+import sys
+
+sys.path.append("src")
+
+from pool_tools import FairConnectionPool
+
+
+class TestFairConnectionPool(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.pool = FairConnectionPool(
+            host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=REDIS_INDEX, max_connections=1, timeout=0.2
+        )
+
+    async def asyncTearDown(self) -> None:
+        await self.pool.disconnect()
+
+    async def test_first_in_first_out(self):
+        """
+        under load, connections are given to the tasks in their order of arrival. a task doing some work between its
+        commands, like a request, is not passed over by the ones arriving meanwhile.
+        """
+        self.pool.max_connections, self.pool.timeout = 2, 5
+        r = redis.asyncio.Redis(connection_pool=self.pool)
+        await asyncio.gather(r.ping(), r.ping())  # connect
+        arrivals, grants = itertools.count(), []
+        get_connection = self.pool.get_connection
+
+        async def ordered_get_connection(*args, **kwargs):
+            n = next(arrivals)
+            connection = await get_connection(*args, **kwargs)
+            grants.append(n)
+            return connection
+
+        async def request():
+            for _ in range(5):
+                time.sleep(0.001)  # cpu work, blocking the event loop
+                await r.ping()
+
+        with mock.patch.object(self.pool, "get_connection", ordered_get_connection):
+            await asyncio.gather(*[request() for _ in range(30)])
+        self.assertEqual(grants, sorted(grants))
+        self.assertEqual(len(grants), 150)
+
+    async def test_timeout(self):
+        """
+        a task waiting longer than the timeout fails, and doesn't keep the next released connection.
+        """
+        connection = await self.pool.get_connection("PING")
+        with self.assertRaises(redis.asyncio.ConnectionError):
+            await self.pool.get_connection("PING")
+        await self.pool.release(connection)
+        self.assertIs(await self.pool.get_connection("PING"), connection)
+
+    async def test_client(self):
+        """
+        concurrent commands share the connections of the pool.
+        """
+        self.pool.max_connections = 2
+        r = redis.asyncio.Redis(connection_pool=self.pool)
+        replies = await asyncio.gather(*[r.echo(str(i)) for i in range(20)])
+        self.assertEqual(replies, [str(i).encode() for i in range(20)])
+        self.assertLessEqual(len(self.pool._available_connections), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
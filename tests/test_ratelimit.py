@@ -0,0 +1,87 @@
+import unittest
+from settings import *
+import redis.asyncio
+import sys
+import time
+from unittest import mock
+
+sys.path.append("src")
+
+from ratelimit_tools import RateLimiter, client_ip, parse_trusted_proxies
+
+
+class TestRateLimiter(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.r = redis.asyncio.Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=REDIS_INDEX)
+        await self.r.flushdb()
+
+    async def asyncTearDown(self) -> None:
+        await self.r.flushdb()
+        await self.r.aclose()
+
+    async def test_token_bucket(self):
+        """
+        a client gets `burst` requests at once, then one request per 1/rate seconds.
+        """
+        limiter = RateLimiter(self.r, {"get_prices": (20, 3)})
+        for _ in range(3):
+            self.assertEqual(await limiter.hit("get_prices", "ip:1"), 0)
+        retry_after = await limiter.hit("get_prices", "ip:1")
+        self.assertGreater(retry_after, 0)
+        self.assertLessEqual(retry_after, 1 / 20)
+        # other clients and endpoints have their own buckets
+        self.assertEqual(await limiter.hit("get_prices", "ip:2"), 0)
+        self.assertEqual(await limiter.hit("history", "ip:1"), 0)  # not limited
+
+        time.sleep(retry_after)
+        self.assertEqual(await limiter.hit("get_prices", "ip:1"), 0)
+        self.assertGreater(await self.r.pttl("ratelimit:get_prices:ip:1"), 0)
+
+    async def test_shared_buckets(self):
+        """
+        workers share the buckets of the clients.
+        """
+        workers = [RateLimiter(self.r, {"submit_prices": (0.1, 2)}) for _ in range(2)]
+        self.assertEqual(await workers[0].hit("submit_prices", "sub:bot"), 0)
+        self.assertEqual(await workers[1].hit("submit_prices", "sub:bot"), 0)
+        self.assertGreater(await workers[0].hit("submit_prices", "sub:bot"), 0)
+        self.assertGreater(await workers[1].hit("submit_prices", "sub:bot"), 0)
+
+    async def test_blocked_fast_path(self):
+        """
+        a rejected client is rejected again without a round-trip to redis until its next token.
+        """
+        limiter = RateLimiter(self.r, {"get_prices": (0.1, 1)})
+        await limiter.hit("get_prices", "ip:1")
+        self.assertGreater(await limiter.hit("get_prices", "ip:1"), 0)
+        with mock.patch.object(limiter, "script", side_effect=AssertionError("redis was called")):
+            self.assertGreater(await limiter.hit("get_prices", "ip:1"), 9)
+
+    async def test_fail_open(self):
+        limiter = RateLimiter(self.r, {"get_prices": (0.1, 1)})
+        with mock.patch.object(limiter, "script", side_effect=redis.asyncio.ConnectionError()):
+            for _ in range(3):
+                self.assertEqual(await limiter.hit("get_prices", "ip:1"), 0)
+
+
+class TestClientIp(unittest.TestCase):
+
+    def test_client_ip(self):
+        """
+        X-Forwarded-For is trusted from the trusted proxies only, up to the first address that isn't one of them.
+        """
+        trusted = parse_trusted_proxies(["127.0.0.1", "10.0.0.0/8"])
+        self.assertEqual(client_ip("127.0.0.1", None, trusted), "127.0.0.1")
+        self.assertEqual(client_ip("127.0.0.1", "203.0.113.5", trusted), "203.0.113.5")
+        # edge cache then the hosting proxy, and an address forged by the client
+        self.assertEqual(client_ip("10.1.2.3", "1.1.1.1, 203.0.113.5, 10.9.9.9", trusted), "203.0.113.5")
+        self.assertEqual(client_ip("198.51.100.7", "203.0.113.5", trusted), "198.51.100.7")
+        self.assertEqual(client_ip("10.1.2.3", "not an ip, 10.9.9.9", trusted), "not an ip")
+        self.assertEqual(client_ip("198.51.100.7", "1.1.1.1, 203.0.113.5", parse_trusted_proxies(["*"])), "1.1.1.1")
+        with self.assertRaises(ValueError):
+            parse_trusted_proxies(["proxy"])
+
+
+if __name__ == "__main__":
+    unittest.main()
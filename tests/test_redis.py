@@ -1,14 +1,17 @@
 import unittest
 from settings import *
 import redis
-from datetime import datetime, timedelta
+import redis.asyncio
+from datetime import datetime, timedelta, timezone
 import json
 import sys
 
 sys.path.append("src")
 
 from data_tools import PriceData
-from app import store_price_in_db, get_price_from_db, analyze_and_store_price
+from history_tools import bucket_key, bucket_start, decode_buckets, index_key, ticks_key
+from aggregation_tools import PriceAggregator, read_with_quotes, sources_key
+from app import store_price_in_db, get_price_from_db, get_prices_from_db, analyze_and_store_price, analyze_and_store_prices
 
 
 class TestRedisConnection(unittest.TestCase):
@@ -26,71 +29,66 @@ class TestRedisConnection(unittest.TestCase):
         self.assertTrue(connected, "Failed to connect to Redis database")
 
 
-class TestRedisData(unittest.TestCase):
+class TestRedisData(unittest.IsolatedAsyncioTestCase):
 
-    @classmethod
-    def setUpClass(cls) -> None:
-        r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=REDIS_INDEX)
-        r.flushdb()
-        cls.r = r
+    async def asyncSetUp(self) -> None:
+        self.r = redis.asyncio.Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=REDIS_INDEX)
+        await self.r.flushdb()
 
-    @classmethod
-    def tearDownClass(cls) -> None:
-        cls.r.flushdb()
+    async def asyncTearDown(self) -> None:
+        await self.r.flushdb()
+        await self.r.aclose()
 
-    def setUp(self) -> None:
-        self.r.flushdb()
-
-    def test_string(self):
+    async def test_string(self):
         """
         insert a string key&value and check if they are stored correctly.
         """
         key = "testkey1"
         value = "testvalue1"
-        self.r.set(key, value)
-        self.assertTrue(self.r.exists(key))
-        self.assertEqual(self.r.get(key).decode("utf-8"), value)
+        await self.r.set(key, value)
+        self.assertTrue(await self.r.exists(key))
+        self.assertEqual((await self.r.get(key)).decode("utf-8"), value)
 
-    def test_int(self):
+    async def test_int(self):
         """
         insert a int key&value and check if they are stored correctly.
         """
         key = 132
         value = 123
-        self.r.set(key, value)
-        self.assertTrue(self.r.exists(key))
-        self.assertEqual(int(self.r.get(key)), value)
+        await self.r.set(key, value)
+        self.assertTrue(await self.r.exists(key))
+        self.assertEqual(int(await self.r.get(key)), value)
 
-    def test_datetime(self):
+    async def test_datetime(self):
         """
         insert a datetime key&value and check if they are stored correctly.
         """
         key = datetime(2024, 1, 5, 23, 45, 0)
         value = datetime(2024, 1, 6, 23, 45, 0)
-        self.r.set(key.isoformat(), value.isoformat())
-        self.assertTrue(self.r.exists(key.isoformat()))
-        self.assertEqual(datetime.fromisoformat(self.r.get(key.isoformat()).decode("utf-8")), value)
+        await self.r.set(key.isoformat(), value.isoformat())
+        self.assertTrue(await self.r.exists(key.isoformat()))
+        self.assertEqual(datetime.fromisoformat((await self.r.get(key.isoformat())).decode("utf-8")), value)
 
-    def test_json(self):
+    async def test_json(self):
         """
         insert a json value and check if they are stored correctly.
         """
         my_dict = {"key1": "value1", "key2": "value2", "key3": 3}
         json_str = json.dumps(my_dict)
-        self.r.set("my_dict_key", json_str)
-        stored_json_str = self.r.get("my_dict_key")
+        await self.r.set("my_dict_key", json_str)
+        stored_json_str = await self.r.get("my_dict_key")
         stored_dict = json.loads(stored_json_str)
         self.assertEqual(my_dict, stored_dict)
 
-    def test_2d_index(self):
+    async def test_2d_index(self):
         name = "USD"
         time = "10.25"
         price = "14700"
         key = f"variable:{name}:{time}"
-        self.r.hset(key, "value", price)
-        self.assertEqual(self.r.hget(key, "value").decode("utf-8"), price)
+        await self.r.hset(key, "value", price)
+        self.assertEqual((await self.r.hget(key, "value")).decode("utf-8"), price)
 
-    def test_store_get_price_from_db(self):
+    async def test_store_get_price_from_db(self):
         p = PriceData(
             code="USD",
             description="us dollar",
@@ -99,38 +97,142 @@ class TestRedisData(unittest.TestCase):
             price2=68000,
             time=datetime.now().isoformat(),
         )
-        store_price_in_db(p.code, p, self.r)
-        self.assertEqual(p.model_dump(), get_price_from_db(p.code, self.r).model_dump())
+        await store_price_in_db(p.code, p, self.r)
+        self.assertEqual(p.model_dump(), (await get_price_from_db(p.code, self.r)).model_dump())
+
+    async def test_get_prices_from_db(self):
+        """
+        get several prices at once and check that missing keys are reported.
+        """
+        p1 = PriceData(code="USD-TMN", price_high=70000, time=datetime.now().isoformat())
+        p2 = PriceData(code="EUR-TMN", price_high=75000, time=datetime.now().isoformat())
+        await store_price_in_db("USD-TMN:current", p1, self.r)
+        await store_price_in_db("EUR-TMN:current", p2, self.r)
+
+        prices = await get_prices_from_db(["EUR-TMN:current", "USD-TMN:current"], self.r)
+        self.assertEqual([p2.model_dump(), p1.model_dump()], [p.model_dump() for p in prices])
 
-    def test_analyze_and_store(self):
+        with self.assertRaises(KeyError) as cm:
+            await get_prices_from_db(["USD-TMN:current", "GBP-TMN:current", "CHF-TMN:current"], self.r)
+        self.assertIn("GBP-TMN:current", str(cm.exception))
+        self.assertIn("CHF-TMN:current", str(cm.exception))
+
+        prices = await get_prices_from_db(["USD-TMN:current", "GBP-TMN:current"], self.r, missing_ok=True)
+        self.assertEqual([p1.model_dump()], [p.model_dump() for p in prices])
+        self.assertEqual(await get_prices_from_db([], self.r), [])
+
+    async def test_analyze_and_store(self):
         # try to insert a price with invalid code, expected to get an error
         newprice = PriceData(code="fake")
         with self.assertRaises(KeyError):
-            analyze_and_store_price(newprice, self.r)
+            await analyze_and_store_price(newprice, self.r)
 
         # insert a valid code and retrieve it
         code = "USD-TMN"
         newprice = PriceData(code=code, price_high=70000, price_low=69000, time="2024-05-02T17:15:00")
-        analyze_and_store_price(newprice, self.r)
-        self.assertEqual(newprice.model_dump(), get_price_from_db(f"{code}:current", self.r).model_dump())
+        await analyze_and_store_price(newprice, self.r)
+        self.assertEqual(newprice.model_dump(), (await get_price_from_db(f"{code}:current", self.r)).model_dump())
 
         # insert a valid code while it is already available in the db (same day, 15 mins later)
         newprice = PriceData(code=code, price_high=72000, price_low=70000, time="2024-05-02T17:30:00")
-        analyze_and_store_price(newprice, self.r)
-        self.assertFalse(self.r.exists(f"{code}:yesterday"))  # we shouldn't still have a price for yesterday
-        self.assertEqual(newprice.model_dump(), get_price_from_db(f"{code}:current", self.r).model_dump())
+        await analyze_and_store_price(newprice, self.r)
+        self.assertFalse(await self.r.exists(f"{code}:yesterday"))  # we shouldn't still have a price for yesterday
+        self.assertEqual(newprice.model_dump(), (await get_price_from_db(f"{code}:current", self.r)).model_dump())
 
         # insert a valid code while it is already available in the db (next day)
         newprice_newday = PriceData(code=code, price_high=75000, price_low=74000, time="2024-05-03T17:30:00")
-        analyze_and_store_price(newprice_newday, self.r)
-        self.assertTrue(self.r.exists(f"{code}:yesterday"))  # we should have a price for yesterday
-        self.assertEqual(newprice.model_dump(), get_price_from_db(f"{code}:yesterday", self.r).model_dump())
+        await analyze_and_store_price(newprice_newday, self.r)
+        self.assertTrue(await self.r.exists(f"{code}:yesterday"))  # we should have a price for yesterday
+        self.assertEqual(newprice.model_dump(), (await get_price_from_db(f"{code}:yesterday", self.r)).model_dump())
 
-        current_price = get_price_from_db(f"{code}:current", self.r)
+        current_price = await get_price_from_db(f"{code}:current", self.r)
         self.assertNotEqual(newprice_newday.model_dump(), current_price.model_dump())
         self.assertEqual(current_price.price_high_change, 3000)
         self.assertEqual(current_price.price_low_change, 4000)
 
+    async def test_analyze_and_store_batch(self):
+        """
+        store a batch of prices in one transaction. invalid codes are rejected and prices of the same code are applied in order.
+        """
+        batch = [
+            PriceData(code="USD-TMN", price_high=70000, price_low=69000, time="2024-05-02T17:15:00"),
+            PriceData(code="fake", time="2024-05-02T17:15:00"),
+            PriceData(code="EUR-TMN", price_high=80000, price_low=79000, time="2024-05-02T17:15:00"),
+            PriceData(code="USD-TMN", price_high=71000, price_low=70000, time="2024-05-03T10:00:00"),
+        ]
+        accepted, rejected = await analyze_and_store_prices(batch, self.r)
+        self.assertEqual(accepted, ["USD-TMN", "EUR-TMN", "USD-TMN"])
+        self.assertEqual(rejected, ["fake"])
+
+        self.assertEqual(batch[0].model_dump(), (await get_price_from_db("USD-TMN:yesterday", self.r)).model_dump())
+        current_price = await get_price_from_db("USD-TMN:current", self.r)
+        self.assertEqual(current_price.price_high_change, 1000)
+        self.assertEqual(current_price.price_low_change, 1000)
+        self.assertEqual(batch[2].model_dump(), (await get_price_from_db("EUR-TMN:current", self.r)).model_dump())
+        self.assertFalse(await self.r.exists("EUR-TMN:yesterday"))
+
+        # submitting the same next-day batch again must not roll the code over twice
+        await analyze_and_store_prices(batch[3:], self.r)
+        self.assertEqual(batch[0].model_dump(), (await get_price_from_db("USD-TMN:yesterday", self.r)).model_dump())
+
+    async def test_analyze_and_store_sources(self):
+        """
+        prices of several sources are kept as quotes, and the current price follows the aggregation policy.
+        """
+        now = datetime.now(timezone.utc)
+        bonbast = PriceData(code="USD-TMN", source="bonbast", price_high=70000, price_low=69000, time=now.isoformat())
+        later = (now + timedelta(minutes=50)).isoformat()
+        tgju = PriceData(code="USD-TMN", source="tgju", price_high=71000, price_low=70000, time=later)
+        priority = PriceAggregator("priority", priority=["bonbast", "tgju"])
+        await analyze_and_store_prices([bonbast, tgju], self.r, priority)
+        self.assertEqual(bonbast.model_dump(), (await get_price_from_db("USD-TMN:current", self.r)).model_dump())
+        self.assertEqual(set(await self.r.hkeys(sources_key("USD-TMN"))), {b"bonbast", b"tgju"})
+        # a quote of the lower priority source changes nothing in the history
+        self.assertEqual(await self.r.zcard(ticks_key("USD-TMN")), 1)
+        self.assertEqual(await self.r.zcard(index_key("USD-TMN", "15m")), 1)  # tgju's bucket isn't created
+
+        await analyze_and_store_prices([tgju], self.r, PriceAggregator("median"))
+        current_price = await get_price_from_db("USD-TMN:current", self.r)
+        self.assertEqual((current_price.source, current_price.price_high), ("bonbast,tgju", 70500))
+        self.assertEqual(current_price.time, tgju.time)
+
+    async def test_read_with_quotes(self):
+        """
+        keys and quotes are read in one script, missing ones included.
+        """
+        await self.r.set("a", "1")
+        await self.r.hset(sources_key("USD-TMN"), mapping={"bonbast": "x", "tgju": "y"})
+        values, quotes = await read_with_quotes(self.r, ["a", "b"], ["USD-TMN", "EUR-TMN"])
+        self.assertEqual(values, [b"1", None])
+        self.assertEqual(quotes, [{b"bonbast": b"x", b"tgju": b"y"}, {}])
+
+    async def test_history(self):
+        """
+        stored prices are appended to the ticks and OHLC buckets of their code.
+        """
+        t0 = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) - timedelta(hours=2)
+        batch = [
+            PriceData(code="USD-TMN", price_high=70000, price_low=69000, time=t0.isoformat()),
+            PriceData(code="USD-TMN", price_high=72000, price_low=70000, time=(t0 + timedelta(minutes=20)).isoformat()),
+            PriceData(code="USD-TMN", price_high=71000, price_low=69500, time=(t0 + timedelta(minutes=70)).isoformat()),
+        ]
+        await analyze_and_store_prices(batch, self.r)
+
+        self.assertEqual(await self.r.zcard(ticks_key("USD-TMN")), 3)
+        self.assertEqual(await self.r.zcard(index_key("USD-TMN", "15m")), 3)
+        self.assertEqual(await self.r.zcard(index_key("USD-TMN", "1h")), 2)
+
+        start = bucket_start(t0.timestamp(), HISTORY_UTC_OFFSET, "1h")
+        hour = decode_buckets([await self.r.get(bucket_key("USD-TMN", "1h", start))])[0]
+        self.assertEqual(list(hour[[0, 1]]), [start, 2])  # start, count
+        self.assertEqual(list(hour[4:9]), [70000, 72000, 70000, 72000, 142000])  # price_high open, max, min, close, sum
+        self.assertGreater(await self.r.ttl(bucket_key("USD-TMN", "1h", start)), 0)
+
+        # prices older than the retention are not kept in the history
+        await analyze_and_store_prices([PriceData(code="EUR-TMN", price_high=1, time="2000-01-01T00:00:00")], self.r)
+        self.assertEqual(await self.r.zcard(ticks_key("EUR-TMN")), 0)
+        self.assertEqual(await self.r.zcard(index_key("EUR-TMN", "1d")), 0)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+from settings import *
+import redis.asyncio
+import sys
+from datetime import datetime
+
+sys.path.append("src")
+
+from data_tools import PriceData, translate_prices
+from storage_tools import FLAG_DERIVED_INFO, decode_price, encode_price, is_legacy, migrate_legacy_prices
+
+
+class TestStorageFormat(unittest.TestCase):
+
+    def test_round_trip(self):
+        prices = translate_prices(
+            [PriceData(code="USD", source="bonbast", price_high=61000, price_low=60900, time="2024-05-01T12:30:00+03:30")]
+        )
+        prices += [
+            PriceData(code="USD", description="us dollar", source="bonbast", time=datetime.now().isoformat()),
+            PriceData(code="EUR-TMN", price_high=1.5, price_high_change=-0.25),  # no time
+            PriceData(code="EUR-TMN", time="2024-05-01T12:30:00.000"),  # not the form isoformat() writes
+            PriceData(code="CAR-ATLAS", category="car", description="سایپا اطلس", time="1969-12-31T23:59:59.5-05:00"),
+        ]
+        for p in prices:
+            encoded = encode_price(p)
+            self.assertEqual(decode_price(encoded), p)
+            # decoded prices are not validated, they must serialize as the validated ones
+            self.assertEqual(decode_price(encoded).model_dump_json(), p.model_dump_json())
+            self.assertFalse(is_legacy(encoded))
+            self.assertLess(len(encoded), len(p.model_dump_json()) / 2)
+
+        # category and description of a translated price are not stored
+        self.assertTrue(encode_price(prices[0])[1] & FLAG_DERIVED_INFO)
+        self.assertNotIn("US Dollar".encode(), encode_price(prices[0]))
+
+    def test_legacy(self):
+        p = PriceData(code="USD-TMN", price_high=70000, time=datetime.now().isoformat())
+        self.assertTrue(is_legacy(p.model_dump_json().encode()))
+        self.assertEqual(decode_price(p.model_dump_json().encode()), p)
+        with self.assertRaises(ValueError):
+            decode_price(b"\x09" + encode_price(p)[1:])
+
+
+class TestMigration(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.r = redis.asyncio.Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=REDIS_INDEX)
+        await self.r.flushdb()
+
+    async def asyncTearDown(self) -> None:
+        await self.r.flushdb()
+        await self.r.aclose()
+
+    async def test_migrate_legacy_prices(self):
+        p1 = PriceData(code="USD-TMN", price_high=70000, time=datetime.now().isoformat())
+        p2 = PriceData(code="EUR-TMN", price_high=75000, time=datetime.now().isoformat())
+        await self.r.set("USD-TMN:current", p1.model_dump_json())
+        await self.r.set("EUR-TMN:current", encode_price(p2))
+        keys = ["USD-TMN:current", "EUR-TMN:current", "GBP-TMN:current"]
+
+        self.assertEqual(await migrate_legacy_prices(keys, self.r), 1)
+        self.assertEqual(await self.r.get("USD-TMN:current"), encode_price(p1))
+        self.assertEqual(await self.r.get("EUR-TMN:current"), encode_price(p2))
+        self.assertFalse(await self.r.exists("GBP-TMN:current"))
+        self.assertEqual(await migrate_legacy_prices(keys, self.r), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+import asyncio
+import json
+import sys
+
+sys.path.append("src")
+
+from stream_tools import PriceStreamHub
+
+
+class TestPriceStreams(unittest.IsolatedAsyncioTestCase):
+
+    async def test_publish(self):
+        """
+        a stream gets the updates of its codes, or all updates if it has no codes.
+        """
+        hub = PriceStreamHub()
+        usd, everything = hub.open(["USD-TMN"]), hub.open()
+        hub.publish({"USD-TMN": b'{"code":"USD-TMN"}', "EUR-TMN": b'{"code":"EUR-TMN"}'})
+        self.assertEqual(json.loads(await usd.next()), {"prices": [{"code": "USD-TMN"}]})
+        self.assertEqual(len(json.loads(await everything.next())["prices"]), 2)
+        self.assertIsNone(await usd.next(timeout=0.05))
+
+        hub.publish({"EUR-TMN": b'{"code":"EUR-TMN"}'})
+        self.assertIsNone(await usd.next(timeout=0.05))
+        hub.close(everything)
+        self.assertEqual(hub.streams, {usd})
+
+    async def test_latest_only(self):
+        """
+        a slow stream gets only the latest price of each code.
+        """
+        hub = PriceStreamHub()
+        stream = hub.open()
+        for price in range(3):
+            hub.publish({"USD-TMN": json.dumps({"code": "USD-TMN", "price_high": price}).encode()})
+        self.assertEqual(json.loads(await stream.next())["prices"], [{"code": "USD-TMN", "price_high": 2}])
+
+    async def test_wakeup(self):
+        hub = PriceStreamHub()
+        stream = hub.open(["USD-TMN"])
+        waiter = asyncio.create_task(stream.next())
+        await asyncio.sleep(0.05)
+        self.assertFalse(waiter.done())
+        hub.publish({"USD-TMN": b"{}"})
+        self.assertEqual(await asyncio.wait_for(waiter, 1), b'{"prices":[{}]}')
+
+    def test_max_streams(self):
+        hub = PriceStreamHub(max_streams=1)
+        self.assertIsNotNone(hub.open())
+        self.assertIsNone(hub.open())
+
+
+if __name__ == "__main__":
+    unittest.main()
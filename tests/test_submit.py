@@ -0,0 +1,188 @@
+import unittest
+import asyncio
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+import httpx
+
+sys.path.append("src")
+
+from data_tools import (
+    MAIN_CODES,
+    AssetInfo,
+    AssetsPayload,
+    PriceData,
+    PricesDeltaPayload,
+    expand_prices,
+    load_assets,
+    read_assets_file,
+)
+from crawlers import CrawlResult, create_client
+from submit_tools import SubmittedSnapshot, SubmitTarget, fetch_assets, post_prices, submit_all
+
+
+class TestSubmittedSnapshot(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "submitter", "snapshot.json")
+        self.prices = [
+            PriceData(code="USD-TMN", source="bonbast", price_high=61000, price_low=60900),
+            PriceData(code="EUR-TMN", source="bonbast", price_high=65000, price_low=64900),
+        ]
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_changes(self):
+        """
+        only the prices that differ from the last submitted ones are submitted, and the snapshot persists.
+        """
+        snapshot = SubmittedSnapshot(self.path)
+        crawl = CrawlResult(source="bonbast", prices=self.prices)
+        self.assertEqual(snapshot.to_submit(crawl, full_sync=False), self.prices)
+        snapshot.update(self.prices)
+
+        snapshot = SubmittedSnapshot(self.path)
+        changed = PriceData(code="EUR-TMN", source="bonbast", price_high=65100, price_low=64900)
+        crawl = CrawlResult(source="bonbast", prices=[self.prices[0], changed])
+        self.assertEqual(snapshot.to_submit(crawl, full_sync=False), [changed])
+        self.assertEqual(snapshot.to_submit(CrawlResult(source="bonbast", unchanged=True), full_sync=False), [])
+
+    def test_full_sync(self):
+        """
+        a full sync submits all prices of the source, the last submitted ones if its page is not modified.
+        """
+        snapshot = SubmittedSnapshot(self.path)
+        self.assertTrue(snapshot.full_sync_due("bonbast", 3600))
+        snapshot.update(self.prices, full_synced=["bonbast"])
+        self.assertFalse(snapshot.full_sync_due("bonbast", 3600))
+        self.assertTrue(snapshot.full_sync_due("iranjib", 3600))
+
+        crawl = CrawlResult(source="bonbast", prices=self.prices)
+        self.assertEqual(snapshot.to_submit(crawl, full_sync=True), self.prices)
+        prices = snapshot.to_submit(CrawlResult(source="bonbast", unchanged=True), full_sync=True)
+        self.assertEqual(
+            [(p.code, p.price_high, p.price_low) for p in prices], [("USD-TMN", 61000, 60900), ("EUR-TMN", 65000, 64900)]
+        )
+        self.assertTrue(all(p.time for p in prices))
+
+    def test_sources(self):
+        """
+        sources reporting the same code are tracked separately.
+        """
+        snapshot = SubmittedSnapshot(self.path)
+        tgju = [PriceData(code="USD-TMN", source="tgju", price_high=61500, price_low=61000)]
+        snapshot.update(self.prices, full_synced=["bonbast"])
+        snapshot.update(tgju, full_synced=["tgju"])
+
+        snapshot = SubmittedSnapshot(self.path)
+        self.assertEqual(snapshot.to_submit(CrawlResult(source="bonbast", prices=self.prices), full_sync=False), [])
+        self.assertEqual(snapshot.to_submit(CrawlResult(source="tgju", prices=tgju), full_sync=False), [])
+        for source, prices in [("bonbast", self.prices), ("tgju", tgju)]:
+            synced = snapshot.to_submit(CrawlResult(source=source, unchanged=True), full_sync=True)
+            self.assertEqual(
+                [(p.code, p.source, p.price_high) for p in synced], [(p.code, source, p.price_high) for p in prices]
+            )
+
+    def test_previous_format(self):
+        """
+        a snapshot saved by the previous versions, keyed by code only, is still read.
+        """
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"values": {"USD-TMN": ["bonbast", 61000, 60900]}, "full_synced_at": {"bonbast": 0}}, f)
+        snapshot = SubmittedSnapshot(self.path)
+        self.assertEqual(snapshot.changes(self.prices), [self.prices[1]])
+
+
+class TestSubmitAll(unittest.IsolatedAsyncioTestCase):
+
+    async def test_submit_all(self):
+        """
+        prices are posted gzip compressed to all targets concurrently, with retries of the failed attempts.
+        """
+        prices = [PriceData(code="USD-TMN", source="bonbast", price_high=61000, price_low=60900, time="2024-05-01")]
+        attempts = {}
+
+        async def handler(request: httpx.Request) -> httpx.Response:
+            host = request.url.host
+            attempts[host] = attempts.get(host, 0) + 1
+            self.assertEqual(request.headers["content-encoding"], "gzip")
+            self.assertEqual(request.headers["token"], "secret")
+            payload = PricesDeltaPayload.model_validate_json(gzip.decompress(request.content))
+            self.assertEqual(expand_prices(payload)[0].price_high, 61000)
+            await asyncio.sleep(0.2)
+            if host == "flaky" and attempts[host] == 1:
+                return httpx.Response(503)
+            if host == "unauthorized":
+                return httpx.Response(401, text="invalid token")
+            return httpx.Response(200, text="1/1 prices stored successfully.")
+
+        targets = [
+            SubmitTarget(url="http://flaky/submit_prices_delta", backoff=0.01),
+            SubmitTarget(url="http://unauthorized/submit_prices_delta"),
+            SubmitTarget(url="http://slow/submit_prices_delta", timeout=0.1, retries=1, backoff=0.01),
+            SubmitTarget(url="http://ok/submit_prices_delta"),
+        ]
+        async with create_client(transport=httpx.MockTransport(handler)) as client:
+            t0 = time.perf_counter()
+            flaky, unauthorized, slow, ok = await submit_all(client, targets, prices, "secret")
+            # the targets are posted to concurrently: the submission takes as long as the two attempts of the flaky one
+            self.assertLess(time.perf_counter() - t0, 0.6)
+
+        self.assertTrue(flaky.ok)
+        self.assertEqual(flaky.attempts, 2)
+        self.assertFalse(unauthorized.ok)
+        self.assertEqual((unauthorized.status_code, unauthorized.attempts), (401, 1))
+        self.assertEqual(unauthorized.response, "invalid token")
+        self.assertFalse(slow.ok)
+        self.assertEqual(slow.attempts, 2)
+        self.assertIn("timed out", slow.error)
+        self.assertTrue(ok.ok)
+        self.assertEqual(ok.attempts, 1)
+
+    async def test_retry_after(self):
+        """
+        a rate limited submission is retried after the Retry-After of the server.
+        """
+        times = []
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            times.append(time.perf_counter())
+            if len(times) == 1:
+                return httpx.Response(429, headers={"Retry-After": "0.3"})
+            return httpx.Response(200)
+
+        async with create_client(transport=httpx.MockTransport(handler)) as client:
+            result = await post_prices(client, SubmitTarget(url="http://limited/", backoff=0.01), b"", "secret")
+        self.assertTrue(result.ok)
+        self.assertEqual(result.attempts, 2)
+        self.assertGreaterEqual(times[1] - times[0], 0.3)
+
+    async def test_fetch_assets(self):
+        """
+        the submitter follows the asset catalog of a server, and keeps its own if the server fails.
+        """
+        assets = read_assets_file()[:2] + [AssetInfo(code="USDT-TMN", category="digital_currency")]
+
+        def handler(request: httpx.Request) -> httpx.Response:
+            if request.url.path == "/assets":
+                return httpx.Response(200, content=AssetsPayload(assets=assets).model_dump_json())
+            return httpx.Response(503)
+
+        try:
+            async with create_client(transport=httpx.MockTransport(handler)) as client:
+                self.assertEqual(await fetch_assets(client, "http://nerkh/assets"), "")
+                self.assertEqual(list(MAIN_CODES), [a.code for a in assets])
+                self.assertIn("503", await fetch_assets(client, "http://nerkh/down"))
+                self.assertEqual(list(MAIN_CODES), [a.code for a in assets])
+        finally:
+            load_assets(read_assets_file())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,11 +1,22 @@
 import unittest
-from datetime import timedelta
+import asyncio
+from settings import *
+import redis.asyncio
+from datetime import datetime, timedelta, timezone
 import time
 import sys
 
 sys.path.append("src")
 
-from authentication_tools import generate_token, validate_token
+from authentication_tools import (
+    TokenCache,
+    generate_token,
+    hash_token,
+    is_token_revoked,
+    listen_for_revocations,
+    revoke_token,
+    validate_token,
+)
 
 
 class TestToken(unittest.TestCase):
@@ -46,5 +57,65 @@ class TestToken(unittest.TestCase):
         self.assertEqual(auth[1], "Token has expired")
 
 
+class TestTokenCache(unittest.TestCase):
+
+    def test_cache(self):
+        cache = TokenCache(max_size=2, ttl=60)
+        expiration = datetime.now(timezone.utc) + timedelta(days=1)
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", "user-a", expiration)
+        cache.put("b", "user-b", expiration)
+        self.assertEqual(cache.get("a"), "user-a")
+        cache.put("c", "user-c", expiration)  # "b" is the least recently used
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), "user-c")
+        self.assertNotIn("a", cache.tokens)  # tokens are kept by their hash
+        cache.discard(hash_token("a"))
+        self.assertIsNone(cache.get("a"))
+
+    def test_expiration(self):
+        """
+        a token is never cached after its expiration.
+        """
+        cache = TokenCache(ttl=60)
+        cache.put("a", "user-a", datetime.now(timezone.utc) + timedelta(seconds=0.1))
+        self.assertEqual(cache.get("a"), "user-a")
+        time.sleep(0.2)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache.tokens), 0)
+
+
+class TestRevocation(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self) -> None:
+        self.r = redis.asyncio.Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=REDIS_INDEX)
+        await self.r.flushdb()
+
+    async def asyncTearDown(self) -> None:
+        await self.r.flushdb()
+        await self.r.aclose()
+
+    async def test_revoke_token(self):
+        """
+        a revoked token is dropped from the caches of the listening workers.
+        """
+        token = generate_token("testuser")
+        cache = TokenCache()
+        cache.put(token, "testuser", validate_token(token)[3])
+        listener = asyncio.create_task(listen_for_revocations(self.r, cache))
+        try:
+            await asyncio.sleep(0.2)  # wait for the subscription
+            self.assertFalse(await is_token_revoked(token, self.r))
+            await revoke_token(token, self.r)
+            self.assertTrue(await is_token_revoked(token, self.r))
+            for _ in range(50):
+                if cache.get(token) is None:
+                    break
+                await asyncio.sleep(0.05)
+            self.assertIsNone(cache.get(token))
+        finally:
+            listener.cancel()
+
+
 if __name__ == "__main__":
     unittest.main()